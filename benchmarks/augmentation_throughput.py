@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "models"))
+from batch_augment import BatchAugment
+
+# ---------------------------
+# Settings
+# ---------------------------
+# HAM10000 originals, and the output size/normalization of each training script
+SOURCE_SIZE = (600, 450)
+MODELS = {
+    "resnet50": (224, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    "irv2": (299, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+}
+BATCH_SIZES = [16, 64]
+WARMUP_ITERS = 2
+
+def albumentations_pipeline(size, mean, std):
+    # train_transform of resnet50.py / IRv2.py
+    return A.Compose([
+        A.HorizontalFlip(),
+        A.VerticalFlip(),
+        A.RandomRotate90(),
+        A.ShiftScaleRotate(shift_limit=0.1, scale_limit=0.1, rotate_limit=180, p=0.5),
+        A.RandomBrightnessContrast(p=0.2),
+        A.HueSaturationValue(p=0.2),
+        A.Resize(size, size),
+        A.Normalize(mean=mean, std=std),
+        ToTensorV2(),
+    ])
+
+def load_images(batch_size, image_dir=None):
+    width, height = SOURCE_SIZE
+    if image_dir:
+        names = sorted(f for f in os.listdir(image_dir) if f.lower().endswith((".jpg", ".png")))[:batch_size]
+        images = [np.array(Image.open(os.path.join(image_dir, f)).convert("RGB").resize(SOURCE_SIZE)) for f in names]
+        if len(images) == batch_size:
+            return np.stack(images)
+    # Smooth random colour fields, so the HSV and resample work resembles real photos
+    rng = np.random.default_rng(0)
+    coarse = rng.integers(60, 230, size=(batch_size, height // 50, width // 50, 3), dtype=np.uint8)
+    return np.stack([np.array(Image.fromarray(c).resize(SOURCE_SIZE, Image.BICUBIC)) for c in coarse])
+
+# ---------------------------
+# Timing
+# ---------------------------
+def time_ms(fn, iters, device):
+    for _ in range(WARMUP_ITERS):
+        fn()
+    timings = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-sample albumentations vs batched (BatchAugment) training augmentation.")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=sorted(MODELS))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--image-dir", default=None, help="Folder of real images (e.g. HAM10000/HAM10000_images).")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    devices = [torch.device("cpu")] + ([torch.device("cuda")] if torch.cuda.is_available() else [])
+    # Same seed twice gives the same batch: the augmentation is reproducible
+    sample = torch.from_numpy(load_images(4, args.image_dir))
+    deterministic = torch.equal(BatchAugment(224, *MODELS["resnet50"][1:], seed=0)(sample),
+                                BatchAugment(224, *MODELS["resnet50"][1:], seed=0)(sample))
+    print(f"Deterministic with a fixed seed: {deterministic}; torch threads: {torch.get_num_threads()}\n")
+
+    results = []
+    print(f"{'model':>9} {'pipeline':>16} {'batch':>6} {'ms/batch':>9} {'img/s':>8} {'speedup':>8}")
+    for name in args.models:
+        size, mean, std = MODELS[name]
+        transform = albumentations_pipeline(size, mean, std)
+        for batch_size in args.batch_sizes:
+            images = load_images(batch_size, args.image_dir)
+            # Per-sample path: what the DataLoader does in __getitem__ + collate
+            rows = [("albumentations", torch.device("cpu"),
+                     lambda: torch.stack([transform(image=image)["image"] for image in images]))]
+            for device in devices:
+                augment = BatchAugment(size, mean, std, seed=0)
+                batch = torch.from_numpy(images)
+                # Includes the uint8 host-to-device copy the training loop does
+                rows.append((f"batched ({device.type})", device, lambda a=augment, d=device: a(batch.to(d))))
+
+            baseline = None
+            for pipeline, device, fn in rows:
+                ms = time_ms(fn, args.iters, device)
+                baseline = baseline or ms
+                r = {"model": name, "pipeline": pipeline, "batch_size": batch_size, "ms_per_batch": ms,
+                     "images_per_sec": batch_size / ms * 1000, "speedup": baseline / ms}
+                results.append(r)
+                print(f"{name:>9} {pipeline:>16} {batch_size:>6} {ms:>9.1f} {r['images_per_sec']:>8.1f} {r['speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"deterministic": deterministic, "torch_threads": torch.get_num_threads(), "results": results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, TensorDataset
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "models")))
+from training import train_one_epoch
+from distributed import DistributedResumableSampler, all_reduce_sum, cleanup_distributed, setup_distributed, wrap_model
+from gradient_accumulation import IMAGE_SIZES, NUM_CLASSES, build_model, class_weights
+
+# ---------------------------
+# Settings
+# ---------------------------
+PROCESS_COUNTS = [1, 2, 4, 8]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+# ---------------------------
+# Worker
+# ---------------------------
+def worker(rank, world_size, port, model_name, batch_size, steps, results):
+    # Same environment torchrun would provide, so the training scripts' code path is exercised
+    os.environ.update({
+        "RANK": str(rank), "LOCAL_RANK": str(rank), "WORLD_SIZE": str(world_size),
+        "LOCAL_WORLD_SIZE": str(world_size), "MASTER_ADDR": "127.0.0.1", "MASTER_PORT": str(port),
+    })
+    setup_distributed()
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    torch.manual_seed(0)
+
+    # Fixed per-process batch (weak scaling): every process trains `steps` batches of `batch_size`
+    size = IMAGE_SIZES[model_name]
+    num_samples = batch_size * (steps + 1) * world_size
+    generator = torch.Generator().manual_seed(0)
+    dataset = TensorDataset(torch.randn(num_samples, 3, size, size, generator=generator),
+                            torch.randint(0, NUM_CLASSES, (num_samples,), generator=generator))
+    sampler = DistributedResumableSampler(dataset, seed=0)
+    loader = DataLoader(dataset, batch_size=batch_size, sampler=sampler)
+
+    model = wrap_model(build_model(model_name))
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    criterion = nn.CrossEntropyLoss(weight=class_weights())
+
+    # Warm up on the first batch, then time the rest
+    sampler.set_epoch(0)
+    train_one_epoch(model, [next(iter(loader))], optimizer, criterion, "cpu")
+    sampler.set_epoch(0, position=batch_size)
+    _, throughput = train_one_epoch(model, loader, optimizer, criterion, "cpu")
+    samples_per_sec, = all_reduce_sum([throughput["images_per_sec"]])
+    if rank == 0:
+        results.put({"processes": world_size, "samples_per_sec": samples_per_sec, "peak_rss_mb": throughput["peak_memory_mb"]})
+    cleanup_distributed()
+
+def main():
+    parser = argparse.ArgumentParser(description="Samples/sec of DDP (gloo) CPU training at several process counts.")
+    parser.add_argument("--model", choices=sorted(IMAGE_SIZES), default="inception_resnet_v2")
+    parser.add_argument("--processes", type=int, nargs="+", default=PROCESS_COUNTS)
+    parser.add_argument("--batch-size", type=int, default=8, help="Per-process batch size.")
+    parser.add_argument("--steps", type=int, default=5, help="Timed steps per process.")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    context = mp.get_context("spawn")
+    results = []
+    for world_size in args.processes:
+        queue = context.SimpleQueue()
+        mp.spawn(worker, args=(world_size, free_port(), args.model, args.batch_size, args.steps, queue), nprocs=world_size)
+        results.append(queue.get())
+
+    baseline = results[0]["samples_per_sec"] / results[0]["processes"]
+    print(f"\n{args.model}, {args.batch_size} samples/process/step, {os.cpu_count()} cores")
+    print(f"{'procs':>6} {'samples/s':>10} {'speedup':>8} {'efficiency':>11} {'rank0 RSS MB':>13}")
+    for r in results:
+        speedup = r["samples_per_sec"] / (baseline * results[0]["processes"])
+        efficiency = r["samples_per_sec"] / (baseline * r["processes"])
+        print(f"{r['processes']:>6} {r['samples_per_sec']:>10.1f} {speedup:>7.2f}x {efficiency:>10.0%} {r['peak_rss_mb']:>13.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+from PIL import Image
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "vertex"))
+from serving_model import InceptionResNetV2_SoftAttention
+from explain import explain_batch
+
+# ---------------------------
+# Settings
+# ---------------------------
+IMG_SIZE = 299
+NUM_CLASSES = 7
+WARMUP_ITERS = 2
+# Explanations are rendered at the (capped) size of the uploaded photo
+IMAGE_SIZES = {"256px": (256, 256), "12mp": (4000, 3000)}
+
+# ---------------------------
+# Timing
+# ---------------------------
+def time_ms(fn, iters):
+    for _ in range(WARMUP_ITERS):
+        fn()
+    timings = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+def main():
+    parser = argparse.ArgumentParser(description="Added latency of /predict explanations (SoftAttention heatmaps).")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    # The serving architecture of vertex/app.py, random weights
+    model = InceptionResNetV2_SoftAttention(num_classes=NUM_CLASSES, img_size=IMG_SIZE).to(device).eval()
+    rng = np.random.default_rng(0)
+
+    results = []
+    print(f"{'mode':>10} {'photo':>6} {'batch':>6} {'p50 ms':>9} {'p95 ms':>9} {'added ms':>9}")
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, 3, IMG_SIZE, IMG_SIZE, device=device)
+        with torch.no_grad():
+            # "off" is the flag-off path of app.py; "maps" only also returns the attention tensor
+            off = time_ms(lambda: model(x), args.iters)
+            maps = time_ms(lambda: model(x, return_attention=True), args.iters)
+            _, attn_maps = model(x, return_attention=True)
+        rows = [("off", "-", off), ("maps", "-", maps)]
+        for photo, (width, height) in IMAGE_SIZES.items():
+            # Noise photos are the worst case for PNG compression
+            images = [Image.fromarray(rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)) for _ in range(batch_size)]
+            for fmt in ("png", "rle"):
+                render = time_ms(lambda: explain_batch(images, attn_maps, fmt), args.iters)
+                rows.append((fmt, photo, (maps[0] + render[0], maps[1] + render[1])))
+        for mode, photo, (p50, p95) in rows:
+            r = {"mode": mode, "photo": photo, "batch_size": batch_size, "p50_ms": p50, "p95_ms": p95, "added_ms": p50 - off[0]}
+            results.append(r)
+            print(f"{mode:>10} {photo:>6} {batch_size:>6} {p50:>9.1f} {p95:>9.1f} {r['added_ms']:>+9.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
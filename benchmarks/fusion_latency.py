@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "vertex"))
+from fusion_engine import BRANCHES, FUSION_IMG_SIZE, FusionEngine, load_engine
+
+# ---------------------------
+# Settings
+# ---------------------------
+BATCH_SIZES = [1, 8]
+WARMUP_ITERS = 2
+
+def modes(early_exit_threshold, with_exit):
+    cores = os.cpu_count() or 1
+    # Sequential gives every op all cores; concurrent splits them between the branches
+    # so the three intra-op pools do not oversubscribe the CPU
+    branch_threads = max(1, cores // len(BRANCHES))
+    configs = [
+        ("sequential", cores, {"concurrent": False}),
+        ("concurrent", branch_threads, {"concurrent": True}),
+    ]
+    if with_exit:
+        configs += [
+            ("sequential+exit", cores, {"concurrent": False, "early_exit_threshold": early_exit_threshold}),
+            ("concurrent+exit", branch_threads, {"concurrent": True, "early_exit_threshold": early_exit_threshold}),
+        ]
+    return configs
+
+def time_infer(engine, x, iters, **kwargs):
+    for _ in range(WARMUP_ITERS):
+        engine.infer(x, **kwargs)
+    timings, exits = [], 0
+    for _ in range(iters):
+        start = time.perf_counter()
+        result = engine.infer(x, **kwargs)
+        timings.append((time.perf_counter() - start) * 1000)
+        exits += result["exited_branch"] is not None
+    return {"p50_ms": float(np.percentile(timings, 50)), "p95_ms": float(np.percentile(timings, 95)), "exit_rate": exits / iters}
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency of sequential vs concurrent fusion-branch execution.")
+    parser.add_argument("--checkpoint", default=None, help="Fusion checkpoint (random weights if omitted).")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--early-exit-threshold", type=float, default=0.9, help="Only used if the checkpoint has fitted branch heads.")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    engine = load_engine(args.checkpoint, device) if args.checkpoint else FusionEngine().to(device).eval()
+
+    results = []
+    print(f"{'mode':>16} {'batch':>6} {'threads':>8} {'p50 ms':>9} {'p95 ms':>9} {'exit rate':>10} {'speedup':>8}")
+    for batch_size in args.batch_sizes:
+        x = torch.randn(batch_size, 3, FUSION_IMG_SIZE, FUSION_IMG_SIZE, device=device)
+        baseline = None
+        for name, threads, kwargs in modes(args.early_exit_threshold, bool(engine.branch_heads_fitted)):
+            torch.set_num_threads(threads)
+            r = {"mode": name, "batch_size": batch_size, "threads": threads, **time_infer(engine, x, args.iters, **kwargs)}
+            baseline = baseline or r["p50_ms"]
+            r["speedup"] = baseline / r["p50_ms"]
+            results.append(r)
+            print(f"{name:>16} {batch_size:>6} {threads:>8} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['exit_rate']:>9.0%} {r['speedup']:>7.2f}x")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import os
+import sys
+import json
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+import torch.nn as nn
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "models")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "vertex")))
+from training import CHECKPOINT_BLOCKS, batch_normalizer, enable_activation_checkpointing, summed_loss, train_one_epoch
+
+# ---------------------------
+# Settings
+# ---------------------------
+NUM_CLASSES = 7
+IMAGE_SIZES = {"inception_resnet_v2": 299, "resnet50": 224}
+MICRO_BATCH_SIZES = [32, 16, 8, 4]
+
+def build_model(name):
+    if name == "inception_resnet_v2":
+        # The architecture IRv2.py trains and vertex/app.py serves
+        from serving_model import InceptionResNetV2_SoftAttention
+        return InceptionResNetV2_SoftAttention(num_classes=NUM_CLASSES, img_size=IMAGE_SIZES[name])
+    from torchvision.models import resnet50
+    backbone = nn.Sequential(*list(resnet50(weights=None).children())[:-2])
+    head = nn.Sequential(nn.AdaptiveAvgPool2d((1, 1)), nn.Flatten(), nn.Linear(2048, NUM_CLASSES))
+    return nn.Sequential(backbone, head)
+
+def synthetic_batches(name, num_samples, micro_batch_size, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    size = IMAGE_SIZES[name]
+    images = torch.randn(num_samples, 3, size, size, generator=generator)
+    labels = torch.randint(0, NUM_CLASSES, (num_samples,), generator=generator)
+    return [(images[i:i + micro_batch_size], labels[i:i + micro_batch_size]) for i in range(0, num_samples, micro_batch_size)]
+
+def class_weights():
+    return torch.linspace(0.5, 3.0, NUM_CLASSES)
+
+# ---------------------------
+# Loss Parity
+# ---------------------------
+def check_parity(name, device, batch_size=8, micro_batch_size=2, atol=1e-4):
+    # Gradients of the weighted CE on the full batch vs. the same batch accumulated in micro-batches
+    # the way train_one_epoch does. Eval mode keeps BatchNorm on running stats so the two are comparable.
+    torch.manual_seed(0)
+    model = build_model(name).to(device).eval()
+    weight = class_weights().to(device)
+    criterion = nn.CrossEntropyLoss(weight=weight)
+    (images, labels), = synthetic_batches(name, batch_size, batch_size)
+
+    model.zero_grad()
+    criterion(model(images.to(device)), labels.to(device)).backward()
+    expected = [p.grad.clone() for p in model.parameters()]
+
+    model.zero_grad()
+    normalizer = batch_normalizer(criterion, labels)
+    for micro_images, micro_labels in synthetic_batches(name, batch_size, micro_batch_size):
+        (summed_loss(criterion, model(micro_images.to(device)), micro_labels.to(device)) / normalizer).backward()
+    max_diff = max((p.grad - g).abs().max().item() for p, g in zip(model.parameters(), expected))
+    if max_diff > atol:
+        raise AssertionError(f"Accumulated gradients diverge from the large-batch gradients: max abs diff {max_diff:.2e}")
+    print(f"Loss/gradient parity OK for {name} (max abs diff {max_diff:.2e})")
+
+# ---------------------------
+# Throughput & Memory
+# ---------------------------
+def run_config(name, device, effective_batch_size, micro_batch_size, checkpointing, steps):
+    torch.manual_seed(0)
+    model = build_model(name).to(device)
+    if checkpointing:
+        enable_activation_checkpointing(model, CHECKPOINT_BLOCKS[name])
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    criterion = nn.CrossEntropyLoss(weight=class_weights().to(device))
+    accumulation_steps = effective_batch_size // micro_batch_size
+
+    # One warmup step, then the timed steps
+    train_one_epoch(model, synthetic_batches(name, effective_batch_size, micro_batch_size), optimizer, criterion, device,
+                    accumulation_steps=accumulation_steps)
+    _, throughput = train_one_epoch(model, synthetic_batches(name, effective_batch_size * steps, micro_batch_size, seed=1),
+                                    optimizer, criterion, device, accumulation_steps=accumulation_steps)
+    return {
+        "model": name,
+        "effective_batch_size": effective_batch_size,
+        "micro_batch_size": micro_batch_size,
+        "accumulation_steps": accumulation_steps,
+        "activation_checkpointing": checkpointing,
+        **throughput,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and peak memory of gradient accumulation / activation checkpointing configurations.")
+    parser.add_argument("--model", choices=sorted(IMAGE_SIZES), default="inception_resnet_v2")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--effective-batch-size", type=int, default=64)
+    parser.add_argument("--micro-batch-sizes", type=int, nargs="+", default=MICRO_BATCH_SIZES)
+    parser.add_argument("--steps", type=int, default=3, help="Timed optimizer steps per configuration.")
+    parser.add_argument("--output", default=None, help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    check_parity(args.model, args.device)
+
+    configs = [(micro, checkpointing) for micro in args.micro_batch_sizes if args.effective_batch_size % micro == 0
+               for checkpointing in (False, True)]
+    results = []
+    # A fresh process per configuration, so peak memory (RSS on CPU) is not carried over between runs
+    context = multiprocessing.get_context("spawn")
+    for micro, checkpointing in configs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_config, args.model, args.device, args.effective_batch_size,
+                                           micro, checkpointing, args.steps).result())
+
+    print(f"\n{args.model} on {args.device}, effective batch {args.effective_batch_size}")
+    print(f"{'micro':>6} {'accum':>6} {'ckpt':>5} {'img/s':>9} {'peak MB':>9}")
+    for r in results:
+        print(f"{r['micro_batch_size']:>6} {r['accumulation_steps']:>6} {'yes' if r['activation_checkpointing'] else 'no':>5} "
+              f"{r['images_per_sec']:>9.1f} {r['peak_memory_mb']:>9.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,338 @@
+import os
+import io
+import sys
+import json
+import time
+import base64
+import socket
+import platform
+import argparse
+import threading
+import subprocess
+import urllib.request
+from contextlib import nullcontext, redirect_stdout
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import numpy as np
+from PIL import Image
+
+VERTEX_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "vertex"))
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# ---------------------------
+# Settings
+# ---------------------------
+# Processed dataset images are 256x256; phone cameras upload ~12MP JPEGs
+IMAGE_SIZES = {"256px": (256, 256), "12mp": (4000, 3000)}
+CONCURRENCY_LEVELS = [1, 4, 16]
+BACKENDS = ["direct", "inprocess", "flask", "gunicorn"]
+
+# ---------------------------
+# Payloads
+# ---------------------------
+def synthetic_jpeg(width, height, seed=0, quality=90):
+    # Smooth colour field plus mild noise, so JPEG size and decode cost resemble a skin photo
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(90, 230, size=(height // 250 + 2, width // 250 + 2, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    pixels = np.asarray(image, dtype=np.int16) + rng.integers(-8, 9, size=(height, width, 3), dtype=np.int16)
+    buffer = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+def load_payloads(image_dir=None):
+    # One request body per image size; real photos from --image-dir replace the synthetic ones
+    payloads = {}
+    for name, (width, height) in IMAGE_SIZES.items():
+        jpeg = synthetic_jpeg(width, height)
+        if image_dir:
+            path = os.path.join(image_dir, f"{name}.jpg")
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    jpeg = f.read()
+        payloads[name] = {"instances": [{"image": base64.b64encode(jpeg).decode("ascii")}]}
+    return payloads
+
+# ---------------------------
+# Memory
+# ---------------------------
+def proc_status_kb(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+def child_pids(pid):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task") if os.path.isdir(f"/proc/{pid}/task") else []:
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+def tree_rss_mb(pid):
+    # RSS of a process and all its descendants (gunicorn master + workers)
+    pids, total = [pid], 0
+    while pids:
+        current = pids.pop()
+        total += proc_status_kb(current, "VmRSS")
+        pids.extend(child_pids(current))
+    return total / 1024
+
+class RSSSampler:
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, tree_rss_mb(self.pid))
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, tree_rss_mb(self.pid))
+
+# ---------------------------
+# Backends
+# ---------------------------
+# Each backend exposes send(payload) -> bool and the pid whose memory is reported.
+class DirectBackend:
+    # decode_image + predict without Flask: the model/preprocessing floor
+    def __init__(self, app_module):
+        self.app = app_module
+        self.pid = os.getpid()
+
+    def send(self, payload):
+        self.app.predict(self.app.decode_image(payload["instances"][0]["image"]))
+        return True
+
+    def close(self):
+        pass
+
+class InProcessBackend:
+    # Full /predict handler (JSON parsing, routing, response) through Flask's test client
+    def __init__(self, app_module):
+        self.client = app_module.app.test_client()
+        self.pid = os.getpid()
+
+    def send(self, payload):
+        return self.client.post("/predict", json=payload).status_code == 200
+
+    def close(self):
+        pass
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class HTTPBackend:
+    # Talks to a server over a real socket: an external --url or one launched here
+    def __init__(self, url=None, server=None, workers=1, threads=1, timeout=300):
+        self.process = None
+        if url is None:
+            port = free_port()
+            if server == "gunicorn":
+                command = ["gunicorn", "-b", f"127.0.0.1:{port}", "-w", str(workers), "--threads", str(threads),
+                           "--timeout", str(timeout), "app:app"]
+            else:
+                command = [sys.executable, "-c", f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+            # Server logs (including the payload echo in /predict) are discarded
+            self.process = subprocess.Popen(command, cwd=VERTEX_PATH, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            url = f"http://127.0.0.1:{port}"
+            self.wait_ready(url, timeout)
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.pid = self.process.pid if self.process else None
+        self.bodies = {}
+
+    def wait_ready(self, url, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode} before becoming ready")
+            try:
+                with urllib.request.urlopen(f"{url}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return
+            except OSError:
+                time.sleep(0.5)
+        raise RuntimeError(f"Server at {url} not ready after {timeout}s")
+
+    def send(self, payload):
+        # Serialize each payload once so client-side JSON encoding stays out of the latency
+        body = self.bodies.get(id(payload))
+        if body is None:
+            body = self.bodies[id(payload)] = json.dumps(payload).encode()
+        request = urllib.request.Request(f"{self.url}/predict", data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status == 200
+        except OSError:
+            return False
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=30)
+
+def import_app():
+    # app.py loads its checkpoint and index relative to vertex/
+    os.chdir(VERTEX_PATH)
+    sys.path.insert(0, VERTEX_PATH)
+    with redirect_stdout(io.StringIO()):
+        import app
+    return app
+
+# ---------------------------
+# Load Generator
+# ---------------------------
+def run_load(backend, payload, concurrency, num_requests, warmup=2):
+    # Closed loop: `concurrency` clients each send their next request as soon as the previous returns
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        for _ in range(warmup):
+            backend.send(payload)
+
+    latencies = np.zeros(num_requests)
+    ok = np.zeros(num_requests, dtype=bool)
+    counter = iter(range(num_requests))
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            ok[i] = backend.send(payload)
+            latencies[i] = (time.perf_counter() - start) * 1000
+
+    sampler = RSSSampler(backend.pid) if backend.pid else None
+    start = time.perf_counter()
+    # /predict echoes the payload to stdout; discard it rather than buffer it (it would inflate RSS)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), (sampler or nullcontext()):
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(client) for _ in range(concurrency)]:
+                future.result()
+    elapsed = time.perf_counter() - start
+
+    completed = latencies[ok]
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": int((~ok).sum()),
+        "p50_ms": float(np.percentile(completed, 50)) if len(completed) else None,
+        "p95_ms": float(np.percentile(completed, 95)) if len(completed) else None,
+        "p99_ms": float(np.percentile(completed, 99)) if len(completed) else None,
+        "mean_ms": float(completed.mean()) if len(completed) else None,
+        "throughput_rps": len(completed) / elapsed,
+        "peak_rss_mb": sampler.peak if sampler else None,
+    }
+
+# ---------------------------
+# Reporting
+# ---------------------------
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=VERTEX_PATH, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def result_key(r):
+    return (r["backend"], r["image"], r["concurrency"])
+
+def print_results(results, baseline=None):
+    previous = {result_key(r): r for r in baseline["results"]} if baseline else {}
+    print(f"{'backend':>10} {'image':>6} {'conc':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>8} {'RSS MB':>8} {'err':>4}"
+          + (f" {'p95 vs base':>12} {'req/s vs base':>14}" if previous else ""))
+    for r in results:
+        fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+        line = (f"{r['backend']:>10} {r['image']:>6} {r['concurrency']:>5} {fmt(r['p50_ms'], '9.1f')} {fmt(r['p95_ms'], '9.1f')} "
+                f"{fmt(r['p99_ms'], '9.1f')} {r['throughput_rps']:>8.2f} {fmt(r['peak_rss_mb'], '8.0f')} {r['errors']:>4}")
+        old = previous.get(result_key(r))
+        if old and old["p95_ms"] and r["p95_ms"]:
+            line += f" {r['p95_ms'] / old['p95_ms']:>11.2f}x {r['throughput_rps'] / old['throughput_rps']:>13.2f}x"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency/throughput/RSS benchmark of the vertex/app.py serving stack.")
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["direct", "inprocess", "gunicorn"])
+    parser.add_argument("--images", nargs="+", choices=sorted(IMAGE_SIZES), default=sorted(IMAGE_SIZES))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--requests", type=int, default=50, help="Requests per (backend, image, concurrency) run.")
+    parser.add_argument("--gunicorn-workers", type=int, default=1)
+    parser.add_argument("--gunicorn-threads", type=int, default=4)
+    parser.add_argument("--url", default=None, help="Benchmark an already running server instead of launching one (backend 'http').")
+    parser.add_argument("--image-dir", default=None, help="Folder with real 256px.jpg / 12mp.jpg samples.")
+    parser.add_argument("--output", default=None, help="JSON results file (default: benchmarks/results/serving_<commit>.json).")
+    parser.add_argument("--compare", default=None, help="Previous JSON results to diff against.")
+    args = parser.parse_args()
+    # import_app() changes into vertex/, so resolve user paths first
+    output = os.path.abspath(args.output or os.path.join(RESULTS_FOLDER, f"serving_{git_commit()}.json"))
+    compare = os.path.abspath(args.compare) if args.compare else None
+    image_dir = os.path.abspath(args.image_dir) if args.image_dir else None
+
+    payloads = load_payloads(image_dir)
+    backends = ["http"] if args.url else args.backends
+    app_module = import_app() if {"direct", "inprocess"} & set(backends) else None
+
+    results = []
+    for backend_name in backends:
+        if backend_name == "direct":
+            backend = DirectBackend(app_module)
+        elif backend_name == "inprocess":
+            backend = InProcessBackend(app_module)
+        else:
+            backend = HTTPBackend(url=args.url, server=backend_name, workers=args.gunicorn_workers, threads=args.gunicorn_threads)
+        try:
+            for image in args.images:
+                for concurrency in args.concurrency:
+                    result = run_load(backend, payloads[image], concurrency, args.requests)
+                    results.append({"backend": backend_name, "image": image, **result})
+                    print(f"{backend_name} {image} x{concurrency}: p95 {result['p95_ms']} ms, {result['throughput_rps']:.2f} req/s")
+        finally:
+            backend.close()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "requests_per_run": args.requests,
+            "gunicorn_workers": args.gunicorn_workers,
+            "gunicorn_threads": args.gunicorn_threads,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+    print()
+    print_results(results, baseline)
+    print(f"\nResults saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "vertex")))
+from soft_attention import SoftAttention, SoftAttention2d
+
+# ---------------------------
+# Settings
+# ---------------------------
+CHANNELS = 1536
+HEADS = 16
+FEATURE_SIZE = 8  # Inception-ResNet-v2 feature map for 299x299 inputs
+BATCH_SIZES = [1, 8, 32]
+
+def check_parity(conv3d_module, conv2d_module, batch_size=4, atol=1e-5):
+    x = torch.randn(batch_size, CHANNELS, FEATURE_SIZE, FEATURE_SIZE)
+    with torch.no_grad():
+        expected = conv3d_module(x)
+        actual = conv2d_module(x)
+    max_diff = (expected - actual).abs().max().item()
+    if not torch.allclose(expected, actual, atol=atol, rtol=1e-4):
+        raise AssertionError(f"SoftAttention2d diverges from SoftAttention: max abs diff {max_diff:.2e}")
+    print(f"Parity OK (max abs diff {max_diff:.2e})")
+
+def time_module(module, batch_size, warmup=5, iters=30):
+    x = torch.randn(batch_size, CHANNELS, FEATURE_SIZE, FEATURE_SIZE)
+    with torch.no_grad():
+        for _ in range(warmup):
+            module(x)
+        timings = []
+        for _ in range(iters):
+            start = time.perf_counter()
+            module(x)
+            timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+def main():
+    parser = argparse.ArgumentParser(description="Parity check and CPU latency of SoftAttention (Conv3d) vs SoftAttention2d.")
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--iters", type=int, default=30)
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    torch.manual_seed(0)
+    conv3d_module = SoftAttention(CHANNELS, heads=HEADS).eval()
+    conv2d_module = SoftAttention2d.from_conv3d(conv3d_module).eval()
+    check_parity(conv3d_module, conv2d_module)
+
+    print(f"\nCPU latency ({torch.get_num_threads()} threads, median of {args.iters} runs)")
+    print(f"{'batch':>6} {'Conv3d (ms)':>12} {'Conv2d (ms)':>12} {'speedup':>8}")
+    for batch_size in BATCH_SIZES:
+        t3d = time_module(conv3d_module, batch_size, iters=args.iters)
+        t2d = time_module(conv2d_module, batch_size, iters=args.iters)
+        print(f"{batch_size:>6} {t3d:>12.2f} {t2d:>12.2f} {t3d / t2d:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, WeightedRandomSampler
+from torch.profiler import ProfilerActivity, profile, schedule
+
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "models"))
+sys.path.append(os.path.join(BASE_PATH, "preprocessing"))
+sys.path.append(os.path.join(BASE_PATH, "vertex"))
+from training import peak_memory_mb
+
+HAM_FOLDER = os.path.join(BASE_PATH, "HAM10000")
+HAM_METADATA_FILE = os.path.join(HAM_FOLDER, "HAM10000_metadata")
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# ---------------------------
+# Settings
+# ---------------------------
+NUM_CLASSES = 7
+IMAGENET_MEAN, IMAGENET_STD = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+
+# Input pipeline and batch size of each training script
+ARCHITECTURES = {
+    "baseline": {"image_size": 256, "batch_size": 64, "images": "HAM10000_images_processed/rgb", "pipeline": "torchvision", "sampler": "shuffle"},
+    "cnn_with_weights": {"image_size": 256, "batch_size": 32, "images": "HAM10000_images_processed/rgb", "pipeline": "torchvision", "sampler": "weighted"},
+    "resnet50": {"image_size": 224, "batch_size": 16, "images": "HAM10000_images", "pipeline": "albumentations", "sampler": "oversample", "normalize": (IMAGENET_MEAN, IMAGENET_STD)},
+    "irv2": {"image_size": 299, "batch_size": 16, "images": "HAM10000_images", "pipeline": "albumentations", "sampler": "shuffle", "normalize": ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))},
+}
+DATASETS = ["synthetic", "real"]
+
+# ---------------------------
+# Models
+# ---------------------------
+class SkinLesionCNN(nn.Module):
+    # Same layers as models/baseline.py and models/cnn_with_weights.py
+    def __init__(self, num_classes=NUM_CLASSES):
+        super(SkinLesionCNN, self).__init__()
+        self.conv1 = nn.Conv2d(3, 32, kernel_size=3, stride=1, padding=1)
+        self.conv2 = nn.Conv2d(32, 64, kernel_size=3, stride=1, padding=1)
+        self.conv3 = nn.Conv2d(64, 128, kernel_size=3, stride=1, padding=1)
+        self.pool = nn.MaxPool2d(kernel_size=2, stride=2)
+        self.fc1 = nn.Linear(128 * 32 * 32, 512)
+        self.fc2 = nn.Linear(512, 256)
+        self.fc3 = nn.Linear(256, num_classes)
+        self.dropout = nn.Dropout(0.5)
+        self.relu = nn.ReLU()
+
+    def forward(self, x):
+        x = self.pool(self.relu(self.conv1(x)))
+        x = self.pool(self.relu(self.conv2(x)))
+        x = self.pool(self.relu(self.conv3(x)))
+        x = x.view(-1, 128 * 32 * 32)
+        x = self.relu(self.fc1(x))
+        x = self.dropout(x)
+        x = self.relu(self.fc2(x))
+        x = self.dropout(x)
+        return self.fc3(x)
+
+def build_model(name):
+    if name in ("baseline", "cnn_with_weights"):
+        return SkinLesionCNN()
+    if name == "resnet50":
+        from torchvision.models import resnet50
+        backbone = nn.Sequential(*list(resnet50(weights=None).children())[:-2])
+        head = nn.Sequential(nn.AdaptiveAvgPool2d((1, 1)), nn.Flatten(), nn.Dropout(p=0.3), nn.Linear(2048, NUM_CLASSES))
+        return nn.Sequential(backbone, head)
+    # The serving architecture of vertex/app.py (Inception-ResNet-v2 + SoftAttention head)
+    from serving_model import InceptionResNetV2_SoftAttention
+    return InceptionResNetV2_SoftAttention(num_classes=NUM_CLASSES, img_size=ARCHITECTURES["irv2"]["image_size"])
+
+# ---------------------------
+# Data
+# ---------------------------
+class SyntheticDataset(Dataset):
+    # Pre-generated tensors: no decode or augmentation cost, isolates the model
+    def __init__(self, num_samples, image_size, seed=0):
+        generator = torch.Generator().manual_seed(seed)
+        self.images = torch.randn(num_samples, 3, image_size, image_size, generator=generator)
+        self.labels = torch.randint(0, NUM_CLASSES, (num_samples,), generator=generator)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return self.images[idx], self.labels[idx]
+
+class ImageDataset(Dataset):
+    def __init__(self, image_paths, labels, transform, pipeline):
+        self.image_paths = image_paths
+        self.labels = labels
+        self.transform = transform
+        self.pipeline = pipeline
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        image = Image.open(self.image_paths[idx]).convert("RGB")
+        if self.pipeline == "albumentations":
+            image = self.transform(image=np.array(image))["image"].float()
+        else:
+            image = self.transform(image)
+        return image, torch.tensor(self.labels[idx], dtype=torch.long)
+
+def real_transform(spec):
+    # Training augmentations of the corresponding script
+    if spec["pipeline"] == "torchvision":
+        from torchvision import transforms
+        return transforms.Compose([
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomVerticalFlip(),
+            transforms.RandomRotation(20),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+        ])
+    import albumentations as A
+    from albumentations.pytorch import ToTensorV2
+    mean, std = spec["normalize"]
+    return A.Compose([
+        A.HorizontalFlip(),
+        A.VerticalFlip(),
+        A.RandomRotate90(),
+        A.ShiftScaleRotate(shift_limit=0.1, scale_limit=0.1, rotate_limit=180, p=0.5),
+        A.RandomBrightnessContrast(p=0.2),
+        A.HueSaturationValue(p=0.2),
+        A.Resize(spec["image_size"], spec["image_size"]),
+        A.Normalize(mean=mean, std=std),
+        ToTensorV2(),
+    ])
+
+def build_loader(name, dataset_kind, num_samples, num_workers):
+    spec = ARCHITECTURES[name]
+    if dataset_kind == "synthetic":
+        dataset = SyntheticDataset(num_samples, spec["image_size"])
+        return DataLoader(dataset, batch_size=spec["batch_size"], shuffle=True, num_workers=num_workers)
+
+    from metadata_store import load_metadata, paths_and_labels
+    metadata = load_metadata(HAM_METADATA_FILE, columns=["image_id", "dx"])
+    label_map = {label: idx for idx, label in enumerate(sorted(metadata["dx"].unique()))}
+    metadata = metadata.sample(n=min(num_samples, len(metadata)), random_state=42)
+    image_paths, labels = paths_and_labels(metadata, os.path.join(HAM_FOLDER, spec["images"]), label_map)
+    dataset = ImageDataset(image_paths, labels, real_transform(spec), spec["pipeline"])
+
+    if spec["sampler"] == "weighted":
+        weights = torch.tensor(1.0 / np.bincount(labels)[labels], dtype=torch.float)
+        sampler = WeightedRandomSampler(weights, num_samples=len(dataset), replacement=True)
+    elif spec["sampler"] == "oversample":
+        # Class-balanced index repetition as in resnet50.py, drawn by sample weights here
+        counts = np.bincount(labels)
+        multipliers = np.clip(4000 // counts, 1, 10)
+        sampler = WeightedRandomSampler(torch.tensor(multipliers[labels], dtype=torch.float), num_samples=len(dataset), replacement=True)
+    else:
+        return DataLoader(dataset, batch_size=spec["batch_size"], shuffle=True, num_workers=num_workers)
+    return DataLoader(dataset, batch_size=spec["batch_size"], sampler=sampler, num_workers=num_workers)
+
+# ---------------------------
+# Timed Steps
+# ---------------------------
+def synchronize(device):
+    if torch.device(device).type == "cuda":
+        torch.cuda.synchronize(device)
+
+def batches(loader):
+    while True:
+        yield from loader
+
+def train_step(model, optimizer, criterion, images, labels, device):
+    images, labels = images.to(device), labels.to(device)
+    optimizer.zero_grad()
+    loss = criterion(model(images), labels)
+    loss.backward()
+    optimizer.step()
+    synchronize(device)
+
+def run_benchmark(name, dataset_kind, device, steps, warmup, profile_steps, num_workers, trace_dir):
+    torch.manual_seed(0)
+    spec = ARCHITECTURES[name]
+    loader = build_loader(name, dataset_kind, num_samples=spec["batch_size"] * (steps + warmup + profile_steps + 2), num_workers=num_workers)
+    model = build_model(name).to(device).train()
+    optimizer = optim.Adam(model.parameters(), lr=1e-4)
+    criterion = nn.CrossEntropyLoss()
+    if torch.device(device).type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+
+    stream = batches(loader)
+    for _ in range(warmup):
+        images, labels = next(stream)
+        train_step(model, optimizer, criterion, images, labels, device)
+
+    # Data wait: blocked on the loader. Step: transfer + forward + backward + optimizer.
+    data_times, step_times, num_images = [], [], 0
+    for _ in range(steps):
+        start = time.perf_counter()
+        images, labels = next(stream)
+        loaded = time.perf_counter()
+        train_step(model, optimizer, criterion, images, labels, device)
+        done = time.perf_counter()
+        data_times.append(loaded - start)
+        step_times.append(done - loaded)
+        num_images += labels.size(0)
+
+    trace_path = None
+    if profile_steps:
+        # Profiled separately so the profiler's overhead does not skew the timings above
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if torch.device(device).type == "cuda" else [])
+        with profile(activities=activities, schedule=schedule(wait=0, warmup=1, active=profile_steps), record_shapes=True, profile_memory=True) as prof:
+            for _ in range(profile_steps + 1):
+                images, labels = next(stream)
+                train_step(model, optimizer, criterion, images, labels, device)
+                prof.step()
+        os.makedirs(trace_dir, exist_ok=True)
+        trace_path = os.path.join(trace_dir, f"{name}_{dataset_kind}.json")
+        prof.export_chrome_trace(trace_path)
+
+    total = sum(data_times) + sum(step_times)
+    return {
+        "model": name,
+        "dataset": dataset_kind,
+        "batch_size": spec["batch_size"],
+        "steps": steps,
+        "step_ms": 1000 * float(np.median(step_times)),
+        "data_wait_ms": 1000 * float(np.median(data_times)),
+        "data_wait_fraction": sum(data_times) / total,
+        "images_per_sec": num_images / total,
+        "peak_memory_mb": peak_memory_mb(device),
+        "trace": trace_path,
+    }
+
+# ---------------------------
+# Comparison Table
+# ---------------------------
+def print_table(results):
+    print(f"\n{'model':>17} {'data':>9} {'batch':>6} {'step ms':>9} {'wait ms':>9} {'wait %':>7} {'img/s':>8} {'peak MB':>8}")
+    for r in results:
+        print(f"{r['model']:>17} {r['dataset']:>9} {r['batch_size']:>6} {r['step_ms']:>9.1f} {r['data_wait_ms']:>9.1f} "
+              f"{100 * r['data_wait_fraction']:>6.1f}% {r['images_per_sec']:>8.1f} {r['peak_memory_mb']:>8.0f}")
+    # Real vs synthetic throughput shows how much the input pipeline costs each model
+    by_key = {(r["model"], r["dataset"]): r for r in results}
+    for name in dict.fromkeys(r["model"] for r in results):
+        real, synthetic = by_key.get((name, "real")), by_key.get((name, "synthetic"))
+        if real and synthetic:
+            bound = "input-bound" if real["data_wait_fraction"] > 0.5 else "compute-bound"
+            print(f"{name}: real data runs at {real['images_per_sec'] / synthetic['images_per_sec']:.0%} of synthetic ({bound})")
+
+def main():
+    parser = argparse.ArgumentParser(description="Training step time, data-wait time, throughput, peak memory and profiler traces per architecture.")
+    parser.add_argument("--models", nargs="+", choices=sorted(ARCHITECTURES), default=list(ARCHITECTURES))
+    parser.add_argument("--datasets", nargs="+", choices=DATASETS, default=DATASETS)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--profile-steps", type=int, default=3, help="Steps captured in the torch.profiler trace (0 disables it).")
+    parser.add_argument("--num-workers", type=int, default=0, help="DataLoader workers (the scripts use 0).")
+    parser.add_argument("--output", default=os.path.join(RESULTS_FOLDER, "training_throughput.json"))
+    args = parser.parse_args()
+
+    trace_dir = os.path.join(os.path.dirname(os.path.abspath(args.output)), "traces")
+    results = []
+    # A fresh process per run keeps peak memory and allocator state independent between runs
+    context = multiprocessing.get_context("spawn")
+    for name in args.models:
+        for dataset_kind in args.datasets:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_benchmark, name, dataset_kind, args.device, args.steps, args.warmup,
+                                         args.profile_steps, args.num_workers, trace_dir).result()
+            results.append(result)
+            print(f"{name}/{dataset_kind}: {result['images_per_sec']:.1f} img/s, data wait {100 * result['data_wait_fraction']:.0f}%")
+
+    print_table(results)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({"device": args.device, "num_workers": args.num_workers, "results": results}, f, indent=2)
+    print(f"\nResults saved to {args.output}, traces in {trace_dir}")
+
+if __name__ == "__main__":
+    main()
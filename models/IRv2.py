@@ -1,23 +1,43 @@
 import os
+import sys
+import argparse
 import numpy as np
-import pandas as pd
 import torch
 import torch.nn as nn
 import torch.optim as optim
-import seaborn as sns
-import matplotlib.pyplot as plt
 from PIL import Image
 from torch.utils.data import DataLoader, Dataset
-from sklearn.metrics import classification_report, confusion_matrix
-from sklearn.model_selection import train_test_split
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
-import timm
 
 # ---------------------------
 # Define Paths
 # ---------------------------
 BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "preprocessing"))
+sys.path.append(os.path.join(BASE_PATH, "vertex"))
+from metadata_store import GROUP_COLUMN, LEAK_COLUMN, LESION_COLUMN, load_metadata, paths_and_labels, train_val_split, without_leaks
+from evaluation import evaluate_model
+from serving_model import LABELS, InceptionResNetV2_SoftAttention
+from checkpointing import CheckpointManager
+from batch_augment import BatchAugment
+from training import CHECKPOINT_BLOCKS, enable_activation_checkpointing, fit
+from distributed import DistributedResumableSampler, cleanup_distributed, is_main_process, setup_distributed
+
+parser = argparse.ArgumentParser(description="Train Inception-ResNet-v2 + Soft Attention on HAM10000 and evaluate on ISIC2018.")
+parser.add_argument("--resume", action="store_true", help="Resume from the latest periodic checkpoint.")
+parser.add_argument("--checkpoint-dir", default="checkpoints/irv2")
+parser.add_argument("--save-every", type=int, default=500, help="Save a resumable checkpoint every N steps.")
+parser.add_argument("--keep", type=int, default=3, help="Number of periodic checkpoints to keep.")
+parser.add_argument("--effective-batch-size", type=int, default=None, help="Samples per optimizer step (default: BATCH_SIZE).")
+parser.add_argument("--micro-batch-size", type=int, default=None, help="Samples per forward/backward pass (default: BATCH_SIZE).")
+parser.add_argument("--activation-checkpointing", action="store_true", help="Recompute Block35/17/8 activations in backward.")
+parser.add_argument("--batch-augment", action="store_true", help="Augment whole uint8 batches on the device (batch_augment.py) instead of per sample.")
+args = parser.parse_args()
+
+# Multi-process data parallel when launched with torchrun (gloo, CPU nodes), single process otherwise
+rank, world_size = setup_distributed()
+DEVICE = "cuda" if torch.cuda.is_available() and world_size == 1 else "cpu"
 
 HAM_FOLDER = os.path.join(BASE_PATH, "HAM10000")
 HAM_IMAGES_FOLDER = os.path.join(HAM_FOLDER, "HAM10000_images")
@@ -27,6 +47,8 @@ ISIC_FOLDER = os.path.join(BASE_PATH, "ISIC2018")
 ISIC_IMAGES_FOLDER = os.path.join(ISIC_FOLDER, "ISIC2018_images")
 ISIC_METADATA_FILE = os.path.join(ISIC_FOLDER, "ISIC2018_metadata")
 
+EVAL_FOLDER = os.path.join(BASE_PATH, "plots", "evaluation")
+
 CHECKPOINT_PATH = "best_inception_resnetv2.pth"
 
 # ---------------------------
@@ -38,6 +60,14 @@ LEARNING_RATE = 1e-4
 DROPOUT_P = 0.3
 PATIENCE = 10  
 TARGET_SAMPLES_PER_CLASS = 4000  
+SEED = 42
+
+# The effective batch is global: micro-batch x accumulation steps x processes
+MICRO_BATCH_SIZE = args.micro_batch_size or BATCH_SIZE
+EFFECTIVE_BATCH_SIZE = args.effective_batch_size or MICRO_BATCH_SIZE * world_size
+if EFFECTIVE_BATCH_SIZE % (MICRO_BATCH_SIZE * world_size):
+    parser.error("--effective-batch-size must be a multiple of --micro-batch-size x number of processes")
+ACCUMULATION_STEPS = EFFECTIVE_BATCH_SIZE // (MICRO_BATCH_SIZE * world_size)
 
 # ---------------------------
 # Augmentation Strategy
@@ -60,117 +90,90 @@ test_transform = A.Compose([
     ToTensorV2(),
 ])
 
-# ---------------------------
-# Soft Attention Module
-# ---------------------------
-class SoftAttention(nn.Module):
-    def __init__(self, channels, multiheads=8, aggregate=True, concat_with_x=False):
-        super(SoftAttention, self).__init__()
-        self.multiheads = multiheads
-        self.aggregate = aggregate
-        self.concat_with_x = concat_with_x
-        self.conv3d = nn.Conv3d(in_channels=1, out_channels=multiheads, kernel_size=(3, 3, channels), padding=(1, 1, 0))
-        self.relu = nn.ReLU()
-        self.softmax = nn.Softmax(dim=-1)
-    
-    def forward(self, x):
-        b, c, h, w = x.shape
-        x_exp = x.unsqueeze(1)  # Add depth dimension for conv3d
-        attention_maps = self.conv3d(x_exp).squeeze(-1)  # Shape: (b, multiheads, h, w)
-        attention_maps = self.relu(attention_maps)
-        attention_maps = self.softmax(attention_maps.view(b, self.multiheads, -1))
-        attention_maps = attention_maps.view(b, self.multiheads, h, w)
-        
-        if self.aggregate:
-            attention_maps = attention_maps.sum(dim=1, keepdim=True)
-            x = x * attention_maps
-        else:
-            x = torch.cat([x, x * attention_maps], dim=1)
-        
-        return x
-
 # ---------------------------
 # Custom Dataset with Augmentation
 # ---------------------------
 class SkinLesionDataset(Dataset):
-    def __init__(self, metadata, images_folder, label_map, transform=None):
-        self.metadata = metadata
-        self.images_folder = images_folder
-        self.label_map = label_map
+    def __init__(self, image_paths, labels, transform=None):
+        self.image_paths = image_paths
+        self.labels = labels
         self.transform = transform
 
     def __len__(self):
-        return len(self.metadata)
+        return len(self.labels)
 
     def __getitem__(self, idx):
-        row = self.metadata.iloc[idx]
-        img_id = row["image_id"]
-        dx = row["dx"]
-        label = self.label_map[dx]
-
-        img_path = os.path.join(self.images_folder, f"{img_id}.jpg")
-        image = Image.open(img_path).convert("RGB")
+        image = Image.open(self.image_paths[idx]).convert("RGB")
         image = np.array(image)
 
         if self.transform:
             augmented = self.transform(image=image)
-            image = augmented["image"]
+            image = augmented["image"].float()
+        else:
+            # Decoded uint8, augmented per batch by BatchAugment (--batch-augment)
+            image = torch.from_numpy(image)
 
-        return image.float(), torch.tensor(label, dtype=torch.long)
+        return image, torch.tensor(self.labels[idx], dtype=torch.long)
 
 # ---------------------------
 # Load & Prepare Datasets
 # ---------------------------
-ham_metadata = pd.read_csv(HAM_METADATA_FILE)
-ham_classes = sorted(ham_metadata["dx"].unique())
+ham_metadata = load_metadata(HAM_METADATA_FILE, columns=["image_id", "dx"], optional=[GROUP_COLUMN, LESION_COLUMN])
+# Class indices of the served checkpoints, so a trained model can be exported as-is
+ham_classes = LABELS
 label_map = {name: idx for idx, name in enumerate(ham_classes)}
 NUM_CLASSES = len(label_map)
 
-train_df, val_df = train_test_split(ham_metadata, test_size=0.10, stratify=ham_metadata["dx"])
+train_df, val_df = train_val_split(ham_metadata, test_size=0.10, seed=SEED)
 
 class_counts = train_df["dx"].value_counts().to_dict()
 total_samples = sum(class_counts.values())
 class_weights = {label_map[cls]: total_samples / (len(class_counts) * count) for cls, count in class_counts.items()}
-class_weights_tensor = torch.tensor(list(class_weights.values()), dtype=torch.float).to("cuda")
+# Indexed by class, not by value_counts() order
+class_weights_tensor = torch.tensor([class_weights[i] for i in range(NUM_CLASSES)], dtype=torch.float).to(DEVICE)
 
-train_dataset = SkinLesionDataset(train_df, HAM_IMAGES_FOLDER, label_map, transform=train_transform)
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
+# HAM10000 images are all 600x450, so decoded uint8 images collate into batches as they are
+batch_augment = BatchAugment(299, mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5), seed=SEED + rank) if args.batch_augment else None
+train_dataset = SkinLesionDataset(*paths_and_labels(train_df, HAM_IMAGES_FOLDER, label_map),
+                                  transform=None if args.batch_augment else train_transform)
+train_sampler = DistributedResumableSampler(train_dataset, seed=SEED)
+train_loader = DataLoader(train_dataset, batch_size=MICRO_BATCH_SIZE, sampler=train_sampler)
 
-val_dataset = SkinLesionDataset(val_df, HAM_IMAGES_FOLDER, label_map, transform=test_transform)
+val_dataset = SkinLesionDataset(*paths_and_labels(val_df, HAM_IMAGES_FOLDER, label_map), transform=test_transform)
 val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False)
 
-isic_metadata = pd.read_csv(ISIC_METADATA_FILE)
-test_dataset = SkinLesionDataset(isic_metadata, ISIC_IMAGES_FOLDER, label_map, transform=test_transform)
+isic_metadata = without_leaks(load_metadata(ISIC_METADATA_FILE, columns=["image_id", "dx"], optional=[LEAK_COLUMN]))
+test_dataset = SkinLesionDataset(*paths_and_labels(isic_metadata, ISIC_IMAGES_FOLDER, label_map), transform=test_transform)
 test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=False)
 
 # ---------------------------
 # Load Pretrained Inception-ResNet-v2 with Soft Attention
 # ---------------------------
-model = timm.create_model("inception_resnet_v2", pretrained=True, num_classes=NUM_CLASSES)
-model.global_pool = SoftAttention(channels=1536)
-model.to("cuda")
+# The served architecture (vertex/serving_model.py): SoftAttention, max pooling and a flat fc head
+model = InceptionResNetV2_SoftAttention(num_classes=NUM_CLASSES, dropout_p=DROPOUT_P, img_size=299, pretrained=True)
+model.to(DEVICE)
+if args.activation_checkpointing:
+    enable_activation_checkpointing(model, CHECKPOINT_BLOCKS["inception_resnet_v2"])
 
 optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
 criterion = nn.CrossEntropyLoss(weight=class_weights_tensor)
 
-def evaluate_model():
-    y_true, y_pred = [], []
-    with torch.no_grad():
-        for images, labels in test_loader:
-            images, labels = images.to("cuda"), labels.to("cuda")
-            outputs = model(images)
-            preds = outputs.argmax(dim=1)
-            y_true.extend(labels.cpu().numpy())
-            y_pred.extend(preds.cpu().numpy())
+# ---------------------------
+# Training with Checkpointing
+# ---------------------------
+checkpoints = CheckpointManager(args.checkpoint_dir, keep=args.keep, save_every=args.save_every)
+fit(model, optimizer, criterion, train_loader, val_loader, DEVICE, checkpoints, CHECKPOINT_PATH, NUM_EPOCHS, PATIENCE,
+    SEED, resume=args.resume, accumulation_steps=ACCUMULATION_STEPS, batch_augment=batch_augment)
+
+# ---------------------------
+# Evaluation on ISIC2018
+# ---------------------------
+if is_main_process():
+    model.load_state_dict(torch.load(CHECKPOINT_PATH))
 
+    evaluator = evaluate_model(model, test_loader, DEVICE, ham_classes)
     print("\n**Classification Report on ISIC2018:**")
-    print(classification_report(y_true, y_pred, target_names=ham_classes))
-    cm = confusion_matrix(y_true, y_pred)
-    plt.figure(figsize=(8, 6))
-    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=ham_classes, yticklabels=ham_classes)
-    plt.title("Confusion Matrix")
-    plt.xlabel("Predicted")
-    plt.ylabel("True")
-    plt.show()
-
-evaluate_model()
+    print(evaluator.report_text())
+    evaluator.save(EVAL_FOLDER, "irv2_isic2018").result()
+
+cleanup_distributed()
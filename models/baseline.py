@@ -1,13 +1,11 @@
 import os
+import sys
 import torch
 import torch.nn as nn
 import torch.optim as optim
 import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.metrics import classification_report, confusion_matrix
 from torch.utils.data import DataLoader, Dataset, random_split
 from torchvision import transforms
-import pandas as pd
 from PIL import Image
 
 BASE_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "HAM10000"))
@@ -18,41 +16,46 @@ METADATA_FILE = os.path.join(BASE_FOLDER, "HAM10000_metadata")
 TEST_FOLDER = os.path.join(BASE_TEST_FOLDER, "ISIC2018_images_processed", "rgb")
 TEST_METADATA = os.path.join(BASE_TEST_FOLDER, "ISIC2018_metadata")
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "preprocessing")))
+from metadata_store import load_metadata, paths_and_labels
+from evaluation import evaluate_model
+
+EVAL_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "plots", "evaluation"))
+
 NUM_SAMPLES = 10000
 TRAIN_SPLIT = 0.8  
 NUM_EPOCHS = 40
 BATCH_SIZE = 64
 NUM_CLASSES = None
 
-metadata = pd.read_csv(METADATA_FILE)
-test_metadata = pd.read_csv(TEST_METADATA)
+metadata = load_metadata(METADATA_FILE, columns=["image_id", "dx"])
+test_metadata = load_metadata(TEST_METADATA, columns=["image_id", "dx"])
 
 if NUM_SAMPLES < len(metadata):
     metadata = metadata.sample(n=NUM_SAMPLES, random_state=42).reset_index(drop=True)
 
-lesion_classes = {name: idx for idx, name in enumerate(metadata["dx"].unique())}
-metadata["label"] = metadata["dx"].map(lesion_classes)
-test_metadata["label"] = test_metadata["dx"].map(lesion_classes)
+lesion_classes = {name: idx for idx, name in enumerate(metadata["dx"].astype(str).unique())}
+image_paths, labels = paths_and_labels(metadata, IMAGES_FOLDER, lesion_classes)
+test_image_paths, test_labels = paths_and_labels(test_metadata, TEST_FOLDER, lesion_classes)
 
 NUM_CLASSES = len(lesion_classes)
 
 class SkinLesionDataset(Dataset):
-    def __init__(self, metadata, images_folder, transform=None):
-        self.metadata = metadata
-        self.images_folder = images_folder
+    def __init__(self, image_paths, labels, transform=None):
+        self.image_paths = image_paths
+        self.labels = labels
         self.transform = transform
 
     def __len__(self):
-        return len(self.metadata)
+        return len(self.labels)
 
     def __getitem__(self, idx):
-        row = self.metadata.iloc[idx]
-        img_path = os.path.join(self.images_folder, row["image_id"] + ".jpg")
-        label = row["label"]
+        img_path = self.image_paths[idx]
+        label = self.labels[idx]
         
         if not os.path.exists(img_path):
             print(f"Warning: {img_path} not found. Skipping...")
-            return self.__getitem__((idx + 1) % len(self.metadata))
+            return self.__getitem__((idx + 1) % len(self.labels))
     
         image = Image.open(img_path).convert("RGB")
 
@@ -74,9 +77,9 @@ test_transform = transforms.Compose([
     transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
 ])
 
-full_dataset = SkinLesionDataset(metadata, IMAGES_FOLDER, transform=transform)
+full_dataset = SkinLesionDataset(image_paths, labels, transform=transform)
 
-test_dataset = SkinLesionDataset(test_metadata, TEST_FOLDER, transform=test_transform)
+test_dataset = SkinLesionDataset(test_image_paths, test_labels, transform=test_transform)
 
 train_size = int(TRAIN_SPLIT * len(full_dataset))
 val_size = len(full_dataset) - train_size
@@ -168,47 +171,15 @@ def train_model(model, train_loader, val_loader, criterion, optimizer, epochs=10
     plt.show()
 
 def evaluate_runtime(model, loader, criterion):
-    model.eval()
-    loss, correct, total = 0.0, 0, 0
-    y_true, y_pred = [], []
-    
-    with torch.no_grad():
-        for images, labels in loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            loss += criterion(outputs, labels).item() * images.size(0)
-            _, predicted = torch.max(outputs, 1)
-            correct += (predicted == labels).sum().item()
-            total += labels.size(0)
-            y_true.extend(labels.cpu().numpy())
-            y_pred.extend(predicted.cpu().numpy())
-    
-    print(classification_report(y_true, y_pred, target_names=lesion_classes.keys()))
-    return loss / len(loader.dataset), correct / total
+    evaluator = evaluate_model(model, loader, device, list(lesion_classes), criterion)
+    print(evaluator.report_text())
+    return evaluator.loss, evaluator.accuracy
 
 def evaluate_test_model(model, loader, criterion):
-    model.eval()
-    loss, correct, total = 0.0, 0, 0
-    y_true, y_pred = [], []
-    
-    with torch.no_grad():
-        for images, labels in loader:
-            images, labels = images.to(device), labels.to(device)
-            outputs = model(images)
-            loss += criterion(outputs, labels).item() * images.size(0)
-            _, predicted = torch.max(outputs, 1)
-            correct += (predicted == labels).sum().item()
-            total += labels.size(0)
-            y_true.extend(labels.cpu().numpy())
-            y_pred.extend(predicted.cpu().numpy())
-    
-    print(classification_report(y_true, y_pred, target_names=lesion_classes.keys()))
-    cm = confusion_matrix(y_true, y_pred)
-    sns.heatmap(cm, annot=True, fmt='d', cmap='Blues', xticklabels=lesion_classes.keys(), yticklabels=lesion_classes.keys())
-    plt.xlabel('Predicted')
-    plt.ylabel('Actual')
-    plt.show()
-    return loss / len(loader.dataset), correct / total
+    evaluator = evaluate_model(model, loader, device, list(lesion_classes), criterion)
+    print(evaluator.report_text())
+    evaluator.save(EVAL_FOLDER, "baseline_isic2018").result()
+    return evaluator.loss, evaluator.accuracy
 
 train_model(model, train_loader, val_loader, criterion, optimizer, epochs=NUM_EPOCHS)
 
@@ -0,0 +1,169 @@
+import math
+import torch
+import torch.nn.functional as F
+
+# Batched replacement for the per-sample albumentations train pipelines of resnet50.py and
+# IRv2.py (flips, RandomRotate90, ShiftScaleRotate, RandomBrightnessContrast,
+# HueSaturationValue, Resize, Normalize). The DataLoader only decodes and collates uint8
+# images; the whole batch is then augmented at once, on the training device.
+
+# ---------------------------
+# Color Space
+# ---------------------------
+# Channel of (v, q, p, t) that each of R, G, B takes in the six hue sextants
+HSV_SEXTANTS = torch.tensor([[0, 3, 2], [1, 0, 2], [2, 0, 3], [2, 1, 0], [3, 2, 0], [0, 2, 1]])
+
+def rgb_to_hsv(x):
+    # (B, 3, H, W) in [0, 1] -> hue, saturation, value in [0, 1]
+    r, g, b = x.unbind(dim=1)
+    maxc, minc = x.max(dim=1).values, x.min(dim=1).values
+    delta = maxc - minc
+    safe_delta = torch.where(delta > 0, delta, torch.ones_like(delta))
+    rc, gc, bc = (maxc - r) / safe_delta, (maxc - g) / safe_delta, (maxc - b) / safe_delta
+    hue = torch.where(maxc == r, bc - gc, torch.where(maxc == g, 2.0 + rc - bc, 4.0 + gc - rc))
+    hue = torch.where(delta > 0, (hue / 6.0) % 1.0, torch.zeros_like(hue))
+    sat = torch.where(maxc > 0, delta / torch.where(maxc > 0, maxc, torch.ones_like(maxc)), torch.zeros_like(maxc))
+    return torch.stack([hue, sat, maxc], dim=1)
+
+def hsv_to_rgb(x):
+    h, s, v = x.unbind(dim=1)
+    sextant = torch.floor(h * 6.0)
+    f = h * 6.0 - sextant
+    candidates = torch.stack([v, v * (1 - s * f), v * (1 - s), v * (1 - s * (1 - f))], dim=1)
+    index = HSV_SEXTANTS.to(x.device)[sextant.long() % 6].permute(0, 3, 1, 2)
+    return candidates.gather(1, index)
+
+# ---------------------------
+# Geometry
+# ---------------------------
+def affine_matrices(m00, m01, m10, m11, tx, ty):
+    # Batch of 3x3 homogeneous matrices from (B,) tensors
+    zeros, ones = torch.zeros_like(m00), torch.ones_like(m00)
+    return torch.stack([
+        torch.stack([m00, m01, tx], dim=-1),
+        torch.stack([m10, m11, ty], dim=-1),
+        torch.stack([zeros, zeros, ones], dim=-1),
+    ], dim=-2)
+
+def scaling(sx, sy):
+    zeros = torch.zeros_like(sx)
+    return affine_matrices(sx, zeros, zeros, sy, zeros, zeros)
+
+def rotation(angle, scale=None):
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    scale = torch.ones_like(angle) if scale is None else scale
+    zeros = torch.zeros_like(angle)
+    return affine_matrices(cos * scale, -sin * scale, sin * scale, cos * scale, zeros, zeros)
+
+# ---------------------------
+# Batched Augmentation
+# ---------------------------
+class BatchAugment:
+    # Defaults match the albumentations train_transform of resnet50.py / IRv2.py
+    def __init__(self, size, mean, std, flip_p=0.5, rotate90_p=0.5,
+                 shift_scale_rotate_p=0.5, shift_limit=0.1, scale_limit=0.1, rotate_limit=180,
+                 brightness_contrast_p=0.2, brightness_limit=0.2, contrast_limit=0.2,
+                 hsv_p=0.2, hue_shift_limit=20, sat_shift_limit=30, val_shift_limit=20, seed=None):
+        self.size = size
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(1, 3, 1, 1)
+        self.std = torch.tensor(std, dtype=torch.float32).view(1, 3, 1, 1)
+        self.flip_p = flip_p
+        self.rotate90_p = rotate90_p
+        self.shift_scale_rotate_p = shift_scale_rotate_p
+        self.shift_limit = shift_limit
+        self.scale_limit = scale_limit
+        self.rotate_limit = rotate_limit
+        self.brightness_contrast_p = brightness_contrast_p
+        self.brightness_limit = brightness_limit
+        self.contrast_limit = contrast_limit
+        self.hsv_p = hsv_p
+        # Hue in OpenCV units (0-180), saturation and value in 0-255, as in albumentations
+        self.hue_shift_limit = hue_shift_limit
+        self.sat_shift_limit = sat_shift_limit
+        self.val_shift_limit = val_shift_limit
+        # Parameters are drawn on the CPU, so a seed gives the same augmentations on any device
+        self.generator = torch.Generator()
+        if seed is None:
+            self.generator.seed()
+        else:
+            self.generator.manual_seed(seed)
+
+    def manual_seed(self, seed):
+        self.generator.manual_seed(seed)
+        return self
+
+    def uniform(self, n, low, high):
+        return low + (high - low) * torch.rand(n, generator=self.generator)
+
+    def chance(self, n, p):
+        return torch.rand(n, generator=self.generator) < p
+
+    def geometry(self, n, width, height):
+        # Output -> input map in affine_grid's normalized coordinates. Flips, rot90,
+        # shift-scale-rotate and the final resize are composed in centered pixel coordinates,
+        # so the whole chain costs a single bilinear resample at the output size.
+        full = lambda value: torch.full((n,), float(value))
+        size = full(self.size)
+        flip_x = 1 - 2 * self.chance(n, self.flip_p).float()
+        flip_y = 1 - 2 * self.chance(n, self.flip_p).float()
+        quarter_turns = torch.randint(0, 4, (n,), generator=self.generator) * self.chance(n, self.rotate90_p)
+        # Width/height of the image after rot90, before ShiftScaleRotate and Resize
+        odd = quarter_turns % 2 == 1
+        rotated_w = torch.where(odd, full(height), full(width))
+        rotated_h = torch.where(odd, full(width), full(height))
+
+        apply = self.chance(n, self.shift_scale_rotate_p)
+        angle = torch.where(apply, self.uniform(n, -self.rotate_limit, self.rotate_limit), torch.zeros(n)) * math.pi / 180
+        scale = torch.where(apply, self.uniform(n, 1 - self.scale_limit, 1 + self.scale_limit), torch.ones(n))
+        shift_x = torch.where(apply, self.uniform(n, -self.shift_limit, self.shift_limit), torch.zeros(n)) * rotated_w
+        shift_y = torch.where(apply, self.uniform(n, -self.shift_limit, self.shift_limit), torch.zeros(n)) * rotated_h
+        # Inverse of p -> scale * R(angle) p + shift
+        inverse_rotation = rotation(-angle, 1 / scale)
+        shift = torch.stack([shift_x, shift_y], dim=-1)[..., None]
+        inverse_rotation[:, :2, 2:] = -inverse_rotation[:, :2, :2] @ shift
+
+        chain = [
+            scaling(2 / full(width), 2 / full(height)),
+            scaling(flip_x, flip_y),
+            rotation(-quarter_turns.float() * math.pi / 2).round(),
+            inverse_rotation,
+            scaling(rotated_w / size, rotated_h / size),
+            scaling(size / 2, size / 2),
+        ]
+        theta = chain[0]
+        for matrix in chain[1:]:
+            theta = theta @ matrix
+        return theta[:, :2]
+
+    def __call__(self, images):
+        # uint8 (B, H, W, 3), as collated from decoded HWC arrays -> normalized float (B, 3, size, size)
+        n, height, width, _ = images.shape
+        device = images.device
+        x = images.permute(0, 3, 1, 2).float().div_(255)
+
+        theta = self.geometry(n, width, height).to(device)
+        grid = F.affine_grid(theta, (n, 3, self.size, self.size), align_corners=False)
+        # Reflection padding, like ShiftScaleRotate's default BORDER_REFLECT_101
+        x = F.grid_sample(x, grid, mode="bilinear", padding_mode="reflection", align_corners=False)
+
+        # Color transforms are per pixel, so they run after the resample on the smaller output
+        apply = self.chance(n, self.brightness_contrast_p)
+        alpha = torch.where(apply, 1 + self.uniform(n, -self.contrast_limit, self.contrast_limit), torch.ones(n))
+        beta = torch.where(apply, self.uniform(n, -self.brightness_limit, self.brightness_limit), torch.zeros(n))
+        x = (x * alpha.view(-1, 1, 1, 1).to(device) + beta.view(-1, 1, 1, 1).to(device)).clamp_(0, 1)
+
+        selected = self.chance(n, self.hsv_p)
+        shifts = torch.stack([
+            self.uniform(n, -self.hue_shift_limit, self.hue_shift_limit) / 180,
+            self.uniform(n, -self.sat_shift_limit, self.sat_shift_limit) / 255,
+            self.uniform(n, -self.val_shift_limit, self.val_shift_limit) / 255,
+        ], dim=1)[selected]
+        if len(shifts):
+            # Only the selected images pay for the HSV round trip
+            index = selected.nonzero()[:, 0].to(device)
+            hsv = rgb_to_hsv(x[index]) + shifts.view(-1, 3, 1, 1).to(device)
+            hsv[:, 0] %= 1.0
+            hsv[:, 1:].clamp_(0, 1)
+            x[index] = hsv_to_rgb(hsv)
+
+        return (x - self.mean.to(device)) / self.std.to(device)
@@ -0,0 +1,111 @@
+import os
+import json
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import DataLoader
+from sklearn.model_selection import train_test_split
+
+# common.py holds the served checkpoint's loader, class order, test preprocessing and the ISIC2018 paths
+from common import (BASE_PATH, ISIC_IMAGES_FOLDER, ISIC_METADATA_FILE, LABELS, SERVED_CHECKPOINT, SkinLesionDataset,
+                    load_model, test_transform)
+from metadata_store import LEAK_COLUMN, load_metadata, paths_and_labels, without_leaks
+from evaluation import StreamingEvaluator
+
+# ---------------------------
+# Define Paths
+# ---------------------------
+# Loaded by vertex/app.py (TEMPERATURE_PATH)
+OUTPUT_FILE = os.path.join(BASE_PATH, "vertex", "temperature.json")
+
+# ---------------------------
+# Settings
+# ---------------------------
+BATCH_SIZE = 16
+FIT_FRACTION = 0.5  # the rest of ISIC2018 reports calibration before/after on unseen images
+MAX_ITER = 100
+SEED = 42
+
+# ---------------------------
+# Logits
+# ---------------------------
+def collect_logits(model, loader, device):
+    # The backbone runs once; the temperature is then fitted on the cached logits
+    model.eval()
+    logits, labels = [], []
+    with torch.no_grad():
+        for images, targets in loader:
+            logits.append(model(images.to(device)).float().cpu())
+            labels.append(targets)
+    return torch.cat(logits), torch.cat(labels)
+
+# ---------------------------
+# Temperature Scaling
+# ---------------------------
+def fit_temperature(logits, labels):
+    # Single scalar T > 0 minimizing the NLL of softmax(logits / T); argmax (accuracy) is unchanged
+    log_t = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_t], lr=0.1, max_iter=MAX_ITER, line_search_fn="strong_wolfe")
+
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / log_t.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return float(log_t.exp())
+
+def calibration_metrics(logits, labels, temperature):
+    evaluator = StreamingEvaluator(LABELS)
+    evaluator.update_probs(F.softmax(logits / temperature, dim=1).numpy(), labels.numpy())
+    _, _, ece = evaluator.calibration()
+    return {
+        "nll": float(F.cross_entropy(logits / temperature, labels)),
+        "ece": float(ece),
+        "accuracy": float(evaluator.accuracy),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit temperature scaling for the served model on ISIC2018.")
+    parser.add_argument("--checkpoint", default=SERVED_CHECKPOINT, help="Checkpoint to calibrate (as loaded by vertex/app.py).")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    label_map = {name: idx for idx, name in enumerate(LABELS)}
+    isic_metadata = without_leaks(load_metadata(ISIC_METADATA_FILE, columns=["image_id", "dx"], optional=[LEAK_COLUMN]))
+    dataset = SkinLesionDataset(*paths_and_labels(isic_metadata, ISIC_IMAGES_FOLDER, label_map), transform=test_transform)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+    logits, labels = collect_logits(load_model(args.checkpoint, device), loader, device)
+    fit_idx, holdout_idx = train_test_split(np.arange(len(labels)), train_size=FIT_FRACTION,
+                                            stratify=labels.numpy(), random_state=SEED)
+    fit_idx, holdout_idx = torch.from_numpy(fit_idx), torch.from_numpy(holdout_idx)
+
+    temperature = fit_temperature(logits[fit_idx], labels[fit_idx])
+    before = calibration_metrics(logits[holdout_idx], labels[holdout_idx], 1.0)
+    after = calibration_metrics(logits[holdout_idx], labels[holdout_idx], temperature)
+
+    print(f"Temperature: {temperature:.4f} (fitted on {len(fit_idx)} ISIC2018 images)")
+    print(f"{'':>12} {'NLL':>8} {'ECE':>8} {'accuracy':>9}")
+    for name, m in (("uncalibrated", before), ("calibrated", after)):
+        print(f"{name:>12} {m['nll']:>8.4f} {m['ece']:>8.4f} {m['accuracy']:>9.4f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump({
+            "temperature": temperature,
+            "checkpoint": os.path.basename(args.checkpoint),
+            "fit_samples": len(fit_idx),
+            "holdout_samples": len(holdout_idx),
+            "holdout_uncalibrated": before,
+            "holdout_calibrated": after,
+        }, f, indent=2)
+    print(f"\n✅ Temperature saved to {args.output}; vertex/app.py loads it from TEMPERATURE_PATH")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+import os
+import glob
+import random
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+# ---------------------------
+# Resumable Shuffling Sampler
+# ---------------------------
+# Each epoch's permutation depends only on (seed, epoch), so the sampler can
+# be restored mid-epoch from (epoch, position) and yield exactly the samples
+# that had not been consumed yet.
+class ResumableRandomSampler(Sampler):
+    def __init__(self, data_source, seed=0):
+        self.data_source = data_source
+        self.seed = seed
+        self.epoch = 0
+        self.position = 0
+
+    def set_epoch(self, epoch, position=0):
+        self.epoch = epoch
+        self.position = position
+
+    def advance(self, num_samples):
+        self.position += num_samples
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.data_source), generator=generator).tolist()
+        return iter(order[self.position:])
+
+    def __len__(self):
+        return len(self.data_source) - self.position
+
+    def state_dict(self):
+        return {"seed": self.seed, "epoch": self.epoch, "position": self.position}
+
+    def load_state_dict(self, state):
+        self.seed = state["seed"]
+        self.set_epoch(state["epoch"], state["position"])
+
+# ---------------------------
+# State Helpers
+# ---------------------------
+def to_cpu(obj):
+    if torch.is_tensor(obj):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+def rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+# ---------------------------
+# Checkpoint Manager
+# ---------------------------
+class CheckpointManager:
+    def __init__(self, directory, keep=3, save_every=500):
+        self.directory = directory
+        self.keep = keep
+        self.save_every = save_every
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.pending = None
+        os.makedirs(directory, exist_ok=True)
+
+    def checkpoints(self):
+        return sorted(glob.glob(os.path.join(self.directory, "checkpoint_*.pt")))
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def due(self, step):
+        return bool(self.save_every) and step % self.save_every == 0
+
+    def maybe_save(self, step, **kwargs):
+        if self.due(step):
+            self.save(step, **kwargs)
+
+    def save(self, step, model, optimizer=None, scheduler=None, sampler=None, training_state=None):
+        # Snapshot on the training thread so the copy is consistent, then serialize in the background
+        state = {
+            "step": step,
+            "model": to_cpu(model.state_dict()),
+            "optimizer": to_cpu(optimizer.state_dict()) if optimizer is not None else None,
+            "scheduler": scheduler.state_dict() if scheduler is not None else None,
+            "sampler": sampler.state_dict() if sampler is not None else None,
+            "rng": rng_state(),
+            "training_state": dict(training_state or {}),
+        }
+        # At most one write in flight so snapshots can't pile up in memory
+        self.wait()
+        self.pending = self.writer.submit(self.write, step, state)
+
+    def write(self, step, state):
+        path = os.path.join(self.directory, f"checkpoint_{step:09d}.pt")
+        tmp_path = path + ".tmp"
+        torch.save(state, tmp_path)
+        os.replace(tmp_path, path)
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old)
+        return path
+
+    def wait(self):
+        if self.pending is not None:
+            self.pending.result()
+            self.pending = None
+
+    def resume(self, model, optimizer=None, scheduler=None, sampler=None, path=None):
+        path = path or self.latest()
+        if path is None:
+            return None
+        state = torch.load(path, map_location="cpu", weights_only=False)
+        model.load_state_dict(state["model"])
+        if optimizer is not None and state["optimizer"] is not None:
+            optimizer.load_state_dict(state["optimizer"])
+        if scheduler is not None and state["scheduler"] is not None:
+            scheduler.load_state_dict(state["scheduler"])
+        if sampler is not None and state["sampler"] is not None:
+            sampler.load_state_dict(state["sampler"])
+        set_rng_state(state["rng"])
+        print(f"Resumed from {path} (step {state['step']})")
+        return state
@@ -0,0 +1,95 @@
+import os
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torch.utils.data import Dataset
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+
+# Shared by the scripts that work on the served checkpoint (prune_irv2.py, calibrate_temperature.py,
+# molemonitoring's evaluate/export) and by the cost measurements of preprocessing/lesion_crop.py.
+# Importing this module loads no weights and no data.
+
+# ---------------------------
+# Define Paths
+# ---------------------------
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "preprocessing"))
+sys.path.append(os.path.join(BASE_PATH, "vertex"))
+from serving_model import IMG_SIZE, LABELS, load_serving_model
+
+HAM_FOLDER = os.path.join(BASE_PATH, "HAM10000")
+HAM_IMAGES_FOLDER = os.path.join(HAM_FOLDER, "HAM10000_images")
+HAM_METADATA_FILE = os.path.join(HAM_FOLDER, "HAM10000_metadata")
+
+ISIC_FOLDER = os.path.join(BASE_PATH, "ISIC2018")
+ISIC_IMAGES_FOLDER = os.path.join(ISIC_FOLDER, "ISIC2018_images")
+ISIC_METADATA_FILE = os.path.join(ISIC_FOLDER, "ISIC2018_metadata")
+
+SERVED_CHECKPOINT = os.path.join(BASE_PATH, "vertex", "best_inception_resnetv2_attention.pth")
+
+# ---------------------------
+# Settings
+# ---------------------------
+# Input size of the served checkpoint (IMG_SIZE in vertex/app.py); LABELS is its class order
+IMAGE_SIZE = IMG_SIZE
+
+test_transform = A.Compose([
+    A.Resize(IMAGE_SIZE, IMAGE_SIZE),
+    A.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)),
+    ToTensorV2(),
+])
+
+# ---------------------------
+# Model
+# ---------------------------
+def load_model(path, device):
+    # The serving architecture of vertex/app.py (serving_model.py), resized to the checkpoint
+    return load_serving_model(path, device, img_size=IMAGE_SIZE, num_classes=len(LABELS))
+
+# ---------------------------
+# Data
+# ---------------------------
+class SkinLesionDataset(Dataset):
+    def __init__(self, image_paths, labels, transform):
+        self.image_paths = image_paths
+        self.labels = labels
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        image = np.array(Image.open(self.image_paths[idx]).convert("RGB"))
+        return self.transform(image=image)["image"].float(), torch.tensor(self.labels[idx], dtype=torch.long)
+
+# ---------------------------
+# Cost Measurements
+# ---------------------------
+def count_macs(model, size):
+    macs = []
+    def hook(module, inputs, output):
+        if isinstance(module, nn.Conv2d):
+            macs.append(output.numel() * module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1])
+        elif isinstance(module, nn.Linear):
+            macs.append(output.numel() * module.in_features)
+    handles = [m.register_forward_hook(hook) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, size, size))
+    for handle in handles:
+        handle.remove()
+    return sum(macs)
+
+def median_latency_ms(fn, iters=20, warmup=3):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
@@ -0,0 +1,91 @@
+import os
+import math
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from checkpointing import ResumableRandomSampler
+
+# ---------------------------
+# Process Group
+# ---------------------------
+# torchrun sets RANK/WORLD_SIZE/LOCAL_RANK/LOCAL_WORLD_SIZE; a plain `python script.py`
+# run has none of them and trains as a single process exactly as before.
+def setup_distributed(backend="gloo"):
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+        # Split the node's cores between its processes instead of every process using all of them
+        local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", "1"))
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // local_world_size))
+    return get_rank(), get_world_size()
+
+def cleanup_distributed():
+    if dist.is_initialized():
+        dist.destroy_process_group()
+
+def get_rank():
+    return dist.get_rank() if dist.is_initialized() else 0
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_initialized() else 1
+
+def is_main_process():
+    return get_rank() == 0
+
+def wrap_model(model):
+    if get_world_size() == 1:
+        return model
+    return DistributedDataParallel(model)
+
+def unwrap_model(model):
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+def broadcast_flag(flag):
+    # Rank 0 decides (e.g. early stopping) and every rank follows
+    if get_world_size() == 1:
+        return flag
+    tensor = torch.tensor([int(flag)])
+    dist.broadcast(tensor, src=0)
+    return bool(tensor.item())
+
+def all_reduce_sum(values):
+    if get_world_size() == 1:
+        return values
+    tensor = torch.tensor(values, dtype=torch.float64)
+    dist.all_reduce(tensor)
+    return tensor.tolist()
+
+def all_gather_states(state):
+    # Same-sized per-rank state tensors (e.g. generator states), indexed by rank
+    if get_world_size() == 1:
+        return [state]
+    states = [torch.empty_like(state) for _ in range(get_world_size())]
+    dist.all_gather(states, state)
+    return states
+
+# ---------------------------
+# Distributed Resumable Sampler
+# ---------------------------
+# Shards the epoch permutation of ResumableRandomSampler across ranks. The
+# permutation runs over the dataset's (oversampled) index space, so every
+# oversampled copy goes to exactly one rank per epoch and the class balance of
+# the whole effective batch is the same as in single-process training. The
+# order is padded to a multiple of the world size so all ranks run the same
+# number of steps, and `position` counts this rank's consumed samples, which is
+# identical on every rank, so one checkpointed sampler state resumes them all.
+class DistributedResumableSampler(ResumableRandomSampler):
+    def __init__(self, data_source, seed=0, num_replicas=None, rank=None):
+        super().__init__(data_source, seed)
+        self.num_replicas = num_replicas if num_replicas is not None else get_world_size()
+        self.rank = rank if rank is not None else get_rank()
+        self.num_samples = math.ceil(len(data_source) / self.num_replicas)
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(len(self.data_source), generator=generator).tolist()
+        order += order[:self.num_samples * self.num_replicas - len(order)]
+        return iter(order[self.rank::self.num_replicas][self.position:])
+
+    def __len__(self):
+        return self.num_samples - self.position
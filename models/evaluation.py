@@ -0,0 +1,228 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+import torch.nn.functional as F
+from matplotlib.figure import Figure
+
+# ---------------------------
+# Settings
+# ---------------------------
+ROC_BINS = 1000
+CALIBRATION_BINS = 15
+
+# Artifacts are written on a background thread so evaluation never blocks on disk or rendering;
+# save() returns the write's future, whose result() waits for it and re-raises its errors
+artifact_writer = ThreadPoolExecutor(max_workers=1)
+
+# ---------------------------
+# Streaming Evaluator
+# ---------------------------
+class StreamingEvaluator:
+    def __init__(self, class_names, roc_bins=ROC_BINS, calibration_bins=CALIBRATION_BINS):
+        self.class_names = list(class_names)
+        self.num_classes = len(self.class_names)
+        self.roc_bins = roc_bins
+        self.calibration_bins = calibration_bins
+        self.reset()
+
+    def reset(self):
+        c = self.num_classes
+        self.confusion = np.zeros((c, c), dtype=np.int64)
+        # Per-class histograms of p(class) for positive and negative samples (ROC/AUC)
+        self.positive_hist = np.zeros((c, self.roc_bins), dtype=np.int64)
+        self.negative_hist = np.zeros((c, self.roc_bins), dtype=np.int64)
+        # Confidence-binned counts for the reliability diagram (calibration)
+        self.calibration_count = np.zeros(self.calibration_bins, dtype=np.int64)
+        self.calibration_confidence = np.zeros(self.calibration_bins)
+        self.calibration_correct = np.zeros(self.calibration_bins)
+        self.loss_sum = 0.0
+        self.num_samples = 0
+
+    def update(self, outputs, labels, loss=None):
+        probs = F.softmax(outputs.detach().float(), dim=1).cpu().numpy()
+        labels = labels.detach().cpu().numpy()
+        self.update_probs(probs, labels)
+        if loss is not None:
+            self.loss_sum += float(loss) * len(labels)
+
+    def update_probs(self, probs, labels):
+        c = self.num_classes
+        labels = labels.astype(np.int64)
+        preds = probs.argmax(axis=1)
+        self.confusion += np.bincount(labels * c + preds, minlength=c * c).reshape(c, c)
+
+        bins = np.minimum((probs * self.roc_bins).astype(np.int64), self.roc_bins - 1)
+        flat_bins = bins + np.arange(c)[None, :] * self.roc_bins
+        positive = labels[:, None] == np.arange(c)[None, :]
+        self.positive_hist += np.bincount(flat_bins[positive], minlength=c * self.roc_bins).reshape(c, -1)
+        self.negative_hist += np.bincount(flat_bins[~positive], minlength=c * self.roc_bins).reshape(c, -1)
+
+        confidence = probs[np.arange(len(labels)), preds]
+        conf_bins = np.minimum((confidence * self.calibration_bins).astype(np.int64), self.calibration_bins - 1)
+        self.calibration_count += np.bincount(conf_bins, minlength=self.calibration_bins)
+        self.calibration_confidence += np.bincount(conf_bins, weights=confidence, minlength=self.calibration_bins)
+        self.calibration_correct += np.bincount(conf_bins, weights=(preds == labels), minlength=self.calibration_bins)
+        self.num_samples += len(labels)
+
+    # ---------------------------
+    # Metrics
+    # ---------------------------
+    @property
+    def loss(self):
+        return self.loss_sum / max(self.num_samples, 1)
+
+    @property
+    def accuracy(self):
+        return np.trace(self.confusion) / max(self.num_samples, 1)
+
+    def classification_report(self):
+        tp = np.diag(self.confusion).astype(float)
+        support = self.confusion.sum(axis=1)
+        precision = tp / np.maximum(self.confusion.sum(axis=0), 1)
+        recall = tp / np.maximum(support, 1)
+        f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+        report = {
+            name: {"precision": precision[i], "recall": recall[i], "f1-score": f1[i], "support": int(support[i])}
+            for i, name in enumerate(self.class_names)
+        }
+        weights = support / max(support.sum(), 1)
+        report["accuracy"] = self.accuracy
+        report["macro avg"] = {"precision": precision.mean(), "recall": recall.mean(), "f1-score": f1.mean(), "support": int(support.sum())}
+        report["weighted avg"] = {"precision": (precision * weights).sum(), "recall": (recall * weights).sum(), "f1-score": (f1 * weights).sum(), "support": int(support.sum())}
+        return report
+
+    def report_text(self, digits=2):
+        report = self.classification_report()
+        width = max(len(name) for name in self.class_names + ["weighted avg"])
+        lines = [f"{'':>{width}} {'precision':>9} {'recall':>9} {'f1-score':>9} {'support':>9}", ""]
+        row = "{:>{width}} {:>9.{d}f} {:>9.{d}f} {:>9.{d}f} {:>9}"
+        for name in self.class_names:
+            r = report[name]
+            lines.append(row.format(name, r["precision"], r["recall"], r["f1-score"], r["support"], width=width, d=digits))
+        lines.append("")
+        lines.append(f"{'accuracy':>{width}} {'':>9} {'':>9} {report['accuracy']:>9.{digits}f} {self.num_samples:>9}")
+        for name in ("macro avg", "weighted avg"):
+            r = report[name]
+            lines.append(row.format(name, r["precision"], r["recall"], r["f1-score"], r["support"], width=width, d=digits))
+        return "\n".join(lines)
+
+    def roc_curves(self):
+        # Sweep the threshold from 1 down to 0 over the histogram bins
+        tp = np.cumsum(self.positive_hist[:, ::-1], axis=1)
+        fp = np.cumsum(self.negative_hist[:, ::-1], axis=1)
+        zeros = np.zeros((self.num_classes, 1))
+        tpr = np.hstack([zeros, tp / np.maximum(tp[:, -1:], 1)])
+        fpr = np.hstack([zeros, fp / np.maximum(fp[:, -1:], 1)])
+        auc = ((fpr[:, 1:] - fpr[:, :-1]) * (tpr[:, 1:] + tpr[:, :-1]) / 2).sum(axis=1)
+        return fpr, tpr, auc
+
+    def calibration(self):
+        count = np.maximum(self.calibration_count, 1)
+        confidence = self.calibration_confidence / count
+        accuracy = self.calibration_correct / count
+        ece = (self.calibration_count / max(self.num_samples, 1) * np.abs(accuracy - confidence)).sum()
+        return confidence, accuracy, ece
+
+    def summary(self):
+        _, _, auc = self.roc_curves()
+        confidence, accuracy, ece = self.calibration()
+        return {
+            "num_samples": self.num_samples,
+            "loss": self.loss,
+            "accuracy": self.accuracy,
+            "classification_report": self.classification_report(),
+            "confusion_matrix": self.confusion.tolist(),
+            "auc": dict(zip(self.class_names, auc.tolist())),
+            "macro_auc": float(auc.mean()),
+            "calibration": {
+                "ece": float(ece),
+                "bin_count": self.calibration_count.tolist(),
+                "bin_confidence": confidence.tolist(),
+                "bin_accuracy": accuracy.tolist(),
+            },
+        }
+
+    # ---------------------------
+    # Artifacts
+    # ---------------------------
+    def save(self, output_dir, name):
+        os.makedirs(output_dir, exist_ok=True)
+        summary = json.loads(json.dumps(self.summary(), default=float))
+        fpr, tpr, auc = self.roc_curves()
+        confidence, accuracy, _ = self.calibration()
+        snapshot = (self.confusion.copy(), fpr, tpr, auc, confidence, accuracy, self.calibration_count.copy())
+        return artifact_writer.submit(write_artifacts, output_dir, name, self.class_names, summary, snapshot)
+
+def write_artifacts(output_dir, name, class_names, summary, snapshot):
+    confusion, fpr, tpr, auc, confidence, accuracy, calibration_count = snapshot
+    with open(os.path.join(output_dir, f"{name}_metrics.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    ax.imshow(confusion, cmap="Blues")
+    for i in range(len(class_names)):
+        for j in range(len(class_names)):
+            color = "white" if confusion[i, j] > confusion.max() / 2 else "black"
+            ax.text(j, i, str(confusion[i, j]), ha="center", va="center", color=color)
+    ax.set_xticks(range(len(class_names)), class_names)
+    ax.set_yticks(range(len(class_names)), class_names)
+    ax.set_title(f"Confusion Matrix - {name}")
+    ax.set_xlabel("Predicted")
+    ax.set_ylabel("True")
+    fig.tight_layout()
+    fig.savefig(os.path.join(output_dir, f"{name}_confusion_matrix.png"))
+
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    for i, class_name in enumerate(class_names):
+        ax.plot(fpr[i], tpr[i], label=f"{class_name} (AUC = {auc[i]:.2f})")
+    ax.plot([0, 1], [0, 1], "k--")
+    ax.set_xlim([0, 1])
+    ax.set_ylim([0, 1])
+    ax.set_xlabel("False Positive Rate")
+    ax.set_ylabel("True Positive Rate")
+    ax.set_title(f"ROC Curves - {name}")
+    ax.legend(loc="lower right")
+    fig.savefig(os.path.join(output_dir, f"{name}_roc.png"))
+
+    fig = Figure(figsize=(6, 6))
+    ax = fig.subplots()
+    populated = calibration_count > 0
+    ax.plot(confidence[populated], accuracy[populated], marker="o", label="Model")
+    ax.plot([0, 1], [0, 1], "k--", label="Perfectly calibrated")
+    ax.set_xlabel("Confidence")
+    ax.set_ylabel("Accuracy")
+    ax.set_title(f"Reliability Diagram - {name} (ECE = {summary['calibration']['ece']:.3f})")
+    ax.legend(loc="upper left")
+    fig.savefig(os.path.join(output_dir, f"{name}_calibration.png"))
+
+# ---------------------------
+# Evaluation Loops
+# ---------------------------
+def evaluate_models(models, loader, device, class_names, criterion=None):
+    # One decoded pass over the loader feeds every model
+    evaluators = {name: StreamingEvaluator(class_names) for name in models}
+    for model in models.values():
+        model.eval()
+    with torch.no_grad():
+        for batch in loader:
+            images, labels = batch[0].to(device), batch[1].to(device)
+            for name, model in models.items():
+                outputs = model(images)
+                loss = criterion(outputs, labels).item() if criterion is not None else None
+                evaluators[name].update(outputs, labels, loss)
+    return evaluators
+
+def evaluate_model(model, loader, device, class_names, criterion=None):
+    return evaluate_models({"model": model}, loader, device, class_names, criterion)["model"]
+
+def evaluate_checkpoints(build_model, checkpoint_paths, loader, device, class_names, criterion=None):
+    models = {}
+    for path in checkpoint_paths:
+        model = build_model().to(device)
+        model.load_state_dict(torch.load(path, map_location=device, weights_only=True))
+        models[os.path.splitext(os.path.basename(path))[0]] = model
+    return evaluate_models(models, loader, device, class_names, criterion)
@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+
+# ---------------------------
+# Define Paths
+# ---------------------------
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "preprocessing"))
+sys.path.append(os.path.join(BASE_PATH, "vertex"))
+from metadata_store import GROUP_COLUMN, LEAK_COLUMN, LESION_COLUMN, load_metadata, paths_and_labels, train_val_split, without_leaks
+from fusion_engine import BRANCHES, FUSION_IMG_SIZE, FUSION_LABELS, load_engine
+
+HAM_FOLDER = os.path.join(BASE_PATH, "HAM10000")
+HAM_IMAGES_FOLDER = os.path.join(HAM_FOLDER, "HAM10000_images")
+HAM_METADATA_FILE = os.path.join(HAM_FOLDER, "HAM10000_metadata")
+
+ISIC_FOLDER = os.path.join(BASE_PATH, "ISIC2018")
+ISIC_IMAGES_FOLDER = os.path.join(ISIC_FOLDER, "ISIC2018_images")
+ISIC_METADATA_FILE = os.path.join(ISIC_FOLDER, "ISIC2018_metadata")
+
+# Loaded by vertex/app.py (FUSION_CHECKPOINT_PATH)
+FUSION_CHECKPOINT = os.path.join(BASE_PATH, "vertex", "best_fusion_model.pth")
+REPORT_FILE = os.path.join(BASE_PATH, "plots", "fusion_heads_report.json")
+
+# ---------------------------
+# Settings
+# ---------------------------
+BATCH_SIZE = 32
+VAL_SIZE = 0.2
+THRESHOLDS = [0.9, 0.95, 0.99]  # FUSION_EARLY_EXIT_THRESHOLD candidates
+LATENCY_SAMPLES = 50
+SEED = 42
+
+# Same preprocessing as fusion_transform in vertex/app.py
+test_transform = A.Compose([
+    A.Resize(FUSION_IMG_SIZE, FUSION_IMG_SIZE),
+    A.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
+    ToTensorV2(),
+])
+
+class SkinLesionDataset(Dataset):
+    def __init__(self, image_paths, labels, transform):
+        self.image_paths = image_paths
+        self.labels = labels
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        image = np.array(Image.open(self.image_paths[idx]).convert("RGB"))
+        return self.transform(image=image)["image"].float(), torch.tensor(self.labels[idx], dtype=torch.long)
+
+# ---------------------------
+# Cached Features
+# ---------------------------
+def collect_features(engine, loader, device):
+    # The three backbones run once per image; heads are then fitted on the cached fused features
+    features, probs, labels = [], [], []
+    for images, targets in loader:
+        output = engine.infer(images.to(device), concurrent=False, return_features=True)
+        features.append(output["features"].float().cpu())
+        probs.append(output["probs"].float().cpu())
+        labels.append(targets)
+    return torch.cat(features), torch.cat(probs), torch.cat(labels)
+
+def branch_probs(engine, features):
+    probs, start = {}, 0
+    with torch.no_grad():
+        for name, (_, dim) in BRANCHES.items():
+            head = engine.branch_heads[name]
+            probs[name] = F.softmax(head(features[:, start:start + dim].to(head.weight.device)), dim=1).cpu()
+            start += dim
+    return probs
+
+# ---------------------------
+# Accuracy / Latency Report
+# ---------------------------
+def early_exit_accuracy(heads, fused, labels, threshold):
+    # Per image (/predict_fusion is batch 1): the first confident branch in BRANCHES order answers,
+    # otherwise the fused classifier does. Concurrent serving takes the first branch to finish.
+    predictions = fused.argmax(dim=1).clone()
+    answered = torch.zeros(len(labels), dtype=torch.bool)
+    exits = {}
+    for name in BRANCHES:
+        confidence, predicted = heads[name].max(dim=1)
+        take = (confidence >= threshold) & ~answered
+        predictions[take] = predicted[take]
+        answered |= take
+        exits[name] = float(take.float().mean())
+    return {
+        "accuracy": float((predictions == labels).float().mean()),
+        "exit_rate": float(answered.float().mean()),
+        "exit_rate_by_branch": exits,
+    }
+
+def infer_latency_ms(engine, images, threshold):
+    # Served path: concurrent branches, one image at a time
+    timings = []
+    for image in images:
+        start = time.perf_counter()
+        engine.infer(image[None], concurrent=True, early_exit_threshold=threshold)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": float(np.percentile(timings, 50)), "p95_ms": float(np.percentile(timings, 95))}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the fusion engine's early-exit branch heads on cached HAM10000 features.")
+    parser.add_argument("--checkpoint", default=FUSION_CHECKPOINT, help="Fusion checkpoint (as loaded by vertex/app.py).")
+    parser.add_argument("--output", default=None, help="Checkpoint to write (default: overwrite --checkpoint).")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=THRESHOLDS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--latency-samples", type=int, default=LATENCY_SAMPLES)
+    parser.add_argument("--report", default=REPORT_FILE)
+    args = parser.parse_args()
+    output = args.output or args.checkpoint
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    engine = load_engine(args.checkpoint, device)
+
+    # Class order of FusionModelTimm (models/fusion-vit-efficientnet-resnet50.ipynb)
+    ham_metadata = load_metadata(HAM_METADATA_FILE, columns=["image_id", "dx"], optional=[GROUP_COLUMN, LESION_COLUMN])
+    label_map = {name: idx for idx, name in enumerate(FUSION_LABELS)}
+    train_df, val_df = train_val_split(ham_metadata, VAL_SIZE, SEED)
+    isic_metadata = without_leaks(load_metadata(ISIC_METADATA_FILE, columns=["image_id", "dx"], optional=[LEAK_COLUMN]))
+    splits = {"ham_val": (val_df, HAM_IMAGES_FOLDER), "isic": (isic_metadata, ISIC_IMAGES_FOLDER)}
+
+    def loader(metadata, images_folder):
+        dataset = SkinLesionDataset(*paths_and_labels(metadata, images_folder, label_map), transform=test_transform)
+        return DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+    train_features, _, train_labels = collect_features(engine, loader(train_df, HAM_IMAGES_FOLDER), device)
+    engine.fit_branch_heads(train_features, train_labels)
+    print(f"Branch heads fitted on {len(train_labels)} HAM10000 images")
+
+    report = {"checkpoint": os.path.basename(output), "fit_samples": len(train_labels), "splits": {}}
+    print(f"\n{'split':>8} {'threshold':>10} {'accuracy':>9} {'exit rate':>10}")
+    for split, (metadata, images_folder) in splits.items():
+        features, fused, labels = collect_features(engine, loader(metadata, images_folder), device)
+        heads = branch_probs(engine, features)
+        rows = [{"threshold": None, "accuracy": float((fused.argmax(dim=1) == labels).float().mean()), "exit_rate": 0.0}]
+        rows += [dict(early_exit_accuracy(heads, fused, labels, t), threshold=t) for t in args.thresholds]
+        report["splits"][split] = {"samples": len(labels), "results": rows}
+        for r in rows:
+            threshold = "off" if r["threshold"] is None else f"{r['threshold']:.2f}"
+            print(f"{split:>8} {threshold:>10} {r['accuracy']:>9.4f} {r['exit_rate']:>9.0%}")
+
+    # Latency on held-out HAM10000 images, early exit off vs each threshold
+    val_loader = loader(val_df.sample(n=min(args.latency_samples, len(val_df)), random_state=SEED), HAM_IMAGES_FOLDER)
+    images = torch.cat([batch for batch, _ in val_loader]).to(device)
+    latency = [dict(infer_latency_ms(engine, images, t), threshold=t) for t in [None] + args.thresholds]
+    report["latency"] = latency
+    print(f"\n{'threshold':>10} {'p50 ms':>9} {'p95 ms':>9} {'speedup':>8}")
+    for r in latency:
+        threshold = "off" if r["threshold"] is None else f"{r['threshold']:.2f}"
+        print(f"{threshold:>10} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {latency[0]['p50_ms'] / r['p50_ms']:>7.2f}x")
+
+    # branch_heads_fitted is a buffer, so app.py's load_engine turns early exit on from this file
+    tmp_path = output + ".tmp"
+    torch.save(engine.state_dict(), tmp_path)
+    os.replace(tmp_path, output)
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Fusion checkpoint with fitted branch heads saved to {output}, report in {args.report}")
+
+if __name__ == "__main__":
+    main()
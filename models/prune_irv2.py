@@ -0,0 +1,171 @@
+import os
+import copy
+import json
+import math
+import argparse
+from itertools import islice
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from torch.utils.data import DataLoader
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+
+# ---------------------------
+# Define Paths
+# ---------------------------
+# Paths, class order, test preprocessing, dataset and checkpoint loader of the served model
+from common import (BASE_PATH, HAM_IMAGES_FOLDER, HAM_METADATA_FILE, IMAGE_SIZE, ISIC_IMAGES_FOLDER, ISIC_METADATA_FILE,
+                    LABELS, SERVED_CHECKPOINT, SkinLesionDataset, count_macs, load_model, median_latency_ms, test_transform)
+from metadata_store import GROUP_COLUMN, LEAK_COLUMN, LESION_COLUMN, load_metadata, paths_and_labels, train_val_split, without_leaks
+from evaluation import evaluate_model
+from training import train_one_epoch
+from pruning import MIN_CHANNELS, apply_pruning, channel_counts, check_surgery, prunable_units
+
+OUTPUT_FOLDER = os.path.join(BASE_PATH, "models", "pruned")
+REPORT_FILE = os.path.join(BASE_PATH, "plots", "pruning_report.json")
+
+# ---------------------------
+# Settings
+# ---------------------------
+BATCH_SIZE = 16
+LEARNING_RATE = 1e-5
+MIN_KEEP_FRACTION = 0.25  # never cut a layer below this share of its current width
+SEED = 42
+
+train_transform = A.Compose([
+    A.HorizontalFlip(),
+    A.VerticalFlip(),
+    A.RandomRotate90(),
+    A.Resize(IMAGE_SIZE, IMAGE_SIZE),
+    A.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)),
+    ToTensorV2(),
+])
+
+# ---------------------------
+# Data
+# ---------------------------
+def build_loaders(batch_size, num_workers):
+    label_map = {name: idx for idx, name in enumerate(LABELS)}
+    ham_metadata = load_metadata(HAM_METADATA_FILE, columns=["image_id", "dx"], optional=[GROUP_COLUMN, LESION_COLUMN])
+    # Same seeded split as IRv2.py, so fine-tuning never sees its validation images
+    train_df, _ = train_val_split(ham_metadata, test_size=0.10, seed=SEED)
+    class_counts = train_df["dx"].value_counts().to_dict()
+    class_weights = torch.tensor([len(train_df) / (len(class_counts) * class_counts[name]) for name in LABELS], dtype=torch.float)
+
+    train_dataset = SkinLesionDataset(*paths_and_labels(train_df, HAM_IMAGES_FOLDER, label_map), transform=train_transform)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+    isic_metadata = without_leaks(load_metadata(ISIC_METADATA_FILE, columns=["image_id", "dx"], optional=[LEAK_COLUMN]))
+    test_dataset = SkinLesionDataset(*paths_and_labels(isic_metadata, ISIC_IMAGES_FOLDER, label_map), transform=test_transform)
+    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    return train_loader, test_loader, class_weights
+
+# ---------------------------
+# Channel Importance
+# ---------------------------
+def taylor_importance(model, loader, criterion, device, max_batches):
+    # First-order Taylor estimate of the loss change from removing each channel,
+    # |sum over space of activation x gradient|, accumulated over HAM10000 batches
+    units = prunable_units(model.base_model)
+    scores = {unit.name: torch.zeros(unit.layer.conv.out_channels, device=device) for unit in units}
+
+    def make_hook(name):
+        def forward_hook(module, inputs, output):
+            def grad_hook(grad):
+                scores[name] += (output.detach() * grad).sum(dim=(2, 3)).abs().sum(dim=0)
+            output.register_hook(grad_hook)
+        return forward_hook
+
+    handles = [unit.layer.register_forward_hook(make_hook(unit.name)) for unit in units]
+    model.eval()  # frozen BN statistics and no dropout while scoring
+    for images, labels in islice(loader, max_batches):
+        images, labels = images.to(device), labels.to(device)
+        model.zero_grad(set_to_none=True)
+        criterion(model(images), labels).backward()
+    for handle in handles:
+        handle.remove()
+    model.zero_grad(set_to_none=True)
+    # Layer-wise L2 normalization makes scores comparable across layers for a global ranking
+    return {name: (s / (s.norm() + 1e-12)).cpu() for name, s in scores.items()}
+
+def pruning_plan(scores, ratio):
+    all_scores = torch.cat(list(scores.values()))
+    num_pruned = int(ratio * all_scores.numel())
+    threshold = torch.kthvalue(all_scores, max(num_pruned, 1)).values
+    plan = {}
+    for name, s in scores.items():
+        keep = torch.nonzero(s > threshold).flatten()
+        min_keep = min(len(s), max(MIN_CHANNELS, math.ceil(len(s) * MIN_KEEP_FRACTION)))
+        if len(keep) < min_keep:
+            keep = s.topk(min_keep).indices
+        plan[name] = sorted(keep.tolist())
+    return plan
+
+# ---------------------------
+# Reporting
+# ---------------------------
+def measure(model, test_loader, device):
+    cpu_model = copy.deepcopy(model).to("cpu").eval()
+    x = torch.randn(1, 3, IMAGE_SIZE, IMAGE_SIZE)
+    with torch.no_grad():
+        latency = median_latency_ms(lambda: cpu_model(x))
+    report = evaluate_model(model, test_loader, device, LABELS).classification_report()
+    return {
+        "gflops": 2 * count_macs(cpu_model, IMAGE_SIZE) / 1e9,
+        "params_m": sum(p.numel() for p in model.parameters()) / 1e6,
+        "cpu_latency_ms": latency,
+        "isic_accuracy": float(report["accuracy"]),
+        "isic_mel_recall": float(report["mel"]["recall"]),
+        "prunable_channels": sum(channel_counts(model.base_model).values()),
+    }
+
+def print_row(r):
+    print(f"{r['round']:>5} {r['prunable_channels']:>9} {r['params_m']:>9.2f} {r['gflops']:>8.2f} "
+          f"{r['cpu_latency_ms']:>8.1f} {r['isic_accuracy']:>8.4f} {r['isic_mel_recall']:>8.4f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Iterative structured channel pruning of the served Inception-ResNet-v2 + SoftAttention model.")
+    parser.add_argument("--checkpoint", default=SERVED_CHECKPOINT, help="Starting checkpoint (as loaded by vertex/app.py).")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--ratio", type=float, default=0.2, help="Share of the remaining branch channels removed per round.")
+    parser.add_argument("--importance-batches", type=int, default=64)
+    parser.add_argument("--finetune-epochs", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--output-dir", default=OUTPUT_FOLDER)
+    args = parser.parse_args()
+
+    torch.manual_seed(SEED)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    train_loader, test_loader, class_weights = build_loaders(args.batch_size, args.num_workers)
+    criterion = nn.CrossEntropyLoss(weight=class_weights.to(device))
+    model = load_model(args.checkpoint, device)
+    # Sanity check of the surgery on this timm version before any channel is removed
+    check_surgery(model, torch.randn(2, 3, IMAGE_SIZE, IMAGE_SIZE, device=device))
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    rows = [dict(round=0, checkpoint=args.checkpoint, **measure(model, test_loader, device))]
+    print(f"{'round':>5} {'channels':>9} {'params M':>9} {'GFLOPs':>8} {'CPU ms':>8} {'ISIC acc':>8} {'mel rec':>8}")
+    print_row(rows[0])
+    for round_idx in range(1, args.rounds + 1):
+        plan = pruning_plan(taylor_importance(model, train_loader, criterion, device, args.importance_batches), args.ratio)
+        apply_pruning(model.base_model, plan)
+
+        # Fresh optimizer: the pruned layers are new parameters
+        optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
+        for _ in range(args.finetune_epochs):
+            train_one_epoch(model, train_loader, optimizer, criterion, device)
+
+        # Plain state_dict: vertex/app.py resizes its layers to the checkpoint before loading
+        path = os.path.join(args.output_dir, f"irv2_pruned_round{round_idx}.pth")
+        torch.save(model.state_dict(), path)
+        rows.append(dict(round=round_idx, checkpoint=path, **measure(model, test_loader, device)))
+        print_row(rows[-1])
+
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, "w") as f:
+        json.dump({"ratio": args.ratio, "finetune_epochs": args.finetune_epochs, "rounds": rows}, f, indent=2)
+    print(f"\n✅ Report saved to {REPORT_FILE}; serve a round with MODEL_CHECKPOINT=<path> in vertex/app.py")
+
+if __name__ == "__main__":
+    main()
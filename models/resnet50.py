@@ -1,16 +1,13 @@
 import os
+import sys
+import argparse
 import numpy as np
-import pandas as pd
 import torch
 import torch.nn as nn
 import torch.optim as optim
-import matplotlib.pyplot as plt
-import seaborn as sns
 from PIL import Image
 from torch.utils.data import DataLoader, Dataset
 from torchvision.models import resnet50
-from sklearn.metrics import confusion_matrix, classification_report
-from sklearn.model_selection import train_test_split
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 
@@ -18,6 +15,28 @@ from albumentations.pytorch import ToTensorV2
 # Define Paths
 # ---------------------------
 BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "preprocessing"))
+from metadata_store import GROUP_COLUMN, LEAK_COLUMN, LESION_COLUMN, load_metadata, paths_and_labels, train_val_split, without_leaks
+from evaluation import evaluate_model
+from checkpointing import CheckpointManager
+from distributed import DistributedResumableSampler, cleanup_distributed, is_main_process, setup_distributed
+from batch_augment import BatchAugment
+from training import CHECKPOINT_BLOCKS, enable_activation_checkpointing, fit
+
+parser = argparse.ArgumentParser(description="Train ResNet50 on HAM10000 and evaluate on ISIC2018.")
+parser.add_argument("--resume", action="store_true", help="Resume from the latest periodic checkpoint.")
+parser.add_argument("--checkpoint-dir", default="checkpoints/resnet50")
+parser.add_argument("--save-every", type=int, default=500, help="Save a resumable checkpoint every N steps.")
+parser.add_argument("--keep", type=int, default=3, help="Number of periodic checkpoints to keep.")
+parser.add_argument("--effective-batch-size", type=int, default=None, help="Samples per optimizer step (default: BATCH_SIZE).")
+parser.add_argument("--micro-batch-size", type=int, default=None, help="Samples per forward/backward pass (default: BATCH_SIZE).")
+parser.add_argument("--activation-checkpointing", action="store_true", help="Recompute residual stage activations in backward.")
+parser.add_argument("--batch-augment", action="store_true", help="Augment whole uint8 batches on the device (batch_augment.py) instead of per sample.")
+args = parser.parse_args()
+
+# Multi-process data parallel when launched with torchrun (gloo, CPU nodes), single process otherwise
+rank, world_size = setup_distributed()
+DEVICE = "cuda" if torch.cuda.is_available() and world_size == 1 else "cpu"
 
 HAM_FOLDER = os.path.join(BASE_PATH, "HAM10000")
 HAM_IMAGES_FOLDER = os.path.join(HAM_FOLDER, "HAM10000_images")
@@ -27,6 +46,8 @@ ISIC_FOLDER = os.path.join(BASE_PATH, "ISIC2018")
 ISIC_IMAGES_FOLDER = os.path.join(ISIC_FOLDER, "ISIC2018_images")
 ISIC_METADATA_FILE = os.path.join(ISIC_FOLDER, "ISIC2018_metadata")
 
+EVAL_FOLDER = os.path.join(BASE_PATH, "plots", "evaluation")
+
 CHECKPOINT_PATH = "best_model.pth" 
 
 # ---------------------------
@@ -38,6 +59,14 @@ LEARNING_RATE = 1e-4
 DROPOUT_P = 0.3
 PATIENCE = 30
 TARGET_SAMPLES_PER_CLASS = 4000  # Oversampling + Augmentation limit
+SEED = 42
+
+# The effective batch is global: micro-batch x accumulation steps x processes
+MICRO_BATCH_SIZE = args.micro_batch_size or BATCH_SIZE
+EFFECTIVE_BATCH_SIZE = args.effective_batch_size or MICRO_BATCH_SIZE * world_size
+if EFFECTIVE_BATCH_SIZE % (MICRO_BATCH_SIZE * world_size):
+    parser.error("--effective-batch-size must be a multiple of --micro-batch-size x number of processes")
+ACCUMULATION_STEPS = EFFECTIVE_BATCH_SIZE // (MICRO_BATCH_SIZE * world_size)
 
 # ---------------------------
 # Augmentation Strategy
@@ -64,66 +93,64 @@ test_transform = A.Compose([
 # Custom Dataset with Oversampling & Augmentation
 # ---------------------------
 class SkinLesionDataset(Dataset):
-    def __init__(self, metadata, images_folder, label_map, transform=None, oversample_target=None):
-        self.metadata = metadata
-        self.images_folder = images_folder
-        self.label_map = label_map
+    def __init__(self, image_paths, labels, transform=None, oversample_target=None):
+        self.image_paths = image_paths
+        self.labels = labels
         self.transform = transform
 
-        self.augmented_data = []
-        class_counts = self.metadata["dx"].value_counts().to_dict()
-
-        for cls, count in class_counts.items():
-            class_data = self.metadata[self.metadata["dx"] == cls]
-            multiplier = max(1, min(TARGET_SAMPLES_PER_CLASS // count, 10)) 
-            self.augmented_data.extend([row for _, row in class_data.iterrows()] * multiplier)
-        
-        self.augmented_data = pd.DataFrame(self.augmented_data).reset_index(drop=True)
+        self.indices = np.arange(len(labels))
+        if oversample_target:
+            classes, counts = np.unique(labels, return_counts=True)
+            multipliers = np.clip(oversample_target // counts, 1, 10)
+            self.indices = np.repeat(self.indices, multipliers[np.searchsorted(classes, labels)])
 
     def __len__(self):
-        return len(self.augmented_data)
+        return len(self.indices)
 
     def __getitem__(self, idx):
-        row = self.metadata.iloc[idx]
-        img_id = row["image_id"]
-        dx = row["dx"]
-        label = self.label_map[dx]
-
-        img_path = os.path.join(self.images_folder, f"{img_id}.jpg")
-        image = Image.open(img_path).convert("RGB")
+        i = self.indices[idx]
+        image = Image.open(self.image_paths[i]).convert("RGB")
         image = np.array(image)
 
         if self.transform:
             augmented = self.transform(image=image)
-            image = augmented["image"]
+            image = augmented["image"].float()
+        else:
+            # Decoded uint8, augmented per batch by BatchAugment (--batch-augment)
+            image = torch.from_numpy(image)
 
-        return image.float(), torch.tensor(label, dtype=torch.long)
+        return image, torch.tensor(self.labels[i], dtype=torch.long)
 
 # ---------------------------
 # Load & Prepare Datasets
 # ---------------------------
-ham_metadata = pd.read_csv(HAM_METADATA_FILE)
+ham_metadata = load_metadata(HAM_METADATA_FILE, columns=["image_id", "dx"], optional=[GROUP_COLUMN, LESION_COLUMN])
 ham_classes = sorted(ham_metadata["dx"].unique())
 label_map = {name: idx for idx, name in enumerate(ham_classes)}
 NUM_CLASSES = len(label_map)
 
 # Train/Validation Split (90% Train / 10% Validation)
-train_df, val_df = train_test_split(ham_metadata, test_size=0.10, stratify=ham_metadata["dx"])
+train_df, val_df = train_val_split(ham_metadata, test_size=0.10, seed=SEED)
 
 # Compute Class Weights
 class_counts = train_df["dx"].value_counts().to_dict()
 total_samples = sum(class_counts.values())
 class_weights = {label_map[cls]: total_samples / (len(class_counts) * count) for cls, count in class_counts.items()}
-class_weights_tensor = torch.tensor(list(class_weights.values()), dtype=torch.float).to("cuda")
+# Indexed by class, not by value_counts() order
+class_weights_tensor = torch.tensor([class_weights[i] for i in range(NUM_CLASSES)], dtype=torch.float).to(DEVICE)
 
-train_dataset = SkinLesionDataset(train_df, HAM_IMAGES_FOLDER, label_map, transform=train_transform, oversample_target=TARGET_SAMPLES_PER_CLASS)
-train_loader = DataLoader(train_dataset, batch_size=BATCH_SIZE, shuffle=True)
+# HAM10000 images are all 600x450, so decoded uint8 images collate into batches as they are
+batch_augment = BatchAugment(224, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), seed=SEED + rank) if args.batch_augment else None
+train_dataset = SkinLesionDataset(*paths_and_labels(train_df, HAM_IMAGES_FOLDER, label_map),
+                                  transform=None if args.batch_augment else train_transform, oversample_target=TARGET_SAMPLES_PER_CLASS)
+train_sampler = DistributedResumableSampler(train_dataset, seed=SEED)
+train_loader = DataLoader(train_dataset, batch_size=MICRO_BATCH_SIZE, sampler=train_sampler)
 
-val_dataset = SkinLesionDataset(val_df, HAM_IMAGES_FOLDER, label_map, transform=test_transform)
+val_dataset = SkinLesionDataset(*paths_and_labels(val_df, HAM_IMAGES_FOLDER, label_map), transform=test_transform)
 val_loader = DataLoader(val_dataset, batch_size=BATCH_SIZE, shuffle=False)
 
-isic_metadata = pd.read_csv(ISIC_METADATA_FILE)
-test_dataset = SkinLesionDataset(isic_metadata, ISIC_IMAGES_FOLDER, label_map, transform=test_transform)
+isic_metadata = without_leaks(load_metadata(ISIC_METADATA_FILE, columns=["image_id", "dx"], optional=[LEAK_COLUMN]))
+test_dataset = SkinLesionDataset(*paths_and_labels(isic_metadata, ISIC_IMAGES_FOLDER, label_map), transform=test_transform)
 test_loader = DataLoader(test_dataset, batch_size=BATCH_SIZE, shuffle=False)
 
 # ---------------------------
@@ -140,7 +167,9 @@ conv = nn.Sequential(
     nn.Linear(2048, NUM_CLASSES)
 )
 
-model = nn.Sequential(resnet, conv).to("cuda")
+model = nn.Sequential(resnet, conv).to(DEVICE)
+if args.activation_checkpointing:
+    enable_activation_checkpointing(model, CHECKPOINT_BLOCKS["resnet50"])
 
 optimizer = optim.Adam(filter(lambda p: p.requires_grad, model.parameters()), lr=LEARNING_RATE)
 criterion = nn.CrossEntropyLoss(weight=class_weights_tensor)
@@ -148,94 +177,20 @@ criterion = nn.CrossEntropyLoss(weight=class_weights_tensor)
 # ---------------------------
 # Training with Checkpointing
 # ---------------------------
-best_val_acc = 0
-patience_counter = 0
-
-for epoch in range(NUM_EPOCHS):
-    model.train()
-    train_loss, correct, total = 0.0, 0, 0
-    for images, labels in train_loader:
-        images, labels = images.to("cuda"), labels.to("cuda")
-        optimizer.zero_grad()
-        outputs = model(images)
-        loss = criterion(outputs, labels)
-        loss.backward()
-        optimizer.step()
-
-        train_loss += loss.item()
-        correct += (outputs.argmax(dim=1) == labels).sum().item()
-        total += labels.size(0)
-
-    train_acc = correct / total
-    train_loss /= len(train_loader)
-
-    model.eval()
-    val_loss, correct, total = 0.0, 0, 0
-    with torch.no_grad():
-        for images, labels in val_loader:
-            images, labels = images.to("cuda"), labels.to("cuda")
-            outputs = model(images)
-            val_loss += criterion(outputs, labels).item()
-            correct += (outputs.argmax(dim=1) == labels).sum().item()
-            total += labels.size(0)
-
-    val_acc = correct / total
-    val_loss /= len(val_loader)
-
-    print(f"Epoch [{epoch+1}/{NUM_EPOCHS}] -> Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.4f}, Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}")
-
-    if val_acc > best_val_acc:
-        best_val_acc = val_acc
-        patience_counter = 0
-        torch.save(model.state_dict(), CHECKPOINT_PATH)
-        print("New best model saved!")
-    else:
-        patience_counter += 1
-        if patience_counter >= PATIENCE:
-            print("Early stopping triggered!")
-            break
-
-model.load_state_dict(torch.load(CHECKPOINT_PATH))
-model.eval()
+checkpoints = CheckpointManager(args.checkpoint_dir, keep=args.keep, save_every=args.save_every)
+fit(model, optimizer, criterion, train_loader, val_loader, DEVICE, checkpoints, CHECKPOINT_PATH, NUM_EPOCHS, PATIENCE,
+    SEED, resume=args.resume, accumulation_steps=ACCUMULATION_STEPS, batch_augment=batch_augment)
 
 # ---------------------------
-# Evaluation Function
+# Evaluation on ISIC2018
 # ---------------------------
-def evaluate_model():
-    y_true, y_pred = [], []
-
-    with torch.no_grad():
-        for images, labels in test_loader:
-            images, labels = images.to("cuda"), labels.to("cuda")
-            outputs = model(images)
-            preds = outputs.argmax(dim=1)
-
-            y_true.extend(labels.cpu().numpy())
-            y_pred.extend(preds.cpu().numpy())
+if is_main_process():
+    model.load_state_dict(torch.load(CHECKPOINT_PATH))
+    model.eval()
 
+    evaluator = evaluate_model(model, test_loader, DEVICE, ham_classes)
     print("\n**Classification Report on ISIC2018:**")
-    print(classification_report(y_true, y_pred, target_names=ham_classes))
-
-    cm = confusion_matrix(y_true, y_pred)
-    plt.figure(figsize=(8, 6))
-    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=ham_classes, yticklabels=ham_classes)
-    plt.title("Confusion Matrix")
-    plt.xlabel("Predicted")
-    plt.ylabel("True")
-    plt.show()
-
-evaluate_model()
-
-y_true, y_pred = [], []
-
-with torch.no_grad():
-    for images, labels in test_loader:
-        images, labels = images.to("cuda"), labels.to("cuda")
-        outputs = model(images)
-        preds = outputs.argmax(dim=1)
-
-        y_true.extend(labels.cpu().numpy())
-        y_pred.extend(preds.cpu().numpy())
+    print(evaluator.report_text())
+    evaluator.save(EVAL_FOLDER, "resnet50_isic2018").result()
 
-print("\n**Classification Report on ISIC2018:**")
-print(classification_report(y_true, y_pred, target_names=ham_classes))
+cleanup_distributed()
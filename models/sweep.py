@@ -0,0 +1,374 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision.models import resnet50
+import albumentations as A
+from albumentations.pytorch import ToTensorV2
+
+# ---------------------------
+# Define Paths
+# ---------------------------
+BASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.join(BASE_PATH, "preprocessing"))
+from metadata_store import GROUP_COLUMN, LESION_COLUMN, load_metadata, paths_and_labels, train_val_split
+from evaluation import StreamingEvaluator
+from training import train_one_epoch
+from batch_augment import BatchAugment
+
+HAM_FOLDER = os.path.join(BASE_PATH, "HAM10000")
+HAM_IMAGES_FOLDER = os.path.join(HAM_FOLDER, "HAM10000_images")
+HAM_METADATA_FILE = os.path.join(HAM_FOLDER, "HAM10000_metadata")
+
+CACHE_FOLDER = os.path.join(HAM_FOLDER, "sweep_cache")
+SWEEP_DB_PATH = "sweep.db"
+
+# ---------------------------
+# Settings
+# ---------------------------
+IMAGE_SIZE = 224
+SEED = 42
+PRUNING_METRIC = "mel"  # successive halving ranks trials by validation recall of this class
+
+# Module-level constants of resnet50.py that a trial may override
+SEARCH_SPACE = {
+    "learning_rate": ("log_uniform", 1e-5, 1e-3),
+    "dropout_p": ("uniform", 0.0, 0.5),
+    "patience": ("choice", [5, 10, 30]),
+    "target_samples_per_class": ("choice", [2000, 4000, 6000]),
+    "batch_size": ("choice", [16, 32, 64]),
+}
+
+def sample_params(rng):
+    params = {}
+    for name, (kind, *spec) in SEARCH_SPACE.items():
+        if kind == "log_uniform":
+            params[name] = float(np.exp(rng.uniform(np.log(spec[0]), np.log(spec[1]))))
+        elif kind == "uniform":
+            params[name] = float(rng.uniform(spec[0], spec[1]))
+        else:
+            params[name] = spec[0][int(rng.integers(len(spec[0])))]
+    return params
+
+# Training batches are augmented whole after collation (batch_augment.py), seeded per trial
+def train_augment(trial_id):
+    return BatchAugment(IMAGE_SIZE, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), seed=SEED + trial_id)
+
+test_transform = A.Compose([
+    A.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
+    ToTensorV2(),
+])
+
+# ---------------------------
+# Shared Decoded Dataset
+# ---------------------------
+# Images are decoded and resized once into a uint8 .npy per split. Trials open
+# it with mmap_mode="r", so every worker process reads the same page-cached
+# pixels instead of decoding JPEGs again.
+def decode_chunk(image_paths, images_file, start):
+    images = np.load(images_file, mmap_mode="r+")
+    for offset, path in enumerate(image_paths):
+        image = Image.open(path).convert("RGB").resize((IMAGE_SIZE, IMAGE_SIZE), Image.BILINEAR)
+        images[start + offset] = np.asarray(image)
+    images.flush()
+    return len(image_paths)
+
+def build_cache(workers, chunk_size=256):
+    os.makedirs(CACHE_FOLDER, exist_ok=True)
+    metadata = load_metadata(HAM_METADATA_FILE, columns=["image_id", "dx"], optional=[GROUP_COLUMN, LESION_COLUMN])
+    class_names = sorted(metadata["dx"].unique())
+    label_map = {name: idx for idx, name in enumerate(class_names)}
+    # Same seeded split as resnet50.py
+    train_df, val_df = train_val_split(metadata, test_size=0.10, seed=SEED)
+
+    for split, df in (("train", train_df), ("val", val_df)):
+        images_file = os.path.join(CACHE_FOLDER, f"{split}_images_{IMAGE_SIZE}.npy")
+        labels_file = os.path.join(CACHE_FOLDER, f"{split}_labels.npy")
+        ids_file = os.path.join(CACHE_FOLDER, f"{split}_ids.npy")
+        image_ids = df["image_id"].to_numpy(dtype=str)
+        # Rebuilt when the split changes, e.g. after dedup.py adds group IDs
+        if (os.path.exists(images_file) and os.path.exists(labels_file) and os.path.exists(ids_file)
+                and np.array_equal(np.load(ids_file), image_ids)):
+            continue
+        image_paths, labels = paths_and_labels(df, HAM_IMAGES_FOLDER, label_map)
+        tmp_file = images_file + ".tmp.npy"
+        np.lib.format.open_memmap(tmp_file, mode="w+", dtype=np.uint8, shape=(len(labels), IMAGE_SIZE, IMAGE_SIZE, 3)).flush()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(decode_chunk, image_paths[start:start + chunk_size], tmp_file, start)
+                       for start in range(0, len(labels), chunk_size)]
+            for future in as_completed(futures):
+                future.result()
+        os.replace(tmp_file, images_file)
+        np.save(labels_file, labels)
+        np.save(ids_file, image_ids)
+        print(f"Cached {len(labels)} {split} images -> {images_file}")
+    return class_names
+
+class CachedLesionDataset(Dataset):
+    def __init__(self, split, transform=None, oversample_target=None):
+        self.images_file = os.path.join(CACHE_FOLDER, f"{split}_images_{IMAGE_SIZE}.npy")
+        self.labels = np.load(os.path.join(CACHE_FOLDER, f"{split}_labels.npy"))
+        self.transform = transform
+        self.images = None  # opened lazily so the memmap is never pickled into workers
+
+        self.indices = np.arange(len(self.labels))
+        if oversample_target:
+            classes, counts = np.unique(self.labels, return_counts=True)
+            multipliers = np.clip(oversample_target // counts, 1, 10)
+            self.indices = np.repeat(self.indices, multipliers[np.searchsorted(classes, self.labels)])
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if self.images is None:
+            self.images = np.load(self.images_file, mmap_mode="r")
+        i = self.indices[idx]
+        image = np.array(self.images[i])
+
+        if self.transform:
+            augmented = self.transform(image=image)
+            image = augmented["image"].float()
+        else:
+            # Cached uint8 pixels; the training batch is augmented by BatchAugment
+            image = torch.from_numpy(image)
+
+        return image, torch.tensor(self.labels[i], dtype=torch.long)
+
+# ---------------------------
+# Results DB
+# ---------------------------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL,
+    epochs INTEGER NOT NULL DEFAULT 0,
+    best_score REAL,
+    best_val_acc REAL,
+    started TEXT,
+    finished TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_trials_sweep_score ON trials (sweep, best_score);
+
+CREATE TABLE IF NOT EXISTS epochs (
+    trial_id INTEGER NOT NULL,
+    epoch INTEGER NOT NULL,
+    train_loss REAL,
+    val_loss REAL,
+    val_acc REAL,
+    score REAL,
+    images_per_sec REAL,
+    PRIMARY KEY (trial_id, epoch)
+);
+
+CREATE TABLE IF NOT EXISTS rungs (
+    sweep TEXT NOT NULL,
+    rung INTEGER NOT NULL,
+    trial_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (sweep, rung, trial_id)
+);
+"""
+
+TRIAL_COLUMNS = ["id", "sweep", "params", "status", "epochs", "best_score", "best_val_acc", "started", "finished"]
+
+class SweepDB:
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def add_trial(self, sweep, params):
+        with self.connect() as conn:
+            cursor = conn.execute("INSERT INTO trials (sweep, params, status) VALUES (?, ?, 'pending')", (sweep, json.dumps(params)))
+            return cursor.lastrowid
+
+    def start_trial(self, trial_id):
+        with self.connect() as conn:
+            conn.execute("UPDATE trials SET status = 'running', started = ? WHERE id = ?", (datetime.utcnow().isoformat(), trial_id))
+
+    def record_epoch(self, trial_id, epoch, metrics):
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO epochs (trial_id, epoch, train_loss, val_loss, val_acc, score, images_per_sec) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (trial_id, epoch, metrics["train_loss"], metrics["val_loss"], metrics["val_acc"], metrics["score"], metrics["images_per_sec"]),
+            )
+            conn.execute(
+                "UPDATE trials SET epochs = ?, best_score = MAX(COALESCE(best_score, 0), ?), "
+                "best_val_acc = MAX(COALESCE(best_val_acc, 0), ?) WHERE id = ?",
+                (epoch, metrics["score"], metrics["val_acc"], trial_id),
+            )
+
+    def report_rung(self, sweep, rung, trial_id, score, eta):
+        # Asynchronous successive halving: a trial continues past a rung only while it is in the
+        # top 1/eta of all trials that have reported at that rung so far. Trials reaching a rung
+        # early are compared against fewer peers, which is what lets workers never wait on each other.
+        with self.connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("INSERT OR REPLACE INTO rungs (sweep, rung, trial_id, score) VALUES (?, ?, ?, ?)", (sweep, rung, trial_id, score))
+                scores = [row[0] for row in conn.execute("SELECT score FROM rungs WHERE sweep = ? AND rung = ? ORDER BY score DESC", (sweep, rung))]
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        keep = max(1, len(scores) // eta)
+        return len(scores) < eta or score >= scores[keep - 1]
+
+    def finish_trial(self, trial_id, status):
+        with self.connect() as conn:
+            conn.execute("UPDATE trials SET status = ?, finished = ? WHERE id = ?", (status, datetime.utcnow().isoformat(), trial_id))
+
+    def leaderboard(self, sweep, limit=10):
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(TRIAL_COLUMNS)} FROM trials WHERE sweep = ? ORDER BY best_score DESC LIMIT ?",
+                (sweep, limit),
+            ).fetchall()
+        return [dict(zip(TRIAL_COLUMNS, row)) for row in rows]
+
+# ---------------------------
+# Trial
+# ---------------------------
+def build_model(num_classes, dropout_p):
+    backbone = nn.Sequential(*list(resnet50(weights="IMAGENET1K_V1").children())[:-2])
+    head = nn.Sequential(
+        nn.AdaptiveAvgPool2d((1, 1)),
+        nn.Flatten(),
+        nn.Dropout(p=dropout_p),
+        nn.Linear(2048, num_classes)
+    )
+    return nn.Sequential(backbone, head)
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    rungs = []
+    epochs = min_epochs
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs
+
+def run_trial(db_path, sweep, trial_id, params, class_names, max_epochs, min_epochs, eta, threads):
+    torch.set_num_threads(threads)
+    torch.manual_seed(SEED + trial_id)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    db = SweepDB(db_path)
+    db.start_trial(trial_id)
+
+    train_dataset = CachedLesionDataset("train", oversample_target=params["target_samples_per_class"])
+    val_dataset = CachedLesionDataset("val", test_transform)
+    train_loader = DataLoader(train_dataset, batch_size=params["batch_size"], shuffle=True)
+    val_loader = DataLoader(val_dataset, batch_size=64, shuffle=False)
+    augment = train_augment(trial_id)
+
+    counts = np.bincount(train_dataset.labels, minlength=len(class_names))
+    class_weights = torch.tensor(counts.sum() / (len(class_names) * counts), dtype=torch.float).to(device)
+    model = build_model(len(class_names), params["dropout_p"]).to(device)
+    optimizer = optim.Adam(model.parameters(), lr=params["learning_rate"])
+    criterion = nn.CrossEntropyLoss(weight=class_weights)
+
+    rungs = set(rung_epochs(min_epochs, max_epochs, eta))
+    best_val_acc, best_score, patience_counter = 0.0, 0.0, 0
+    status = "completed"
+    for epoch in range(1, max_epochs + 1):
+        stats, throughput = train_one_epoch(model, train_loader, optimizer, criterion, device, batch_transform=augment)
+
+        evaluator = StreamingEvaluator(class_names)
+        model.eval()
+        with torch.no_grad():
+            for images, labels in val_loader:
+                images, labels = images.to(device), labels.to(device)
+                outputs = model(images)
+                evaluator.update(outputs, labels, criterion(outputs, labels).item())
+        score = evaluator.classification_report()[PRUNING_METRIC]["recall"]
+        best_score = max(best_score, score)
+        db.record_epoch(trial_id, epoch, {
+            "train_loss": stats["train_loss"] / stats["num_batches"],
+            "val_loss": evaluator.loss,
+            "val_acc": evaluator.accuracy,
+            "score": score,
+            "images_per_sec": throughput["images_per_sec"],
+        })
+
+        if evaluator.accuracy > best_val_acc:
+            best_val_acc = evaluator.accuracy
+            patience_counter = 0
+        else:
+            patience_counter += 1
+            if patience_counter >= params["patience"]:
+                status = "early_stopped"
+                break
+
+        if epoch in rungs and not db.report_rung(sweep, epoch, trial_id, best_score, eta):
+            status = "pruned"
+            break
+
+    db.finish_trial(trial_id, status)
+    return trial_id, status, best_score
+
+# ---------------------------
+# Sweep Runner
+# ---------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Parallel hyperparameter sweep for ResNet50 with successive-halving pruning on val mel recall.")
+    parser.add_argument("--name", default=datetime.utcnow().strftime("sweep_%Y%m%d_%H%M%S"), help="Sweep name in the results DB.")
+    parser.add_argument("--trials", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=4, help="Trials trained in parallel.")
+    parser.add_argument("--max-epochs", type=int, default=27)
+    parser.add_argument("--min-epochs", type=int, default=1, help="Epochs before the first pruning rung.")
+    parser.add_argument("--eta", type=int, default=3, help="Keep the top 1/eta of trials at each rung.")
+    parser.add_argument("--db", default=SWEEP_DB_PATH)
+    parser.add_argument("--seed", type=int, default=SEED)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    class_names = build_cache(workers=os.cpu_count() or 1)
+    print(f"Dataset cache ready in {time.perf_counter() - start:.1f}s")
+
+    db = SweepDB(args.db)
+    rng = np.random.default_rng(args.seed)
+    trials = [(db.add_trial(args.name, params), params) for params in (sample_params(rng) for _ in range(args.trials))]
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    print(f"Sweep '{args.name}': {args.trials} trials, {args.workers} workers x {threads} threads, "
+          f"rungs at epochs {rung_epochs(args.min_epochs, args.max_epochs, args.eta)}")
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as executor:
+        futures = [executor.submit(run_trial, args.db, args.name, trial_id, params, class_names,
+                                   args.max_epochs, args.min_epochs, args.eta, threads)
+                   for trial_id, params in trials]
+        for future in as_completed(futures):
+            trial_id, status, best_score = future.result()
+            print(f"Trial {trial_id}: {status}, best {PRUNING_METRIC} recall {best_score:.4f}")
+
+    print(f"\nTop trials by {PRUNING_METRIC} recall:")
+    for trial in db.leaderboard(args.name):
+        print(f"  #{trial['id']:<4} {trial['status']:<14} epochs={trial['epochs']:<3} "
+              f"{PRUNING_METRIC}_recall={trial['best_score'] or 0:.4f} val_acc={trial['best_val_acc'] or 0:.4f} {trial['params']}")
+
+if __name__ == "__main__":
+    main()
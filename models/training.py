@@ -0,0 +1,240 @@
+import time
+import resource
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from itertools import islice
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.distributed as dist
+from torch.utils.checkpoint import checkpoint
+from distributed import (all_gather_states, all_reduce_sum, broadcast_flag, get_rank, get_world_size,
+                         is_main_process, wrap_model)
+
+# ---------------------------
+# Settings
+# ---------------------------
+# Residual stages wrapped by activation checkpointing, by model
+CHECKPOINT_BLOCKS = {
+    # Block35 x10, Block17 x20, Block8 x9 of serving_model.InceptionResNetV2_SoftAttention
+    "inception_resnet_v2": ["base_model.repeat", "base_model.repeat_1", "base_model.repeat_2"],
+    "resnet50": ["0.4", "0.5", "0.6", "0.7"],  # layer1-4 of nn.Sequential(backbone, head)
+}
+
+# ---------------------------
+# Activation Checkpointing
+# ---------------------------
+@contextmanager
+def frozen_batchnorm_stats(module):
+    # The recomputed forward must not update BatchNorm running stats a second time
+    norms = [m for m in module.modules() if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.track_running_stats]
+    saved = [(m.momentum, m.num_batches_tracked.clone()) for m in norms]
+    for m in norms:
+        m.momentum = 0.0
+    try:
+        yield
+    finally:
+        for m, (momentum, tracked) in zip(norms, saved):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(tracked)
+
+def recompute_contexts(module):
+    return nullcontext(), frozen_batchnorm_stats(module)
+
+class CheckpointedSequential(nn.Sequential):
+    # Same children (and state_dict keys) as the wrapped nn.Sequential; each block's
+    # activations are recomputed during backward instead of being kept in memory
+    def forward(self, x):
+        if not (self.training and torch.is_grad_enabled()):
+            return super().forward(x)
+        for module in self:
+            x = checkpoint(module, x, use_reentrant=False, context_fn=partial(recompute_contexts, module))
+        return x
+
+def enable_activation_checkpointing(model, block_names):
+    for name in block_names:
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        blocks = getattr(parent, child_name)
+        if not isinstance(blocks, nn.Sequential):
+            raise TypeError(f"Activation checkpointing expects an nn.Sequential at '{name}', got {type(blocks).__name__}")
+        setattr(parent, child_name, CheckpointedSequential(blocks._modules))
+    return model
+
+# ---------------------------
+# Gradient Accumulation
+# ---------------------------
+def summed_loss(criterion, outputs, labels):
+    # Class-weighted per-sample losses summed, as CrossEntropyLoss computes them before its mean
+    return F.cross_entropy(outputs, labels, weight=getattr(criterion, "weight", None), reduction="sum")
+
+def batch_normalizer(criterion, labels):
+    # Denominator of CrossEntropyLoss's weighted mean over the whole effective batch, so the
+    # micro-batch sums divided by it add up to exactly the loss of one large batch
+    weight = getattr(criterion, "weight", None)
+    if weight is None:
+        return float(len(labels))
+    return weight.detach().cpu()[labels].sum().item()
+
+def peak_memory_mb(device):
+    if torch.device(device).type == "cuda":
+        return torch.cuda.max_memory_allocated(device) / 2**20
+    # ru_maxrss is in KiB on Linux and covers the whole process lifetime
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def train_one_epoch(model, loader, optimizer, criterion, device, accumulation_steps=1, stats=None, on_step=None,
+                    batch_transform=None):
+    stats = stats if stats is not None else {"train_loss": 0.0, "correct": 0, "total": 0, "num_batches": 0}
+    if torch.device(device).type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+    model.train()
+    batches = iter(loader)
+    num_images = 0
+    start = time.perf_counter()
+    while True:
+        micro_batches = list(islice(batches, accumulation_steps))
+        if not micro_batches:
+            break
+        normalizer = batch_normalizer(criterion, torch.cat([labels for _, labels in micro_batches]))
+        scale = 1.0
+        if dist.is_initialized():
+            # DDP averages gradients over ranks, so normalize by the global batch weight and undo the average
+            total = torch.tensor([normalizer], dtype=torch.float64)
+            dist.all_reduce(total)
+            normalizer, scale = total.item(), float(dist.get_world_size())
+
+        optimizer.zero_grad()
+        step_loss, step_samples = 0.0, 0
+        for i, (images, labels) in enumerate(micro_batches):
+            images, labels = images.to(device), labels.to(device)
+            if batch_transform is not None:
+                # e.g. BatchAugment: uint8 batches are augmented on the device after collation
+                images = batch_transform(images)
+            # Only the last micro-batch of a step all-reduces gradients under DDP
+            sync = i == len(micro_batches) - 1 or not hasattr(model, "no_sync")
+            with nullcontext() if sync else model.no_sync():
+                outputs = model(images)
+                loss = summed_loss(criterion, outputs, labels) / normalizer
+                (loss * scale).backward()
+            step_loss += loss.item()
+            stats["correct"] += (outputs.argmax(dim=1) == labels).sum().item()
+            step_samples += labels.size(0)
+        optimizer.step()
+
+        stats["train_loss"] += step_loss
+        stats["total"] += step_samples
+        stats["num_batches"] += 1
+        num_images += step_samples
+        if on_step is not None:
+            on_step(step_samples)
+
+    elapsed = time.perf_counter() - start
+    return stats, {
+        "images_per_sec": num_images / max(elapsed, 1e-9),
+        "peak_memory_mb": peak_memory_mb(device),
+    }
+
+# ---------------------------
+# Training Loop
+# ---------------------------
+def validate(model, loader, criterion, device):
+    model.eval()
+    val_loss, correct, total = 0.0, 0, 0
+    with torch.no_grad():
+        for images, labels in loader:
+            images, labels = images.to(device), labels.to(device)
+            outputs = model(images)
+            val_loss += criterion(outputs, labels).item()
+            correct += (outputs.argmax(dim=1) == labels).sum().item()
+            total += labels.size(0)
+    return val_loss / len(loader), correct / total
+
+def fit(model, optimizer, criterion, train_loader, val_loader, device, checkpoints, best_path, num_epochs, patience,
+        seed, resume=False, accumulation_steps=1, batch_augment=None):
+    # Resumable (optionally distributed) training shared by IRv2.py and resnet50.py: periodic
+    # checkpoints via `checkpoints` (CheckpointManager), the best validation model at best_path
+    # and patience-based early stopping. train_loader must use a DistributedResumableSampler.
+    rank, world_size = get_rank(), get_world_size()
+    train_sampler = train_loader.sampler
+    # Augmentation randomness differs per rank; the sampler order is shared via seed
+    torch.manual_seed(seed + rank)
+
+    # Everything besides model/optimizer/sampler/RNG needed to continue exactly where a run stopped
+    state = {"epoch": 0, "step": 0, "best_val_acc": 0, "patience_counter": 0,
+             "train_loss": 0.0, "correct": 0, "total": 0, "num_batches": 0}
+    if resume:
+        # Every rank loads the same (rank 0) checkpoint from the shared checkpoint directory
+        resumed = checkpoints.resume(model, optimizer, sampler=train_sampler)
+        if resumed is not None:
+            state.update(resumed["training_state"])
+            if not is_main_process():
+                torch.manual_seed(seed + rank + state["step"])
+            generators = state.get("batch_augment_generators")
+            if batch_augment is not None and generators is not None and rank < len(generators):
+                # Continues this rank's augmentation stream exactly where the checkpoint left it
+                batch_augment.generator.set_state(generators[rank])
+
+    ddp_model = wrap_model(model)
+
+    def save_checkpoint(force=False):
+        if batch_augment is not None and (force or checkpoints.due(state["step"])):
+            # Collective: every rank contributes its BatchAugment generator state, rank 0 stores them
+            state["batch_augment_generators"] = all_gather_states(batch_augment.generator.get_state())
+        # Only rank 0 writes; all ranks hold identical weights after every step
+        if not is_main_process():
+            return
+        if force:
+            checkpoints.save(state["step"], model=model, optimizer=optimizer, sampler=train_sampler, training_state=state)
+        else:
+            checkpoints.maybe_save(state["step"], model=model, optimizer=optimizer, sampler=train_sampler, training_state=state)
+
+    def on_step(num_samples):
+        # Called after every optimizer step, so checkpoints never land mid-accumulation
+        state["step"] += 1
+        train_sampler.advance(num_samples)
+        save_checkpoint()
+
+    for epoch in range(state["epoch"], num_epochs):
+        if epoch != state["epoch"]:
+            state.update(epoch=epoch, train_loss=0.0, correct=0, total=0, num_batches=0)
+            train_sampler.set_epoch(epoch)
+
+        _, throughput = train_one_epoch(ddp_model, train_loader, optimizer, criterion, device,
+                                        accumulation_steps=accumulation_steps, stats=state, on_step=on_step,
+                                        batch_transform=batch_augment)
+        # Per-rank loss contributions add up to the global batch loss
+        train_loss, correct, total, images_per_sec = all_reduce_sum(
+            [state["train_loss"], state["correct"], state["total"], throughput["images_per_sec"]])
+        train_acc = correct / total
+        train_loss = train_loss / state["num_batches"]
+
+        # Validation, best-model checkpointing and early stopping run on rank 0 only
+        stop = False
+        if is_main_process():
+            val_loss, val_acc = validate(model, val_loader, criterion, device)
+            print(f"Epoch [{epoch+1}/{num_epochs}] -> Train Loss: {train_loss:.4f}, Train Acc: {train_acc:.4f}, Val Loss: {val_loss:.4f}, Val Acc: {val_acc:.4f}")
+            print(f"    {images_per_sec:.1f} img/s, peak memory {throughput['peak_memory_mb']:.0f} MB "
+                  f"(batch {accumulation_steps * train_loader.batch_size * world_size} = "
+                  f"{accumulation_steps} x {train_loader.batch_size} x {world_size} processes)")
+
+            if val_acc > state["best_val_acc"]:
+                state["best_val_acc"] = val_acc
+                state["patience_counter"] = 0
+                torch.save(model.state_dict(), best_path)
+                print("New best model saved!")
+            else:
+                state["patience_counter"] += 1
+                if state["patience_counter"] >= patience:
+                    print("Early stopping triggered!")
+                    stop = True
+        stop = broadcast_flag(stop)
+
+        # Epoch boundary checkpoint: resuming from it starts the next epoch
+        state.update(epoch=epoch + 1, train_loss=0.0, correct=0, total=0, num_batches=0)
+        train_sampler.set_epoch(epoch + 1)
+        save_checkpoint(force=True)
+        if stop:
+            break
+
+    checkpoints.wait()
+    return state
@@ -0,0 +1,2 @@
+# Command-line entry points for the MoleMonitoring pipeline: python -m molemonitoring --help
+# Only the standard library is imported here; each subcommand imports what it needs when it runs.
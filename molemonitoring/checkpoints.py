@@ -0,0 +1,41 @@
+import os
+import torch
+from torch.utils.data import DataLoader
+
+# Imported by the evaluate/export subcommands after models/, preprocessing/ and vertex/
+# are on sys.path. The served architecture and its data pipeline come from models/common.py,
+# whose loader also accepts channel-pruned checkpoints.
+from metadata_store import LEAK_COLUMN, load_metadata, paths_and_labels, without_leaks
+from evaluation import evaluate_models
+from common import IMAGE_SIZE, ISIC_IMAGES_FOLDER, ISIC_METADATA_FILE, LABELS, SkinLesionDataset, load_model, test_transform
+
+def isic_loader(batch_size):
+    label_map = {name: idx for idx, name in enumerate(LABELS)}
+    metadata = without_leaks(load_metadata(ISIC_METADATA_FILE, columns=["image_id", "dx"], optional=[LEAK_COLUMN]))
+    dataset = SkinLesionDataset(*paths_and_labels(metadata, ISIC_IMAGES_FOLDER, label_map), transform=test_transform)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=min(4, os.cpu_count() or 1))
+
+def evaluate_checkpoints(paths, output_dir, batch_size):
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    models = {os.path.splitext(os.path.basename(path))[0]: load_model(path, device) for path in paths}
+    evaluators = evaluate_models(models, isic_loader(batch_size), device, LABELS)
+    writes = []
+    for name, evaluator in evaluators.items():
+        print(f"\n**{name} on ISIC2018:**")
+        print(evaluator.report_text())
+        writes.append(evaluator.save(output_dir, name))
+    for write in writes:
+        write.result()
+    print(f"\n✅ Reports saved to {output_dir}")
+
+def export_checkpoint(path, output):
+    model = load_model(path, "cpu").eval()
+    # A forward pass at the serving resolution catches shape mismatches before deployment
+    with torch.no_grad():
+        logits = model(torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+    if logits.shape != (1, len(LABELS)):
+        raise SystemExit(f"{path} produces {tuple(logits.shape)} logits, expected (1, {len(LABELS)})")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    torch.save(model.state_dict(), output)
+    params = sum(p.numel() for p in model.parameters()) / 1e6
+    print(f"✅ Exported {path} ({params:.1f}M parameters) -> {output}")
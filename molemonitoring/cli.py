@@ -0,0 +1,197 @@
+import os
+import sys
+import runpy
+import argparse
+from contextlib import contextmanager
+
+# Only the standard library is imported at module level so `--help` and argument errors
+# return immediately. TensorFlow, torch, timm, seaborn, skimage, etc. are imported by the
+# script or module a subcommand runs, and only when it runs.
+
+DEFAULT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+TRAIN_SCRIPTS = {
+    "baseline": "baseline.py",
+    "cnn_with_weights": "cnn_with_weights.py",
+    "resnet50": "resnet50.py",
+    "irv2": "IRv2.py",
+    "sweep": "sweep.py",
+    "prune": "prune_irv2.py",
+    "calibrate": "calibrate_temperature.py",
+    "fusion-heads": "fit_fusion_heads.py",
+}
+# Run in this order whatever order they are given in
+PREPROCESS_STAGES = {
+    "images": ("process_images.py", []),
+    "crops": ("lesion_crop.py", ["crops"]),
+    "dedup": ("dedup.py", []),
+}
+SERVE_APPS = {"predict": "app:app", "sync": "sync_service:sync_app"}
+
+# ---------------------------
+# Running the Existing Scripts
+# ---------------------------
+@contextmanager
+def script_context(folder, argv):
+    # The scripts resolve data paths relative to their own folder and import their
+    # siblings by name, so they run from that folder with it on sys.path
+    previous = os.getcwd(), list(sys.argv), list(sys.path)
+    os.chdir(folder)
+    sys.path.insert(0, folder)
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        os.chdir(previous[0])
+        sys.argv, sys.path[:] = previous[1], previous[2]
+
+def run_script(root, folder, script, argv=()):
+    folder = os.path.join(root, folder)
+    path = os.path.join(folder, script)
+    if not os.path.exists(path):
+        raise SystemExit(f"{path} not found (is --root the repository root?)")
+    print(f"▶ {os.path.relpath(path, root)} {' '.join(argv)}".rstrip())
+    with script_context(folder, [path, *argv]):
+        runpy.run_path(path, run_name="__main__")
+
+def add_paths(root, *folders):
+    for folder in folders:
+        path = os.path.join(root, folder)
+        if path not in sys.path:
+            sys.path.append(path)
+
+# ---------------------------
+# Subcommands
+# ---------------------------
+def cmd_ingest(args):
+    run_script(args.root, "preprocessing", "zip_merge.py")
+    if not args.skip_metadata:
+        run_script(args.root, "preprocessing", "update_metadata.py")
+
+def cmd_preprocess(args):
+    unknown = sorted(set(args.stages) - set(PREPROCESS_STAGES))
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(unknown)} (choose from {', '.join(PREPROCESS_STAGES)})")
+    for stage, (script, argv) in PREPROCESS_STAGES.items():
+        if stage in (args.stages or PREPROCESS_STAGES):
+            run_script(args.root, "preprocessing", script, argv + (args.crop_args if stage == "crops" else []))
+
+def cmd_skin_tone(args):
+    run_script(args.root, "preprocessing", "fitzpatrick.py")
+
+def cmd_plots(args):
+    run_script(args.root, "preprocessing", "generate_plots.py", args.args)
+
+def cmd_train(args):
+    run_script(args.root, "models", TRAIN_SCRIPTS[args.model], args.args)
+
+def cmd_evaluate(args):
+    add_paths(args.root, "models", "preprocessing", "vertex")
+    from molemonitoring.checkpoints import evaluate_checkpoints
+    evaluate_checkpoints(args.checkpoints, args.output_dir, args.batch_size)
+
+def cmd_export(args):
+    add_paths(args.root, "models", "preprocessing", "vertex")
+    from molemonitoring.checkpoints import export_checkpoint
+    export_checkpoint(args.checkpoint, args.output)
+    if args.similarity_index:
+        run_script(args.root, "vertex", "similarity_index.py", ["--output", os.path.abspath(args.similarity_index)])
+
+def cmd_score(args):
+    # batch_score.py runs from vertex/, so paths are made absolute first
+    argv = [os.path.abspath(args.source), "--output", os.path.abspath(args.output), "--format", args.format,
+            "--batch-size", str(args.batch_size), "--checkpoint-every", str(args.checkpoint_every)]
+    if args.workers:
+        argv += ["--workers", str(args.workers)]
+    if args.restart:
+        argv.append("--restart")
+    run_script(args.root, "vertex", "batch_score.py", argv)
+
+def cmd_serve(args):
+    vertex = os.path.join(args.root, "vertex")
+    if args.workers:
+        # Same server and config as the Dockerfile (torch threads and batch size from
+        # autotune.json, --workers overrides its worker count); exec so signals reach gunicorn directly
+        os.chdir(vertex)
+        os.execvp("gunicorn", ["gunicorn", "-c", "gunicorn.conf.py", "-b", f"{args.host}:{args.port}", "-w", str(args.workers),
+                               "--timeout", str(args.timeout), SERVE_APPS[args.app]])
+    module, name = SERVE_APPS[args.app].split(":")
+    with script_context(vertex, [module]):
+        app = getattr(__import__(module), name)
+        app.run(host=args.host, port=args.port)
+
+# ---------------------------
+# Argument Parsing
+# ---------------------------
+def build_parser():
+    parser = argparse.ArgumentParser(prog="molemonitoring", description="MoleMonitoring data, training and serving pipeline.")
+    parser.add_argument("--root", default=os.environ.get("MOLEMONITORING_ROOT", DEFAULT_ROOT),
+                        help="Repository root holding HAM10000/, ISIC2018/, preprocessing/, models/ and vertex/ "
+                             "(default: $MOLEMONITORING_ROOT or the checkout this package lives in).")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    ingest = subparsers.add_parser("ingest", help="Unpack dataverse_files.zip into HAM10000/ and ISIC2018/ and build the metadata stores.")
+    ingest.add_argument("--skip-metadata", action="store_true", help="Only unpack; do not add the benign_malignant column.")
+    ingest.set_defaults(handler=cmd_ingest)
+
+    preprocess = subparsers.add_parser("preprocess", help="Resize + hair removal, lesion crops and near-duplicate groups.")
+    preprocess.add_argument("stages", nargs="*", metavar="stage", help=f"Stages to run, of {', '.join(PREPROCESS_STAGES)} (default: all).")
+    preprocess.add_argument("--crop-args", nargs=argparse.REMAINDER, default=[], help="Extra arguments for `lesion_crop.py crops`.")
+    preprocess.set_defaults(handler=cmd_preprocess)
+
+    skin_tone = subparsers.add_parser("skin-tone", help="Estimate skin tone and Fitzpatrick type for every image.")
+    skin_tone.set_defaults(handler=cmd_skin_tone)
+
+    # No -h/--help of their own on pass-through subcommands, so `train resnet50 --help` reaches the script
+    plots = subparsers.add_parser("plots", add_help=False, help="Render the dataset plots into plots/ (arguments go to generate_plots.py).")
+    plots.set_defaults(handler=cmd_plots, pass_through=True)
+
+    train = subparsers.add_parser("train", add_help=False, help="Train a model (arguments after the model go to its script).")
+    train.add_argument("model", choices=sorted(TRAIN_SCRIPTS))
+    train.set_defaults(handler=cmd_train, pass_through=True)
+
+    evaluate = subparsers.add_parser("evaluate", help="Evaluate served-architecture checkpoints (full or pruned) on ISIC2018.")
+    evaluate.add_argument("checkpoints", nargs="+")
+    evaluate.add_argument("--output-dir", default=None, help="Where to write reports (default: <root>/plots/evaluation).")
+    evaluate.add_argument("--batch-size", type=int, default=32)
+    evaluate.set_defaults(handler=cmd_evaluate)
+
+    export = subparsers.add_parser("export", help="Validate a checkpoint and write it where vertex/app.py loads it.")
+    export.add_argument("checkpoint")
+    export.add_argument("--output", default=None, help="Default: <root>/vertex/best_inception_resnetv2_attention.pth")
+    export.add_argument("--similarity-index", default=None, metavar="PATH", help="Also build the similarity index at PATH.")
+    export.set_defaults(handler=cmd_export)
+
+    score = subparsers.add_parser("score", help="Score a folder or zip of images offline with the served model (resumable).")
+    score.add_argument("source", help="Folder (searched recursively) or .zip of images.")
+    score.add_argument("--output", required=True, help="CSV file, or folder of Parquet parts with --format parquet.")
+    score.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    score.add_argument("--batch-size", type=int, default=64)
+    score.add_argument("--workers", type=int, default=0, help="Decode processes (0: one per CPU but one).")
+    score.add_argument("--checkpoint-every", type=int, default=1024, help="Images per output part and checkpoint.")
+    score.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over.")
+    score.set_defaults(handler=cmd_score)
+
+    serve = subparsers.add_parser("serve", help="Serve vertex/app.py (or the sync service).")
+    serve.add_argument("--app", choices=sorted(SERVE_APPS), default="predict")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--workers", type=int, default=0, help="Gunicorn workers (0: Flask development server).")
+    serve.add_argument("--timeout", type=int, default=120, help="Gunicorn worker timeout in seconds.")
+    serve.set_defaults(handler=cmd_serve)
+    return parser
+
+def main(argv=None):
+    # Unrecognized arguments of `plots` and `train` are forwarded to the script they run
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if extra and not getattr(args, "pass_through", False):
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    args.args = extra
+    args.root = os.path.abspath(args.root)
+    if args.command == "evaluate":
+        args.output_dir = args.output_dir or os.path.join(args.root, "plots", "evaluation")
+    if args.command == "export":
+        args.output = args.output or os.path.join(args.root, "vertex", "best_inception_resnetv2_attention.pth")
+    args.handler(args)
+    return 0
@@ -0,0 +1,185 @@
+import os
+import argparse
+from functools import lru_cache
+from itertools import combinations
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from PIL import Image
+from metadata_store import GROUP_COLUMN, LEAK_COLUMN, open_store
+
+DATASETS = {
+    "HAM10000": ("../HAM10000/HAM10000_metadata", "../HAM10000/HAM10000_images_processed/rgb"),
+    "ISIC2018": ("../ISIC2018/ISIC2018_metadata", "../ISIC2018/ISIC2018_images_processed/rgb"),
+}
+PAIRS_FILE = "../HAM10000/near_duplicates.csv"
+HASH_COLUMN = "phash"
+
+NUM_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DCT_SIZE = 32
+HASH_SIZE = 8     # 8x8 low-frequency DCT coefficients -> 64-bit hash
+RADIUS = 8        # max Hamming distance for a near-duplicate
+NUM_CHUNKS = 4    # multi-index hashing: 4 tables over 16-bit substrings
+
+# ---------------------------
+# Perceptual Hashing
+# ---------------------------
+# Rows of the orthogonal DCT-II basis for the lowest HASH_SIZE frequencies
+_n = np.arange(DCT_SIZE)
+DCT_BASIS = np.cos(np.pi * (2 * _n[None, :] + 1) * np.arange(HASH_SIZE)[:, None] / (2 * DCT_SIZE))
+# Flipping the image negates the odd-frequency coefficients along that axis
+ODD_SIGNS = (-1.0) ** np.arange(HASH_SIZE)
+
+def bits_to_hash(coeffs):
+    flat = coeffs.flatten()
+    bits = flat > np.median(flat[1:])  # DC term excluded from the threshold
+    return int(np.packbits(bits).view(">u8")[0])
+
+def dihedral_hashes(coeffs):
+    # pHash of all 8 flips/rot90s, derived from one DCT: dermoscopy duplicates are often rotated.
+    # The first entry is the hash of the image as stored.
+    signs = (np.ones(HASH_SIZE), ODD_SIGNS)
+    return [bits_to_hash(c * np.outer(row, col)) for c in (coeffs, coeffs.T) for row in signs for col in signs]
+
+def hash_task(path):
+    if not os.path.exists(path):
+        return None
+    gray = np.asarray(Image.open(path).convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    return dihedral_hashes(DCT_BASIS @ gray @ DCT_BASIS.T)
+
+# ---------------------------
+# Multi-Index Hashing
+# ---------------------------
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+@lru_cache(maxsize=None)
+def probe_masks(width, radius):
+    # XOR masks flipping up to `radius` of `width` bits
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks += [sum(1 << bit for bit in bits) for bits in combinations(range(width), r)]
+    return masks
+
+def hamming(a, b):
+    x = np.ascontiguousarray(np.bitwise_xor(a, b), dtype=np.uint64)
+    return POPCOUNT[x.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class MultiIndexHash:
+    # Splits each 64-bit code into NUM_CHUNKS substrings with one hash table per substring.
+    # Two codes within distance r agree to within r // NUM_CHUNKS bits on at least one
+    # substring, so probing those few neighbours of each substring finds every candidate
+    # without comparing all pairs.
+    def __init__(self, hashes, num_chunks=NUM_CHUNKS):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.bounds = np.linspace(0, 64, num_chunks + 1).astype(int).tolist()
+        self.tables = []
+        for lo, hi in zip(self.bounds[:-1], self.bounds[1:]):
+            keys = self.substring(self.hashes, lo, hi)
+            order = np.argsort(keys, kind="stable")
+            values, starts = np.unique(keys[order], return_index=True)
+            self.tables.append(dict(zip(values.tolist(), np.split(order, starts[1:]))))
+
+    @staticmethod
+    def substring(codes, lo, hi):
+        return (codes >> np.uint64(lo)) & np.uint64((1 << (hi - lo)) - 1)
+
+    def search(self, query, radius):
+        sub_radius = radius // len(self.tables)
+        query = np.uint64(query)
+        buckets = []
+        for table, lo, hi in zip(self.tables, self.bounds[:-1], self.bounds[1:]):
+            key = int(self.substring(query, lo, hi))
+            for mask in probe_masks(hi - lo, sub_radius):
+                bucket = table.get(key ^ mask)
+                if bucket is not None:
+                    buckets.append(bucket)
+        if not buckets:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(buckets))
+        distances = hamming(self.hashes[candidates], query)
+        keep = distances <= radius
+        return candidates[keep], distances[keep].astype(np.int64)
+
+# ---------------------------
+# Grouping
+# ---------------------------
+def find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+def union(parent, a, b):
+    ra, rb = find(parent, a), find(parent, b)
+    if ra != rb:
+        parent[max(ra, rb)] = min(ra, rb)
+
+def hash_dataset(name, store):
+    _, images_folder = DATASETS[name]
+    image_ids = store.read(["image_id"])["image_id"].astype(str).tolist()
+    paths = [os.path.join(images_folder, image_id + ".jpg") for image_id in image_ids]
+    with Pool(NUM_WORKERS) as pool:
+        variants = pool.map(hash_task, paths, chunksize=64)
+    store.append_column(HASH_COLUMN, [f"{v[0]:016x}" if v else "" for v in variants])
+    print(f"{name}: hashed {sum(v is not None for v in variants)}/{len(paths)} images with {NUM_WORKERS} workers")
+    return image_ids, variants
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash near-duplicate detection and leak-free group IDs for HAM10000/ISIC2018.")
+    parser.add_argument("--radius", type=int, default=RADIUS, help="Max Hamming distance (of 64 bits) for a near-duplicate.")
+    args = parser.parse_args()
+
+    stores = {name: open_store(metadata_file) for name, (metadata_file, _) in DATASETS.items()}
+    rows = []  # (dataset, image_id, [hash variants] or None)
+    for name, store in stores.items():
+        image_ids, variants = hash_dataset(name, store)
+        rows += [(name, image_id, v) for image_id, v in zip(image_ids, variants)]
+
+    # Only the stored orientation is indexed; every orientation is queried
+    hashed = [i for i, (_, _, v) in enumerate(rows) if v is not None]
+    index = MultiIndexHash([rows[i][2][0] for i in hashed])
+    parent = list(range(len(rows)))
+    matches = {}
+    for i in hashed:
+        for code in rows[i][2]:
+            found, distances = index.search(code, args.radius)
+            for j, d in zip(found.tolist(), distances.tolist()):
+                j = hashed[j]
+                if j != i:
+                    key = (min(i, j), max(i, j))
+                    matches[key] = min(d, matches.get(key, d))
+    pairs = []
+    for (i, j), d in matches.items():
+        union(parent, i, j)
+        pairs.append((rows[i][0], rows[i][1], rows[j][0], rows[j][1], d))
+
+    # Images of the same HAM10000 lesion always share a group (HAM10000 rows come first)
+    ham_lesions = stores["HAM10000"].read(["lesion_id"])["lesion_id"].astype(str).tolist()
+    first_of_lesion = {}
+    for k, lesion_id in enumerate(ham_lesions):
+        union(parent, k, first_of_lesion.setdefault(lesion_id, k))
+
+    _, group_ids = np.unique([find(parent, i) for i in range(len(rows))], return_inverse=True)
+    pairs_df = pd.DataFrame(pairs, columns=["dataset_a", "image_a", "dataset_b", "image_b", "distance"])
+    pairs_df.to_csv(PAIRS_FILE, index=False)
+
+    start = 0
+    ham_groups = set()
+    for name, store in stores.items():
+        count = len(store)
+        groups = group_ids[start:start + count]
+        store.append_column(GROUP_COLUMN, groups.astype(np.int64))
+        if name == "HAM10000":
+            ham_groups = set(groups.tolist())
+        else:
+            leaked = np.array([g in ham_groups for g in groups.tolist()])
+            store.append_column(LEAK_COLUMN, leaked)
+            print(f"{name}: {int(leaked.sum())}/{count} images duplicate a HAM10000 image (excluded from evaluation)")
+        print(f"{name}: {len(np.unique(groups))} groups over {count} images")
+        start += count
+
+    cross = int((pairs_df["dataset_a"] != pairs_df["dataset_b"]).sum())
+    print(f"✅ {len(pairs_df)} near-duplicate pairs (radius {args.radius}, {cross} across datasets) saved to {PAIRS_FILE}")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,18 @@
 import os
+import csv
+from multiprocessing import Pool
+import numpy as np
 import pandas as pd
 import stone
+from metadata_store import open_store
 
 BASE_FOLDER = "../HAM10000"
 IMAGES_FOLDER = os.path.join(BASE_FOLDER, "HAM10000_images_processed", "rgb")
 METADATA_FILE = os.path.join(BASE_FOLDER, "HAM10000_metadata")
+RESULTS_FILE = os.path.join(BASE_FOLDER, "fitzpatrick_results.csv")
 
-metadata = pd.read_csv(METADATA_FILE)
+NUM_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+REPORT_EVERY = 50
 
 FITZPATRICK_MAP = {
     "I": "I (Very Fair)",
@@ -17,63 +23,109 @@ FITZPATRICK_MAP = {
     "VI": "VI (Dark Brown/Black)"
 }
 
-def classify_fitzpatrick(hex_color):
-    if not hex_color:
-        return "Unknown"
-
-    hex_color = hex_color.lstrip("#")
-    r, g, b = tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-    intensity = (r + g + b) / 3
-
-    if intensity > 240:
-        return "I (Very Fair)"
-    elif intensity > 210:
-        return "II (Fair)"
-    elif intensity > 190:
-        return "III (Medium)"
-    elif intensity > 170:
-        return "IV (Olive)"
-    elif intensity > 140:
-        return "V (Brown)"
-    else:
-        return "VI (Dark Brown/Black)"
-
-
-def analyze_skin_tone(image_path, image_id):
-    result = stone.process(image_path, image_type="color",
-                           return_report_image=True)
-    if "faces" not in result or not result["faces"]:
-        return None, None, None
-
-    tone_label = result["faces"][0].get("tone_label", "Unknown")
-    skin_hex = result["faces"][0].get("skin_tone", None)
-    fitzpatrick_type = classify_fitzpatrick(skin_hex)
+# Upper bounds of each intensity band, darkest first: <=140 is VI, >240 is I
+INTENSITY_BINS = np.array([140, 170, 190, 210, 240])
+FITZPATRICK_BY_BIN = np.array([FITZPATRICK_MAP[t] for t in ("VI", "V", "IV", "III", "II", "I")], dtype=object)
 
-    return fitzpatrick_type, skin_hex, tone_label
+RESULT_COLUMNS = ["image_id", "skin_tone_hex", "stone_label"]
 
+def classify_fitzpatrick(hex_colors):
+    hex_colors = pd.Series(hex_colors, dtype=object)
+    known = hex_colors.notna() & (hex_colors != "")
+    labels = np.full(len(hex_colors), "Unknown", dtype=object)
+    if not known.any():
+        return labels
 
-fitzpatrick_column, skin_color_column, stone_labels = [], [], []
-print("🔄 Processing images... This may take a while.")
+    values = hex_colors[known].str.lstrip("#").apply(int, base=16).to_numpy(dtype=np.int64)
+    rgb = np.stack([(values >> shift) & 0xFF for shift in (16, 8, 0)], axis=1)
+    intensity = rgb.mean(axis=1)
+    labels[known.to_numpy()] = FITZPATRICK_BY_BIN[np.digitize(intensity, INTENSITY_BINS, right=True)]
+    return labels
 
-for idx, row in metadata.iterrows():
-    image_id = row["image_id"]
-    img_file = os.path.join(IMAGES_FOLDER, image_id + ".jpg")
 
-    if os.path.exists(img_file):
-        fitzpatrick_type, skin_hex, stone_label = analyze_skin_tone(
-            img_file, image_id)
-        fitzpatrick_column.append(fitzpatrick_type)
-        skin_color_column.append(skin_hex)
-        stone_labels.append(stone_label)
-    else:
-        fitzpatrick_column.append("Missing Image")
-        skin_color_column.append(None)
-        stone_labels.append(None)
-
-metadata["fitzpatrick_scale"] = fitzpatrick_column
-metadata["skin_tone_hex"] = skin_color_column
-metadata["stone_label"] = stone_labels
-metadata.to_csv(METADATA_FILE, index=False)
+def analyze_skin_tone(task):
+    image_id, image_path = task
+    result = stone.process(image_path, image_type="color",
+                           return_report_image=False)
+    if "faces" not in result or not result["faces"]:
+        return image_id, None, None
 
-print("\n✅ Processing Complete!")
-print(f"🔹 Updated metadata saved: {METADATA_FILE}")
+    tone_label = result["faces"][0].get("tone_label", "Unknown")
+    skin_hex = result["faces"][0].get("skin_tone", None)
+    return image_id, skin_hex, tone_label
+
+
+def drop_partial_row(results_file):
+    # A run killed mid-write can leave an unterminated last line; it is cut off before appending
+    with open(results_file, "rb+") as f:
+        data = f.read()
+        if data and not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+
+def load_finished(results_file):
+    # "Missing Image" rows are retried, so images added after an earlier run get labelled
+    if not os.path.exists(results_file):
+        return set()
+    drop_partial_row(results_file)
+    if os.path.getsize(results_file) == 0:
+        return set()
+    results = pd.read_csv(results_file, usecols=["image_id", "stone_label"], keep_default_na=False)
+    return set(results.loc[results["stone_label"] != "Missing Image", "image_id"])
+
+
+def run_skin_tone_stage(metadata, images_folder, results_file, num_workers=NUM_WORKERS):
+    finished = load_finished(results_file)
+    pending = [
+        (image_id, os.path.join(images_folder, image_id + ".jpg"))
+        for image_id in metadata["image_id"]
+        if image_id not in finished
+    ]
+    print(f"🔄 {len(finished)} images already labelled, {len(pending)} remaining.")
+
+    is_new_file = not os.path.exists(results_file) or os.path.getsize(results_file) == 0
+    with open(results_file, "a", newline="") as f, Pool(num_workers) as pool:
+        writer = csv.writer(f)
+        if is_new_file:
+            writer.writerow(RESULT_COLUMNS)
+
+        missing = [task for task in pending if not os.path.exists(task[1])]
+        present = [task for task in pending if os.path.exists(task[1])]
+        for image_id, _ in missing:
+            writer.writerow([image_id, "", "Missing Image"])
+        f.flush()
+
+        # Flushed per row, so an interrupted run loses at most the row being written
+        for done, row in enumerate(pool.imap_unordered(analyze_skin_tone, present, chunksize=8), start=1):
+            writer.writerow(row)
+            f.flush()
+            if done % REPORT_EVERY == 0:
+                print(f"Processed {done}/{len(present)} images")
+
+    return pd.read_csv(results_file, keep_default_na=False, na_values=[""])
+
+
+def main():
+    store = open_store(METADATA_FILE)
+    metadata = store.read(["image_id"])
+    print("🔄 Processing images... This may take a while.")
+    results = run_skin_tone_stage(metadata, IMAGES_FOLDER, RESULTS_FILE)
+    results = results.drop_duplicates("image_id", keep="last").set_index("image_id")
+    results = results.reindex(metadata["image_id"])
+
+    missing = (results["stone_label"] == "Missing Image").to_numpy()
+    no_face = results["stone_label"].isna().to_numpy()
+    fitzpatrick = classify_fitzpatrick(results["skin_tone_hex"].to_numpy())
+    fitzpatrick[missing] = "Missing Image"
+    fitzpatrick[no_face] = None
+
+    store.append_column("fitzpatrick_scale", fitzpatrick)
+    store.append_column("skin_tone_hex", results["skin_tone_hex"].to_numpy())
+    store.append_column("stone_label", results["stone_label"].where(~missing).to_numpy())
+
+    print("\n✅ Processing Complete!")
+    print(f"🔹 Updated metadata saved: {store.root}")
+
+
+if __name__ == "__main__":
+    main()
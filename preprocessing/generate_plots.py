@@ -1,7 +1,15 @@
 import os
+import json
+import hashlib
+import inspect
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
+from metadata_store import load_metadata
 
 def plot_class_distribution(metadata, plots_folder):
     class_counts = metadata["dx"].value_counts().sort_values(ascending=False)
@@ -17,7 +25,7 @@ def plot_class_distribution(metadata, plots_folder):
     plt.gca().bar_label(bars, fmt='%d', padding=3)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "class_distribution_histogram_ordered.png"))
-    plt.show()
+    plt.close()
 
 def plot_benign_vs_malignant(metadata, plots_folder):
     benign_malignant_counts = metadata["benign_malignant"].value_counts()
@@ -32,7 +40,7 @@ def plot_benign_vs_malignant(metadata, plots_folder):
     plt.gca().bar_label(plt.gca().containers[0], fmt='%d', padding=3)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "benign_vs_malignant.png"))
-    plt.show()
+    plt.close()
 
 def plot_age_distribution_by_type(metadata, plots_folder):
     plt.figure(figsize=(12, 6))
@@ -43,7 +51,7 @@ def plot_age_distribution_by_type(metadata, plots_folder):
     plt.xticks(rotation=45)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "age_distribution_by_type.png"))
-    plt.show()
+    plt.close()
 
 def plot_proportion_malignant_by_age(metadata, plots_folder):
     age_malignancy = metadata.groupby('age')['benign_malignant'].apply(lambda x: (x == 'Malignant').mean()).reset_index()
@@ -57,7 +65,7 @@ def plot_proportion_malignant_by_age(metadata, plots_folder):
     plt.grid(alpha=0.5)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "proportion_of_malignant_by_age.png"))
-    plt.show()
+    plt.close()
 
 def plot_age_distribution(metadata, plots_folder):
     plt.figure(figsize=(8, 6))
@@ -67,7 +75,7 @@ def plot_age_distribution(metadata, plots_folder):
     plt.ylabel("Frequency")
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "distribution_age.png"))
-    plt.show()
+    plt.close()
 
 def plot_gender_distribution(metadata, plots_folder):
     plt.figure(figsize=(8, 6))
@@ -78,7 +86,7 @@ def plot_gender_distribution(metadata, plots_folder):
     plt.gca().bar_label(plt.gca().containers[0], fmt='%d', padding=3)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "gender_distribution.png"))
-    plt.show()
+    plt.close()
 
 def plot_localization_distribution(metadata, plots_folder):
     plt.figure(figsize=(10, 6))
@@ -90,7 +98,7 @@ def plot_localization_distribution(metadata, plots_folder):
     plt.gca().bar_label(plt.gca().containers[0], fmt='%d', padding=3)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "localization_distribution.png"))
-    plt.show()
+    plt.close()
 
 def plot_gender_by_dx(metadata, plots_folder):
     aggregated_data = metadata.groupby(['sex', 'dx']).size().reset_index(name='count')
@@ -113,7 +121,7 @@ def plot_gender_by_dx(metadata, plots_folder):
     plt.ylabel("Count")
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "gender_by_dx.png"))
-    plt.show()
+    plt.close()
 
 def plot_localization_by_dx(metadata, plots_folder):
     aggregated_localization = metadata.groupby(['localization', 'dx']).size().reset_index(name='count')
@@ -137,7 +145,7 @@ def plot_localization_by_dx(metadata, plots_folder):
     plt.xticks(rotation=45)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "localization_by_dx.png"))
-    plt.show()
+    plt.close()
 
 def plot_benign_malignant_by_dx(metadata, plots_folder):
     aggregated_benign_malignant = metadata.groupby(['benign_malignant', 'dx']).size().reset_index(name='count')
@@ -161,7 +169,7 @@ def plot_benign_malignant_by_dx(metadata, plots_folder):
     plt.xticks(rotation=45)
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "benign_malignant_by_dx.png"))
-    plt.show()
+    plt.close()
 
 def plot_psnr_histogram(metrics, plots_folder):
     psnr_bins = [0, 29, 39, float('inf')]
@@ -181,7 +189,7 @@ def plot_psnr_histogram(metrics, plots_folder):
 
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "psnr_histogram.png"))
-    plt.show()
+    plt.close()
 
 def plot_ssim_histogram(metrics, plots_folder):
     ssim_bins = [0, 0.7, 0.9, 1.0]
@@ -201,28 +209,117 @@ def plot_ssim_histogram(metrics, plots_folder):
 
     plt.tight_layout()
     plt.savefig(os.path.join(plots_folder, "ssim_histogram.png"))
-    plt.show()
-
-
-root_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-
-plots_folder = os.path.join(root_folder, "plots")
-os.makedirs(plots_folder, exist_ok=True)
-
-metadata = pd.read_csv( os.path.join(root_folder, "HAM10000", "HAM10000_metadata"))
-metrics = pd.read_csv(os.path.join(root_folder, "HAM10000", "HAM10000_images_processed", "metrics", "hair_removal_metrics.csv"))
-
-plot_class_distribution(metadata, plots_folder)
-plot_benign_vs_malignant(metadata, plots_folder)
-plot_age_distribution_by_type(metadata, plots_folder)
-plot_proportion_malignant_by_age(metadata, plots_folder)
-plot_age_distribution(metadata, plots_folder)
-plot_gender_distribution(metadata, plots_folder)
-plot_localization_distribution(metadata, plots_folder)
-plot_gender_by_dx(metadata, plots_folder)
-plot_localization_by_dx(metadata, plots_folder)
-plot_benign_malignant_by_dx(metadata, plots_folder)
-plot_psnr_histogram(metrics, plots_folder)
-plot_ssim_histogram(metrics, plots_folder)
-
-
+    plt.close()
+
+
+# ---------------------------
+# Plot Registry
+# ---------------------------
+# name -> (function, source table, input columns, output file)
+PLOTS = {
+    "class_distribution": (plot_class_distribution, "metadata", ["dx", "benign_malignant"], "class_distribution_histogram_ordered.png"),
+    "benign_vs_malignant": (plot_benign_vs_malignant, "metadata", ["benign_malignant"], "benign_vs_malignant.png"),
+    "age_distribution_by_type": (plot_age_distribution_by_type, "metadata", ["dx", "age"], "age_distribution_by_type.png"),
+    "proportion_malignant_by_age": (plot_proportion_malignant_by_age, "metadata", ["age", "benign_malignant"], "proportion_of_malignant_by_age.png"),
+    "age_distribution": (plot_age_distribution, "metadata", ["age"], "distribution_age.png"),
+    "gender_distribution": (plot_gender_distribution, "metadata", ["sex"], "gender_distribution.png"),
+    "localization_distribution": (plot_localization_distribution, "metadata", ["localization"], "localization_distribution.png"),
+    "gender_by_dx": (plot_gender_by_dx, "metadata", ["sex", "dx"], "gender_by_dx.png"),
+    "localization_by_dx": (plot_localization_by_dx, "metadata", ["localization", "dx"], "localization_by_dx.png"),
+    "benign_malignant_by_dx": (plot_benign_malignant_by_dx, "metadata", ["benign_malignant", "dx"], "benign_malignant_by_dx.png"),
+    "psnr_histogram": (plot_psnr_histogram, "metrics", ["PSNR"], "psnr_histogram.png"),
+    "ssim_histogram": (plot_ssim_histogram, "metrics", ["SSIM"], "ssim_histogram.png"),
+}
+
+CACHE_FILE = ".plot_cache.json"
+
+# ---------------------------
+# Cache Helpers
+# ---------------------------
+def plot_hash(name, data):
+    func, _, columns, _ = PLOTS[name]
+    digest = hashlib.sha256(inspect.getsource(func).encode())
+    digest.update(pd.util.hash_pandas_object(data[columns], index=False).values.tobytes())
+    return digest.hexdigest()
+
+def load_cache(plots_folder):
+    path = os.path.join(plots_folder, CACHE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_cache(plots_folder, cache):
+    with open(os.path.join(plots_folder, CACHE_FILE), "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
+def render_plot(name, data, plots_folder):
+    func = PLOTS[name][0]
+    func(data, plots_folder)
+    return name
+
+# ---------------------------
+# Pipeline
+# ---------------------------
+def load_sources(root_folder, names):
+    sources = {}
+    metadata_columns = sorted({c for n in names if PLOTS[n][1] == "metadata" for c in PLOTS[n][2]})
+    metrics_columns = sorted({c for n in names if PLOTS[n][1] == "metrics" for c in PLOTS[n][2]})
+    if metadata_columns:
+        sources["metadata"] = load_metadata(os.path.join(root_folder, "HAM10000", "HAM10000_metadata"), columns=metadata_columns)
+    if metrics_columns:
+        sources["metrics"] = pd.read_csv(
+            os.path.join(root_folder, "HAM10000", "HAM10000_images_processed", "metrics", "hair_removal_metrics.csv"),
+            usecols=metrics_columns,
+        )
+    return sources
+
+def generate_plots(root_folder, names, workers=None, force=False):
+    plots_folder = os.path.join(root_folder, "plots")
+    os.makedirs(plots_folder, exist_ok=True)
+
+    sources = load_sources(root_folder, names)
+    cache = load_cache(plots_folder)
+
+    stale = {}
+    for name in names:
+        _, source, columns, filename = PLOTS[name]
+        data = sources[source][columns]
+        digest = plot_hash(name, data)
+        up_to_date = cache.get(name) == digest and os.path.exists(os.path.join(plots_folder, filename))
+        if force or not up_to_date:
+            stale[name] = (data, digest)
+
+    print(f"{len(names) - len(stale)} plots up to date, {len(stale)} to render.")
+    if not stale:
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(render_plot, name, data, plots_folder) for name, (data, _) in stale.items()]
+        for future in futures:
+            name = future.result()
+            cache[name] = stale[name][1]
+            print(f"Rendered {name} -> {PLOTS[name][3]}")
+
+    save_cache(plots_folder, cache)
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate dataset plots into plots/.")
+    parser.add_argument("plots", nargs="*", help="Plots to generate (default: all).")
+    parser.add_argument("--list", action="store_true", help="List the available plots and exit.")
+    parser.add_argument("--force", action="store_true", help="Re-render plots even if their inputs are unchanged.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    if args.list:
+        print("\n".join(PLOTS))
+        return
+    unknown = sorted(set(args.plots) - set(PLOTS))
+    if unknown:
+        parser.error(f"Unknown plots: {', '.join(unknown)} (use --list)")
+
+    root_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    generate_plots(root_folder, args.plots or list(PLOTS), workers=args.workers, force=args.force)
+
+if __name__ == "__main__":
+    main()
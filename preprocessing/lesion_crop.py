@@ -0,0 +1,294 @@
+import os
+import sys
+import json
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from metadata_store import GROUP_COLUMN, LESION_COLUMN, open_store, train_val_split
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "vertex")))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "models")))
+from lesion_cropper import FULL_FRAME, LesionCropper, MaskNet, bbox_iou, crop_image, mask_to_bbox, save_cropper, to_mask_input
+
+BASE_FOLDER = "../HAM10000"
+IMAGES_FOLDER = os.path.join(BASE_FOLDER, "HAM10000_images")
+SEGMENTATIONS_FOLDER = os.path.join(BASE_FOLDER, "HAM10000_segmentations_processed")
+CROPS_FOLDER = os.path.join(BASE_FOLDER, "HAM10000_images_cropped")
+METADATA_FILE = os.path.join(BASE_FOLDER, "HAM10000_metadata")
+CROPPER_PATH = "../vertex/lesion_cropper.pth"
+REPORT_FILE = "../plots/lesion_crop_report.json"
+
+NUM_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+CROP_SIZE = 224
+MARGIN = 0.1
+MASK_INPUT_SIZE = 128
+MASK_WIDTH = 16
+SEED = 42
+
+BBOX_COLUMNS = ["lesion_bbox_x0", "lesion_bbox_y0", "lesion_bbox_x1", "lesion_bbox_y1"]
+
+# ---------------------------
+# Ground-truth Boxes and Crops
+# ---------------------------
+def mask_path(image_id):
+    # process_images.py reads the masks as 3-channel PNGs, so they land in rgb/
+    for folder in (os.path.join(SEGMENTATIONS_FOLDER, "rgb"), SEGMENTATIONS_FOLDER):
+        path = os.path.join(folder, f"{image_id}_segmentation.png")
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_mask(image_id):
+    path = mask_path(image_id)
+    if path is None:
+        return None
+    return np.asarray(Image.open(path).convert("L"), dtype=np.float32) / 255.0
+
+def crop_task(task):
+    image_id, crop_size, margin = task
+    mask = load_mask(image_id)
+    bbox = mask_to_bbox(mask, margin=margin) if mask is not None else FULL_FRAME
+    image_path = os.path.join(IMAGES_FOLDER, image_id + ".jpg")
+    out_path = os.path.join(CROPS_FOLDER, str(crop_size), image_id + ".jpg")
+    if os.path.exists(image_path) and not os.path.exists(out_path):
+        crop = crop_image(Image.open(image_path).convert("RGB"), bbox)
+        crop.resize((crop_size, crop_size), Image.BICUBIC).save(out_path, quality=95)
+    return image_id, bbox, mask is not None
+
+def run_crop_stage(store, crop_size, margin, num_workers=NUM_WORKERS):
+    image_ids = store.read(["image_id"])["image_id"].tolist()
+    os.makedirs(os.path.join(CROPS_FOLDER, str(crop_size)), exist_ok=True)
+    bboxes = {}
+    missing_masks = 0
+    with Pool(num_workers) as pool:
+        tasks = [(image_id, crop_size, margin) for image_id in image_ids]
+        for done, (image_id, bbox, has_mask) in enumerate(pool.imap_unordered(crop_task, tasks, chunksize=16), start=1):
+            bboxes[image_id] = bbox
+            missing_masks += not has_mask
+            if done % 1000 == 0:
+                print(f"Cropped {done}/{len(tasks)} images")
+
+    # Normalized boxes go to the metadata store so training and the report can re-crop at any size
+    boxes = np.array([bboxes[image_id] for image_id in image_ids])
+    for i, column in enumerate(BBOX_COLUMNS):
+        store.append_column(column, boxes[:, i])
+    print(f"✅ {len(image_ids)} crops saved to {os.path.join(CROPS_FOLDER, str(crop_size))} "
+          f"({missing_masks} without a mask kept the full frame)")
+
+# ---------------------------
+# Mask Predictor Training
+# ---------------------------
+class MaskDataset(Dataset):
+    def __init__(self, image_ids, input_size, output_size, augment=False):
+        self.image_ids = image_ids
+        self.input_size = input_size
+        self.output_size = output_size
+        self.augment = augment
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def __getitem__(self, idx):
+        image_id = self.image_ids[idx]
+        image = to_mask_input([Image.open(os.path.join(IMAGES_FOLDER, image_id + ".jpg"))], self.input_size)[0]
+        mask = torch.from_numpy(load_mask(image_id))[None, None]
+        # Area-averaged target: the fraction of each coarse cell covered by the lesion
+        target = F.adaptive_avg_pool2d(mask, self.output_size)[0]
+        if self.augment:
+            if torch.rand(1).item() < 0.5:
+                image, target = image.flip(-1), target.flip(-1)
+            if torch.rand(1).item() < 0.5:
+                image, target = image.flip(-2), target.flip(-2)
+        return image, target
+
+def split_columns(store, columns):
+    return columns + [column for column in (GROUP_COLUMN, LESION_COLUMN) if column in store.columns]
+
+def split_ids(metadata):
+    train_df, val_df = train_val_split(metadata, test_size=0.10, seed=SEED)
+    return train_df, val_df
+
+def train_mask_predictor(store, epochs, batch_size, output):
+    metadata = store.read(split_columns(store, ["image_id", "dx"]))
+    metadata = metadata[[mask_path(image_id) is not None for image_id in metadata["image_id"]]]
+    train_df, val_df = split_ids(metadata)
+    output_size = MASK_INPUT_SIZE // 8
+    train_loader = DataLoader(MaskDataset(train_df["image_id"].tolist(), MASK_INPUT_SIZE, output_size, augment=True),
+                              batch_size=batch_size, shuffle=True, num_workers=NUM_WORKERS)
+    val_ids = val_df["image_id"].tolist()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = MaskNet(width=MASK_WIDTH).to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    criterion = nn.BCEWithLogitsLoss()
+    best_iou = -1.0
+    for epoch in range(epochs):
+        model.train()
+        total_loss = 0.0
+        for images, targets in train_loader:
+            images, targets = images.to(device), targets.to(device)
+            optimizer.zero_grad()
+            loss = criterion(model(images), targets)
+            loss.backward()
+            optimizer.step()
+            total_loss += loss.item()
+
+        save_cropper(output, model, MASK_INPUT_SIZE, MASK_WIDTH, margin=MARGIN)
+        iou = evaluate_cropper(LesionCropper(output, device), val_ids)
+        print(f"Epoch {epoch + 1}/{epochs} -> Loss: {total_loss / len(train_loader):.4f}, Val box IoU: {iou:.4f}")
+        if iou > best_iou:
+            best_iou = iou
+            os.replace(output, output + ".best")
+        else:
+            os.remove(output)
+    os.replace(output + ".best", output)
+    print(f"✅ Mask predictor saved to {output} (val box IoU {best_iou:.4f})")
+    print(f"Serving does not crop until LESION_CROPPER_PATH={os.path.basename(output)} is set for vertex/app.py")
+
+def evaluate_cropper(cropper, image_ids, batch_size=64):
+    ious = []
+    for start in range(0, len(image_ids), batch_size):
+        chunk = image_ids[start:start + batch_size]
+        images = [Image.open(os.path.join(IMAGES_FOLDER, image_id + ".jpg")) for image_id in chunk]
+        predicted = cropper.predict_bboxes(images)
+        truth = [mask_to_bbox(load_mask(image_id), margin=cropper.margin) for image_id in chunk]
+        ious.append(bbox_iou(predicted, truth))
+    return float(np.concatenate(ious).mean())
+
+# ---------------------------
+# Accuracy / Latency Report
+# ---------------------------
+class CropDataset(Dataset):
+    def __init__(self, image_ids, labels, bboxes, transform):
+        self.image_ids = image_ids
+        self.labels = labels
+        self.bboxes = bboxes
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        image = Image.open(os.path.join(IMAGES_FOLDER, self.image_ids[idx] + ".jpg")).convert("RGB")
+        image = np.asarray(crop_image(image, self.bboxes[idx]))
+        return self.transform(image=image)["image"].float(), torch.tensor(self.labels[idx], dtype=torch.long)
+
+def build_transforms(size):
+    import albumentations as A
+    from albumentations.pytorch import ToTensorV2
+    normalize = A.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
+    train = A.Compose([A.Resize(size, size), A.HorizontalFlip(), A.VerticalFlip(), A.RandomRotate90(), normalize, ToTensorV2()])
+    test = A.Compose([A.Resize(size, size), normalize, ToTensorV2()])
+    return train, test
+
+def build_classifier(num_classes):
+    from torchvision.models import resnet50
+    backbone = nn.Sequential(*list(resnet50(weights="IMAGENET1K_V1").children())[:-2])
+    head = nn.Sequential(nn.AdaptiveAvgPool2d((1, 1)), nn.Flatten(), nn.Dropout(p=0.3), nn.Linear(2048, num_classes))
+    return nn.Sequential(backbone, head)
+
+def run_report(store, sizes, epochs, batch_size, cropper_path):
+    from common import count_macs, median_latency_ms
+    from evaluation import evaluate_model
+    from training import train_one_epoch
+
+    metadata = store.read(split_columns(store, ["image_id", "dx"] + BBOX_COLUMNS))
+    class_names = sorted(metadata["dx"].unique())
+    label_map = {name: idx for idx, name in enumerate(class_names)}
+    train_df, val_df = split_ids(metadata)
+    train_labels = train_df["dx"].astype(str).map(label_map).to_numpy()
+    val_labels = val_df["dx"].astype(str).map(label_map).to_numpy()
+    gt_train, gt_val = train_df[BBOX_COLUMNS].to_numpy(), val_df[BBOX_COLUMNS].to_numpy()
+    full_train, full_val = np.tile(FULL_FRAME, (len(train_df), 1)), np.tile(FULL_FRAME, (len(val_df), 1))
+
+    cropper = LesionCropper(cropper_path)
+    val_ids = val_df["image_id"].tolist()
+    predicted_val = np.concatenate([
+        np.asarray(cropper.predict_bboxes([Image.open(os.path.join(IMAGES_FOLDER, i + ".jpg")) for i in val_ids[start:start + 64]]))
+        for start in range(0, len(val_ids), 64)
+    ])
+    sample = Image.open(os.path.join(IMAGES_FOLDER, val_ids[0] + ".jpg")).convert("RGB")
+    crop_ms = median_latency_ms(lambda: cropper.crop([sample]))
+    print(f"Mask predictor: val box IoU {bbox_iou(predicted_val, gt_val).mean():.4f}, {crop_ms:.2f} ms per image")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    rows = []
+    for size in sizes:
+        train_transform, test_transform = build_transforms(size)
+        for mode, train_boxes, eval_sets in (
+            ("full_frame", full_train, {"full_frame": full_val}),
+            ("lesion_crop", gt_train, {"gt_crop": gt_val, "predicted_crop": predicted_val}),
+        ):
+            torch.manual_seed(SEED)
+            model = build_classifier(len(class_names)).to(device)
+            optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+            criterion = nn.CrossEntropyLoss()
+            train_loader = DataLoader(CropDataset(train_df["image_id"].tolist(), train_labels, train_boxes, train_transform),
+                                      batch_size=batch_size, shuffle=True, num_workers=NUM_WORKERS)
+            for _ in range(epochs):
+                train_one_epoch(model, train_loader, optimizer, criterion, device)
+
+            cpu_model = model.to("cpu").eval()
+            x = torch.randn(1, 3, size, size)
+            with torch.no_grad():
+                classifier_ms = median_latency_ms(lambda: cpu_model(x))
+            macs = count_macs(cpu_model, size)
+            model.to(device)
+
+            for eval_name, boxes in eval_sets.items():
+                loader = DataLoader(CropDataset(val_ids, val_labels, boxes, test_transform), batch_size=64, num_workers=NUM_WORKERS)
+                report = evaluate_model(model, loader, device, class_names).classification_report()
+                latency = classifier_ms + (crop_ms if eval_name == "predicted_crop" else 0.0)
+                rows.append({
+                    "input_size": size,
+                    "train": mode,
+                    "eval": eval_name,
+                    "accuracy": float(report["accuracy"]),
+                    "mel_recall": float(report["mel"]["recall"]),
+                    "macro_f1": float(report["macro avg"]["f1-score"]),
+                    "gmacs": macs / 1e9,
+                    "cpu_latency_ms": latency,
+                })
+                print(f"{size}px {eval_name}: acc {rows[-1]['accuracy']:.4f}, mel recall {rows[-1]['mel_recall']:.4f}, "
+                      f"{rows[-1]['gmacs']:.2f} GMACs, {latency:.1f} ms")
+
+    print(f"\n{'size':>5} {'eval':>15} {'acc':>7} {'mel rec':>8} {'GMACs':>7} {'CPU ms':>8}")
+    for r in rows:
+        print(f"{r['input_size']:>5} {r['eval']:>15} {r['accuracy']:>7.4f} {r['mel_recall']:>8.4f} {r['gmacs']:>7.2f} {r['cpu_latency_ms']:>8.1f}")
+    os.makedirs(os.path.dirname(REPORT_FILE), exist_ok=True)
+    with open(REPORT_FILE, "w") as f:
+        json.dump({"epochs": epochs, "crop_ms": crop_ms, "results": rows}, f, indent=2)
+    print(f"\n✅ Report saved to {REPORT_FILE}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Lesion bounding boxes from the HAM10000 masks, crops, mask predictor and accuracy/latency report.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    crops = subparsers.add_parser("crops", help="Compute mask bounding boxes and store fixed-resolution crops.")
+    crops.add_argument("--size", type=int, default=CROP_SIZE)
+    crops.add_argument("--margin", type=float, default=MARGIN)
+    train = subparsers.add_parser("train-mask", help="Train the lightweight mask predictor used at inference time.")
+    train.add_argument("--epochs", type=int, default=20)
+    train.add_argument("--batch-size", type=int, default=64)
+    train.add_argument("--output", default=CROPPER_PATH)
+    report = subparsers.add_parser("report", help="Accuracy/latency of full-frame vs cropped inputs at several sizes.")
+    report.add_argument("--sizes", type=int, nargs="+", default=[160, 192, 224, 299])
+    report.add_argument("--epochs", type=int, default=5)
+    report.add_argument("--batch-size", type=int, default=32)
+    report.add_argument("--cropper", default=CROPPER_PATH)
+    args = parser.parse_args()
+
+    store = open_store(METADATA_FILE)
+    if args.command == "crops":
+        run_crop_stage(store, args.size, args.margin)
+    elif args.command == "train-mask":
+        train_mask_predictor(store, args.epochs, args.batch_size, args.output)
+    else:
+        run_report(store, args.sizes, args.epochs, args.batch_size, args.cropper)
+
+if __name__ == "__main__":
+    main()
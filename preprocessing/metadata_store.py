@@ -0,0 +1,147 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+# The store keeps one Parquet file per column inside `<metadata_file>.store/`,
+# all sharing the row order of `image_id.parquet`. Adding or replacing a
+# column only writes that column's file instead of rewriting the whole CSV.
+# `source.json` records the size and mtime of the CSV it was imported from, so
+# an edited or replaced CSV is re-imported by open_store.
+
+CATEGORICAL_COLUMNS = ["dx", "localization", "sex", "benign_malignant", "fitzpatrick_scale"]
+KEY_COLUMN = "image_id"
+# Written by dedup.py: lesion_id merged with perceptual near-duplicates, and ISIC2018 images that repeat a HAM10000 one
+GROUP_COLUMN = "group_id"
+# HAM10000's own lesion grouping, used for splits until dedup.py has written GROUP_COLUMN
+LESION_COLUMN = "lesion_id"
+LEAK_COLUMN = "ham_duplicate"
+SOURCE_FILE = "source.json"
+
+def store_path(metadata_file):
+    return f"{metadata_file}.store"
+
+def column_path(root, column):
+    return os.path.join(root, f"{column}.parquet")
+
+def source_stamp(csv_file):
+    stat = os.stat(csv_file)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+def typed_column(name, values):
+    series = pd.Series(values, name=name)
+    if name in CATEGORICAL_COLUMNS:
+        series = series.astype("category")
+    return series
+
+class MetadataStore:
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(column_path(root, KEY_COLUMN)):
+            raise FileNotFoundError(f"No metadata store found at {root}")
+
+    @classmethod
+    def from_csv(cls, csv_file, root=None):
+        root = root or store_path(csv_file)
+        os.makedirs(root, exist_ok=True)
+        write_csv_columns(root, csv_file, pd.read_csv(csv_file))
+        return cls(root)
+
+    @property
+    def source(self):
+        # Stamp of the CSV last imported, None for stores written before it was recorded
+        path = os.path.join(self.root, SOURCE_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def reimport(self, csv_file):
+        # Replaces the CSV's columns; columns added since (dedup.py, fitzpatrick.py, ...) are
+        # kept, which is only valid while the CSV still lists the same images in the same order
+        metadata = pd.read_csv(csv_file)
+        added = [column for column in self.columns if column not in metadata.columns]
+        rows_changed = metadata[KEY_COLUMN].astype(str).tolist() != self.read([KEY_COLUMN])[KEY_COLUMN].astype(str).tolist()
+        if added and rows_changed:
+            raise ValueError(f"{csv_file} changed its rows since {self.root} was built; delete the store and "
+                             f"rerun the scripts that added {', '.join(added)}")
+        write_csv_columns(self.root, csv_file, metadata)
+
+    @property
+    def columns(self):
+        names = sorted(f[:-len(".parquet")] for f in os.listdir(self.root) if f.endswith(".parquet"))
+        return [KEY_COLUMN] + [name for name in names if name != KEY_COLUMN]
+
+    def __len__(self):
+        return len(pd.read_parquet(column_path(self.root, KEY_COLUMN)))
+
+    def read(self, columns=None):
+        columns = columns or self.columns
+        return pd.concat([pd.read_parquet(column_path(self.root, column)) for column in columns], axis=1)
+
+    def append_column(self, name, values):
+        series = typed_column(name, values)
+        if len(series) != len(self):
+            raise ValueError(f"Column '{name}' has {len(series)} rows, store has {len(self)}")
+        series.to_frame().to_parquet(column_path(self.root, name), index=False)
+
+    def drop_column(self, name):
+        if name == KEY_COLUMN:
+            raise ValueError(f"Cannot drop the key column '{KEY_COLUMN}'")
+        path = column_path(self.root, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def to_csv(self, csv_file):
+        self.read().to_csv(csv_file, index=False)
+
+def write_csv_columns(root, csv_file, metadata):
+    # Write the key after the other columns so a half-finished import is not picked up as a
+    # store, and the source stamp last so an interrupted re-import is redone
+    for column in metadata.columns:
+        if column != KEY_COLUMN:
+            typed_column(column, metadata[column]).to_frame().to_parquet(column_path(root, column), index=False)
+    metadata[[KEY_COLUMN]].to_parquet(column_path(root, KEY_COLUMN), index=False)
+    with open(os.path.join(root, SOURCE_FILE), "w") as f:
+        json.dump(source_stamp(csv_file), f)
+
+def open_store(metadata_file):
+    root = store_path(metadata_file)
+    if not os.path.exists(column_path(root, KEY_COLUMN)):
+        return MetadataStore.from_csv(metadata_file, root)
+    store = MetadataStore(root)
+    # A store may be used without its CSV; when the CSV is there it must match what was imported
+    if os.path.exists(metadata_file) and store.source != source_stamp(metadata_file):
+        print(f"{metadata_file} changed since {root} was built, re-importing it")
+        store.reimport(metadata_file)
+    return store
+
+def load_metadata(metadata_file, columns=None, optional=()):
+    # Optional columns are read only if the store has them (e.g. before dedup.py has run)
+    store = open_store(metadata_file)
+    if columns is not None:
+        columns = list(columns) + [column for column in optional if column in store.columns]
+    return store.read(columns)
+
+def train_val_split(metadata, test_size, seed):
+    # Stratified by dx and grouped so that no lesion (or, once dedup.py has run, no
+    # near-duplicate image) appears on both sides of the split
+    from sklearn.model_selection import StratifiedGroupKFold, train_test_split
+    groups = next((column for column in (GROUP_COLUMN, LESION_COLUMN) if column in metadata), None)
+    if groups is None:
+        return train_test_split(metadata, test_size=test_size, stratify=metadata["dx"], random_state=seed)
+    folds = StratifiedGroupKFold(n_splits=round(1 / test_size), shuffle=True, random_state=seed)
+    train_idx, val_idx = next(folds.split(metadata, metadata["dx"], metadata[groups]))
+    return metadata.iloc[train_idx], metadata.iloc[val_idx]
+
+def without_leaks(metadata):
+    # Drops test images that duplicate a training image
+    if LEAK_COLUMN not in metadata:
+        return metadata
+    return metadata[~metadata[LEAK_COLUMN].astype(bool)].reset_index(drop=True)
+
+def paths_and_labels(metadata, images_folder, label_map, extension=".jpg"):
+    image_ids = metadata[KEY_COLUMN].to_numpy(dtype=str)
+    paths = np.char.add(np.char.add(images_folder + os.sep, image_ids), extension)
+    labels = metadata["dx"].astype(str).map(label_map).to_numpy(dtype=np.int64)
+    return paths, labels
@@ -3,18 +3,24 @@ import os
 os.environ['NO_ALBUMENTATIONS_UPDATE'] = '1'
 
 import time
+import json
 from datetime import datetime
 import base64
 import io
 import torch
-import torch.nn as nn
 import torch.nn.functional as F
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify
 from PIL import Image
 import numpy as np
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
-import timm
+from similarity_index import IVFPQIndex
+from serving_model import load_serving_model
+from lesion_tracking import LesionTracker, DRIFT_METRICS
+from lesion_cropper import LesionCropper, crop_image
+from fusion_engine import FUSION_IMG_SIZE, FUSION_LABELS, load_engine
+from deadlines import Deadline, DeadlineExceeded, live_indices, shed_counts
+from explain import explain_batch, parse_explain
 
 app = Flask(__name__)
 
@@ -22,61 +28,21 @@ app = Flask(__name__)
 # 1. Model Components
 # ============================================================
 
-class SoftAttention(nn.Module):
-    def __init__(self, channels, heads, aggregate=True, concat_with_x=False):
-        super(SoftAttention, self).__init__()
-        self.channels = channels
-        self.multiheads = heads
-        self.aggregate_channels = aggregate
-        self.concat_input_with_scaled = concat_with_x
-        self.conv = nn.Conv3d(1, heads, kernel_size=(channels, 3, 3), padding=(0, 1, 1), bias=True)
-
-    def forward(self, x):
-        b, c, h, w = x.shape
-        x_exp = x.unsqueeze(1)
-        conv3d = self.conv(x_exp).squeeze(2)
-        attn_maps = F.softmax(conv3d.view(b, self.multiheads, -1), dim=-1).view(b, self.multiheads, h, w)
-        if self.aggregate_channels:
-            attn_maps = attn_maps.sum(dim=1, keepdim=True)
-            x_out = x * attn_maps
-        else:
-            x_out = x * attn_maps.unsqueeze(1)
-        if self.concat_input_with_scaled:
-            return torch.cat([x_out, x], dim=1)
-        return x_out
-
-class InceptionResNetV2_SoftAttention(nn.Module):
-    def __init__(self, num_classes, dropout_p):
-        super(InceptionResNetV2_SoftAttention, self).__init__()
-        self.num_classes = num_classes 
-        self.base_model = timm.create_model("inception_resnet_v2", pretrained=True, num_classes=0, global_pool="")
-        self.soft_attention = SoftAttention(1536, heads=16, aggregate=True)
-        self.pool = nn.MaxPool2d(kernel_size=2, stride=2, padding=1)
-        self.relu = nn.ReLU()
-        self.dropout = nn.Dropout(dropout_p)
-        self.fc = None 
-
-    def forward(self, x):
-        features = self.base_model.forward_features(x)
-        attn_features = self.soft_attention(features)
-        pooled_features = self.pool(features)
-        pooled_attn = self.pool(attn_features)
-        combined = torch.cat([pooled_features, pooled_attn], dim=1)
-        activated = self.relu(combined)
-        dropped = self.dropout(activated)
-        flat = torch.flatten(dropped, 1)
-        if self.fc is None:
-            self.fc = nn.Linear(flat.shape[1], self.num_classes).to(flat.device)
-        out = self.fc(flat)
-        return out
+# InceptionResNetV2_SoftAttention (serving_model.py) is shared with models/prune_irv2.py,
+# autotune.py and the benchmarks, so they all measure and prune what is served here.
 
 # ============================================================
 # 2. Global Settings and Preprocessing
 # ============================================================
 
-IMG_SIZE = 299
+# Models trained on lesion crops can run at a smaller input size (e.g. 224)
+IMG_SIZE = int(os.environ.get("IMG_SIZE", "299"))
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 NUM_CLASSES = 7
+
+# Intra-op threads per worker, from autotune.json via gunicorn.conf.py
+if os.environ.get("TORCH_NUM_THREADS"):
+    torch.set_num_threads(int(os.environ["TORCH_NUM_THREADS"]))
 LABELS = ["nv", "mel", "bkl", "bcc", "akiec", "vasc", "df"]
 
 test_transform = A.Compose([
@@ -89,30 +55,95 @@ test_transform = A.Compose([
 # 3. Load Model and Weights
 # ============================================================
 
-model_checkpoint = "best_inception_resnetv2_attention.pth"
+# May point at a channel-pruned checkpoint from models/prune_irv2.py
+model_checkpoint = os.environ.get("MODEL_CHECKPOINT", "best_inception_resnetv2_attention.pth")
 
-model = InceptionResNetV2_SoftAttention(num_classes=NUM_CLASSES, dropout_p=0.5)
-model.to(DEVICE)
-dummy_input = torch.randn(1, 3, IMG_SIZE, IMG_SIZE).to(DEVICE)
-_ = model(dummy_input)
 try:
-    # Use weights_only=True for secure loading
-    model.load_state_dict(torch.load(model_checkpoint, map_location=DEVICE, weights_only=True))
+    # weights_only=True for secure loading; the fc head is sized for IMG_SIZE
+    model = load_serving_model(model_checkpoint, DEVICE, img_size=IMG_SIZE, num_classes=NUM_CLASSES)
 except Exception as e:
     raise RuntimeError(f"Failed to load model checkpoint: {e}")
 model.eval()
 
+# Temperature scaling fitted on ISIC2018 by models/calibrate_temperature.py (1.0: uncalibrated)
+TEMPERATURE_PATH = os.environ.get("TEMPERATURE_PATH", "temperature.json")
+
+temperature = 1.0
+if os.path.exists(TEMPERATURE_PATH):
+    with open(TEMPERATURE_PATH) as f:
+        calibration = json.load(f)
+    # A temperature fitted on another checkpoint's logits would mis-scale this one's
+    calibrated_checkpoint = calibration.get("checkpoint")
+    if calibrated_checkpoint != os.path.basename(model_checkpoint):
+        print(f"Warning: {TEMPERATURE_PATH} was fitted on {calibrated_checkpoint}, serving {os.path.basename(model_checkpoint)}; "
+              "ignoring it (rerun models/calibrate_temperature.py)")
+    else:
+        temperature = float(calibration["temperature"])
+        print(f"Loaded calibration temperature {temperature:.4f} from {TEMPERATURE_PATH}")
+
+SIMILARITY_INDEX_PATH = os.environ.get("SIMILARITY_INDEX_PATH", "similarity_index.npz")
+DEFAULT_TOP_K = 5
+MAX_TOP_K = int(os.environ.get("SIMILARITY_MAX_TOP_K", "50"))
+
+similarity_index = None
+if os.path.exists(SIMILARITY_INDEX_PATH):
+    similarity_index = IVFPQIndex.load(SIMILARITY_INDEX_PATH)
+    print(f"Loaded similarity index with {len(similarity_index)} reference images")
+
+# Opt-in inference-time lesion cropping (see preprocessing/lesion_crop.py). Crops change what
+# the classifier sees, so a trained mask predictor is only used when LESION_CROPPER_PATH is
+# set explicitly, alongside a checkpoint trained on crops; training one never switches it on.
+LESION_CROPPER_PATH = os.environ.get("LESION_CROPPER_PATH", "")
+
+lesion_cropper = None
+if LESION_CROPPER_PATH:
+    if not os.path.exists(LESION_CROPPER_PATH):
+        raise RuntimeError(f"LESION_CROPPER_PATH is set but {LESION_CROPPER_PATH} does not exist")
+    lesion_cropper = LesionCropper(LESION_CROPPER_PATH, DEVICE)
+    print(f"Loaded lesion cropper from {LESION_CROPPER_PATH}")
+
+# Optional EfficientNet-B3 + ResNet50 + ViT-B/16 fusion model (see vertex/fusion_engine.py)
+FUSION_CHECKPOINT_PATH = os.environ.get("FUSION_CHECKPOINT_PATH", "best_fusion_model.pth")
+FUSION_EARLY_EXIT_THRESHOLD = float(os.environ.get("FUSION_EARLY_EXIT_THRESHOLD", "0.95"))
+
+fusion_engine = None
+if os.path.exists(FUSION_CHECKPOINT_PATH):
+    fusion_engine = load_engine(FUSION_CHECKPOINT_PATH, DEVICE, num_classes=NUM_CLASSES)
+    print(f"Loaded fusion model from {FUSION_CHECKPOINT_PATH}")
+
+fusion_transform = A.Compose([
+    A.Resize(height=FUSION_IMG_SIZE, width=FUSION_IMG_SIZE),
+    A.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
+    ToTensorV2()
+])
+
+LESION_DB_PATH = os.environ.get("LESION_DB_PATH", "lesions.db")
+lesion_tracker = LesionTracker(LESION_DB_PATH, mel_index=LABELS.index("mel"))
+
 # ============================================================
 # 4. Formatting Functions
 # ============================================================
 
-def format_percentage(prob):
-    percent = round(prob * 100, 1)
-    if percent < 0.1:
-        return "<0.1%"
-    if percent.is_integer():
-        return f"{int(percent)}%"
-    return f"{percent}%"
+def format_percentages(probs):
+    # One decimal, trailing ".0" dropped, "<0.1%" below 0.1, over a whole (batch, classes) array
+    percent = np.round(np.asarray(probs, dtype=np.float64) * 100, 1)
+    text = np.char.replace(np.char.mod("%.1f%%", percent), ".0%", "%")
+    return np.where(percent < 0.1, "<0.1%", text)
+
+def format_predictions(probs, timestamp_str, processing_time_str, labels=LABELS):
+    # One response dict per row of a numpy probability matrix whose columns follow `labels`
+    pred_idx = probs.argmax(axis=1).tolist()
+    percentages = format_percentages(probs).tolist()
+    return [
+        {
+            "timestamp": timestamp_str,
+            "prediction": labels[idx],
+            "confidence": row[idx],
+            "detailed_predictions": dict(zip(labels, row)),
+            "processing_time": processing_time_str
+        }
+        for idx, row in zip(pred_idx, percentages)
+    ]
 
 def format_processing_time(elapsed):
     minutes = int(elapsed // 60)
@@ -123,36 +154,113 @@ def format_processing_time(elapsed):
 # 5. Prediction Function
 # ============================================================
 
-def predict(image):
-    image_np = np.array(image)
-    transformed = test_transform(image=image_np)
-    image_tensor = transformed["image"].unsqueeze(0).to(DEVICE)
-    
+def predict_batch(images, return_embeddings=False, deadlines=None, explain=None):
+    # Rows whose request deadline has passed are dropped before each expensive step and
+    # come back as None (and NaN probs/embeddings rows)
+    live = live_indices(deadlines, len(images))
+    images = [images[i] for i in live]
+    bboxes = None
+    if lesion_cropper is not None and images:
+        bboxes = lesion_cropper.predict_bboxes(images)
+        images = [crop_image(image, bbox) for image, bbox in zip(images, bboxes)]
+    tensors = [test_transform(image=np.array(image))["image"] for image in images]
+    if deadlines is not None:
+        keep = live_indices([deadlines[i] for i in live], len(live))
+        live, images, tensors = [live[i] for i in keep], [images[i] for i in keep], [tensors[i] for i in keep]
+        bboxes = [bboxes[i] for i in keep] if bboxes is not None else None
+
+    results = [None] * len(deadlines if deadlines is not None else live)
+    all_probs = np.full((len(results), NUM_CLASSES), np.nan, dtype=np.float32)
+    all_embeddings = None
+    if not tensors:
+        return (results, all_probs, all_embeddings) if return_embeddings else results
+    image_tensor = torch.stack(tensors).to(DEVICE)
+
     start_time = time.time()
     with torch.no_grad():
-        outputs = model(image_tensor)
-        probs = F.softmax(outputs, dim=1)
+        outputs, embeddings, attn_maps = model(image_tensor, return_embedding=True, return_attention=True)
+        # Calibrated probabilities, copied to numpy once for the whole batch
+        probs = F.softmax(outputs / temperature, dim=1).cpu().numpy()
     elapsed_time = time.time() - start_time
 
-    pred_idx = torch.argmax(probs, dim=1).item()
-    predicted_label = LABELS[pred_idx]
-    confidence_str = format_percentage(probs[0][pred_idx].item())
+    timestamp_str = datetime.utcnow().strftime("%d-%m-%Y - %H:%M:%S")
+    processing_time_str = format_processing_time(elapsed_time)
+
+    for i, result in zip(live, format_predictions(probs, timestamp_str, processing_time_str)):
+        results[i] = result
+    if explain:
+        # Rendered from the maps of the forward pass above, outside processing_time
+        for i, explanation in zip(live, explain_batch(images, attn_maps, explain, bboxes)):
+            results[i]["explanation"] = explanation
+    if return_embeddings:
+        embeddings = embeddings.cpu().numpy()
+        all_probs[live] = probs
+        all_embeddings = np.full((len(results), embeddings.shape[1]), np.nan, dtype=embeddings.dtype)
+        all_embeddings[live] = embeddings
+        return results, all_probs, all_embeddings
+    return results
+
+def predict(image, explain=None):
+    return predict_batch([image], explain=explain)[0]
+
+def predict_fusion_batch(images, return_features=False):
+    image_tensor = torch.stack([
+        fusion_transform(image=np.array(image))["image"] for image in images
+    ]).to(DEVICE)
+
+    start_time = time.time()
+    output = fusion_engine.infer(image_tensor, early_exit_threshold=FUSION_EARLY_EXIT_THRESHOLD, return_features=return_features)
+    probs = output["probs"].cpu().numpy()
+    elapsed_time = time.time() - start_time
 
-    detailed_predictions = {
-        LABELS[i]: format_percentage(probs[0][i].item())
-        for i in range(NUM_CLASSES)
-    }
-    
     timestamp_str = datetime.utcnow().strftime("%d-%m-%Y - %H:%M:%S")
     processing_time_str = format_processing_time(elapsed_time)
-    
-    return {
-        "timestamp": timestamp_str,
-        "prediction": predicted_label,
-        "confidence": confidence_str,
-        "detailed_predictions": detailed_predictions,
-        "processing_time": processing_time_str
-    }
+
+    results = format_predictions(probs, timestamp_str, processing_time_str, labels=FUSION_LABELS)
+    # Fused 4352-dim features, so callers can cache them and skip the backbones later
+    features = output["features"].cpu().numpy().round(6).tolist() if output["features"] is not None else None
+    for i, result in enumerate(results):
+        result["exited_branch"] = output["exited_branch"]
+        if features is not None:
+            result["features"] = features[i]
+    return results
+
+def embed(image):
+    image_np = np.array(image)
+    transformed = test_transform(image=image_np)
+    image_tensor = transformed["image"].unsqueeze(0).to(DEVICE)
+    with torch.no_grad():
+        _, embedding = model(image_tensor, return_embedding=True)
+    return embedding.cpu().numpy()
+
+def find_similar(image, k):
+    distances, ids = similarity_index.search(embed(image), k=k)
+    return [
+        {
+            "image_id": str(similarity_index.metadata["image_id"][idx]),
+            "dx": str(similarity_index.metadata["dx"][idx]),
+            "distance": round(float(dist), 4),
+        }
+        for dist, idx in zip(distances[0], ids[0]) if idx >= 0
+    ]
+
+def decode_image(base64_image):
+    image_bytes = base64.b64decode(base64_image)
+    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+# Every request carries a deadline (see deadlines.py). Requests that expired while queued
+# are shed before decoding, and again after decoding before they reach the model.
+def start_deadline():
+    g.deadline = Deadline.from_headers(request.headers)
+    if request.method == "POST":
+        g.deadline.check("queued")
+
+def deadline_exceeded(e):
+    print(f"Shed {request.path}: {e}")
+    return jsonify({"error": str(e)}), 504
+
+app.before_request(start_deadline)
+app.register_error_handler(DeadlineExceeded, deadline_exceeded)
 
 @app.route("/predict", methods=["POST"])
 def predict_endpoint():
@@ -164,26 +272,117 @@ def predict_endpoint():
         print("No instances provided in payload.")
         return jsonify({"error": "No instances provided."}), 400
 
+    try:
+        # {"parameters": {"explain": true | "png" | "rle"}} adds an attention heatmap to the prediction
+        explain = parse_explain((data.get("parameters") or {}).get("explain"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
         base64_image = data['instances'][0]['image']
         print("Base64 image received, length:", len(base64_image))
-        image_bytes = base64.b64decode(base64_image)
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+        image = decode_image(base64_image)
     except Exception as e:
         print("Error processing image:", e)
         return jsonify({"error": f"Error processing image: {str(e)}"}), 400
 
-    result = predict(image)
-    print("Prediction result:", result)
+    g.deadline.check("before_model")
+
+    result = predict(image, explain=explain)
+    # The base64 overlay is left out of the logs
+    logged = {k: v for k, v in result.items() if k != "explanation"}
+    print("Prediction result:", logged)
     
     response = {"predictions": [result]}
-    print("Final response:", response)
+    print("Final response:", {"predictions": [logged]})
     return jsonify(response)
 
+@app.route("/predict_fusion", methods=["POST"])
+def predict_fusion_endpoint():
+    if fusion_engine is None:
+        return jsonify({"error": "Fusion model is not loaded."}), 503
+
+    data = request.get_json()
+    if not data or 'instances' not in data:
+        return jsonify({"error": "No instances provided."}), 400
+
+    try:
+        instance = data['instances'][0]
+        return_features = bool(instance.get('return_features', False))
+        image = decode_image(instance['image'])
+    except Exception as e:
+        print("Error processing image:", e)
+        return jsonify({"error": f"Error processing image: {str(e)}"}), 400
+
+    g.deadline.check("before_model")
+
+    return jsonify({"predictions": predict_fusion_batch([image], return_features)})
+
+@app.route("/similar", methods=["POST"])
+def similar_endpoint():
+    if similarity_index is None:
+        return jsonify({"error": "Similarity index is not loaded."}), 503
+
+    data = request.get_json()
+    if not data or 'instances' not in data:
+        return jsonify({"error": "No instances provided."}), 400
+
+    try:
+        instance = data['instances'][0]
+        k = int(instance.get('k', DEFAULT_TOP_K))
+        image = decode_image(instance['image'])
+    except Exception as e:
+        print("Error processing image:", e)
+        return jsonify({"error": f"Error processing image: {str(e)}"}), 400
+
+    max_k = min(MAX_TOP_K, len(similarity_index))
+    if not 1 <= k <= max_k:
+        return jsonify({"error": f"k must be between 1 and {max_k}."}), 400
+
+    g.deadline.check("before_model")
+
+    return jsonify({"predictions": [{"similar": find_similar(image, k)}]})
+
+@app.route("/track", methods=["POST"])
+def track_endpoint():
+    data = request.get_json()
+    if not data or 'instances' not in data:
+        return jsonify({"error": "No instances provided."}), 400
+
+    try:
+        instance = data['instances'][0]
+        patient_id, lesion_id = str(instance['patient_id']), str(instance['lesion_id'])
+        image = decode_image(instance['image'])
+    except Exception as e:
+        print("Error processing image:", e)
+        return jsonify({"error": f"Error processing request: {str(e)}"}), 400
+
+    g.deadline.check("before_model")
+
+    results, probs, embeddings = predict_batch([image], return_embeddings=True)
+    change = lesion_tracker.record_visit(patient_id, lesion_id, embeddings[0], probs[0])
+    return jsonify({"predictions": [dict(results[0], change=change)]})
+
+@app.route("/lesions/flagged", methods=["GET"])
+def flagged_lesions_endpoint():
+    metric = request.args.get("metric", "last_drift")
+    if metric not in DRIFT_METRICS:
+        return jsonify({"error": f"metric must be one of {DRIFT_METRICS}."}), 400
+    try:
+        threshold = float(request.args["threshold"])
+        limit = min(int(request.args.get("limit", 100)), 1000)
+    except (KeyError, ValueError):
+        return jsonify({"error": "A numeric threshold is required."}), 400
+    return jsonify({"lesions": lesion_tracker.flagged_lesions(threshold, metric, limit)})
+
+@app.route("/lesions/<patient_id>/<lesion_id>", methods=["GET"])
+def lesion_history_endpoint(patient_id, lesion_id):
+    return jsonify({"history": lesion_tracker.history(patient_id, lesion_id, LABELS)})
+
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"}), 200
+    return jsonify({"status": "ok", "shed": shed_counts()}), 200
 
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=8080)
@@ -0,0 +1,227 @@
+import os
+import json
+import math
+import time
+import queue
+import argparse
+import multiprocessing
+import numpy as np
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+# Run offline on the serving machine type (`python autotune.py`) and ship the resulting
+# autotune.json with the image. Without a result for the container's CPU quota,
+# gunicorn.conf.py serves with quota_config() and tunes once before the workers start.
+AUTOTUNE_CONFIG_PATH = os.environ.get("AUTOTUNE_CONFIG_PATH", "autotune.json")
+LATENCY_SLO_MS = float(os.environ.get("AUTOTUNE_SLO_MS", "1000"))
+SYNC_LATENCY_SLO_MS = float(os.environ.get("AUTOTUNE_SYNC_SLO_MS", "5000"))
+DURATION_S = float(os.environ.get("AUTOTUNE_DURATION_S", "5"))
+# Longest a worker may take to load the model and warm up before the run is abandoned
+WORKER_TIMEOUT_S = float(os.environ.get("AUTOTUNE_WORKER_TIMEOUT_S", "300"))
+SYNC_BATCH_SIZES = [1, 4, 8, 16]
+# Same model and input size as app.py
+MODEL_CHECKPOINT = os.environ.get("MODEL_CHECKPOINT", "best_inception_resnetv2_attention.pth")
+IMG_SIZE = int(os.environ.get("IMG_SIZE", "299"))
+NUM_CLASSES = 7
+
+# ============================================================
+# 2. CPU Quota
+# ============================================================
+
+def cgroup_cpu_limit():
+    # cgroup v2 (cpu.max: "<quota> <period>" or "max <period>"), then cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+def available_cpus():
+    # A container sees every host core in os.cpu_count(); the quota is what it may use
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.floor(limit)))
+    return cpus
+
+def candidate_configs(cpus):
+    # Workers x torch threads never exceeds the quota, so processes do not oversubscribe it
+    workers = sorted({w for w in (1, 2, 4, 8, cpus) if w <= cpus})
+    return [{"workers": w, "torch_threads": max(1, cpus // w)} for w in workers]
+
+# ============================================================
+# 3. Benchmark
+# ============================================================
+
+def build_model(checkpoint):
+    # The served checkpoint (full or channel-pruned) at the served input size
+    import torch
+    from serving_model import load_serving_model
+    return load_serving_model(checkpoint, torch.device("cpu"), img_size=IMG_SIZE, num_classes=NUM_CLASSES).eval()
+
+def benchmark_worker(checkpoint, torch_threads, batch_size, duration, barrier, results):
+    # Puts its timings, or the error as a string; a failing worker breaks the barrier so
+    # the others stop waiting for it
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+        model = build_model(checkpoint)
+        x = torch.randn(batch_size, 3, IMG_SIZE, IMG_SIZE)
+        with torch.no_grad():
+            model(x)  # warm-up
+            barrier.wait()
+            timings, end = [], time.perf_counter() + duration
+            while time.perf_counter() < end:
+                start = time.perf_counter()
+                model(x)
+                timings.append(time.perf_counter() - start)
+        results.put(timings)
+    except Exception as e:
+        barrier.abort()
+        results.put(f"{type(e).__name__}: {e}")
+
+def benchmark_config(config, batch_size, checkpoint, duration=DURATION_S):
+    # All workers start together, as gunicorn workers would serve concurrent traffic
+    context = multiprocessing.get_context("spawn")
+    barrier, results = context.Barrier(config["workers"], timeout=WORKER_TIMEOUT_S), context.Queue()
+    processes = [
+        context.Process(target=benchmark_worker, args=(checkpoint, config["torch_threads"], batch_size, duration, barrier, results))
+        for _ in range(config["workers"])
+    ]
+    for process in processes:
+        process.start()
+    outcomes, give_up = [], time.monotonic() + WORKER_TIMEOUT_S + duration
+    while len(outcomes) < len(processes) and time.monotonic() < give_up:
+        try:
+            outcomes.append(results.get(timeout=1))
+        except queue.Empty:
+            # A worker killed without reporting (e.g. out of memory) never puts a result
+            if any(process.exitcode not in (None, 0) for process in processes):
+                break
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+
+    errors = [o for o in outcomes if isinstance(o, str)]
+    errors += [f"worker exited with code {p.exitcode}" for p in processes if p.exitcode not in (0, None)]
+    if len(outcomes) < len(processes) and not errors:
+        errors.append(f"no result within {WORKER_TIMEOUT_S + duration:.0f} s")
+    if errors:
+        raise RuntimeError(f"Benchmark of {config} at batch {batch_size} failed: {'; '.join(dict.fromkeys(errors))}")
+    timings = outcomes
+    batch_latencies = np.concatenate([np.asarray(t) for t in timings]) * 1000
+    images = sum(len(t) for t in timings) * batch_size
+    # A request in a full batch waits for the whole batch, so its latency is the batch latency
+    return dict(config,
+                batch_size=batch_size,
+                images_per_sec=images / duration,
+                p50_ms=float(np.percentile(batch_latencies, 50)),
+                p95_ms=float(np.percentile(batch_latencies, 95)))
+
+def choose(results, slo_ms):
+    within = [r for r in results if r["p95_ms"] <= slo_ms]
+    if within:
+        return max(within, key=lambda r: r["images_per_sec"])
+    # Nothing meets the SLO: take the lowest-latency configuration
+    return min(results, key=lambda r: r["p95_ms"])
+
+def report(r):
+    print(f"[autotune] workers={r['workers']} threads={r['torch_threads']} batch={r['batch_size']}: "
+          f"{r['images_per_sec']:.1f} img/s, p95 {r['p95_ms']:.0f} ms")
+
+def tune(cpus, checkpoint=MODEL_CHECKPOINT, slo_ms=LATENCY_SLO_MS, sync_slo_ms=SYNC_LATENCY_SLO_MS, duration=DURATION_S):
+    # /predict scores one image per request, so workers x threads are chosen at batch 1
+    predict_results = []
+    for config in candidate_configs(cpus):
+        predict_results.append(benchmark_config(config, 1, checkpoint, duration))
+        report(predict_results[-1])
+    best = choose(predict_results, slo_ms)
+    serving = {key: best[key] for key in ("workers", "torch_threads")}
+
+    # sync_service.py chunks uploads by SYNC_MAX_BATCH_SIZE; tuned separately, on the chosen
+    # workers x threads and against its own (batch) latency budget
+    sync_results = []
+    for batch_size in SYNC_BATCH_SIZES:
+        sync_results.append(benchmark_config(serving, batch_size, checkpoint, duration))
+        report(sync_results[-1])
+    sync_best = choose(sync_results, sync_slo_ms)
+    return {
+        "cpus": cpus,
+        "slo_ms": slo_ms,
+        "sync_slo_ms": sync_slo_ms,
+        "img_size": IMG_SIZE,
+        "checkpoint": os.path.basename(checkpoint),
+        "config": dict(serving, sync_max_batch_size=sync_best["batch_size"]),
+        "predict_results": predict_results,
+        "sync_results": sync_results,
+    }
+
+# ============================================================
+# 4. Persisted Configuration
+# ============================================================
+
+def save_config(tuned, path=AUTOTUNE_CONFIG_PATH):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(tuned, f, indent=2)
+    os.replace(tmp_path, path)
+
+def load_config(path=AUTOTUNE_CONFIG_PATH):
+    # Returns None when there is no result for this CPU quota
+    if not os.path.exists(path):
+        print(f"[autotune] {path} not found")
+        return None
+    with open(path) as f:
+        stored = json.load(f)
+    cpus = available_cpus()
+    if stored.get("cpus") != cpus:
+        print(f"[autotune] {path} was tuned for {stored.get('cpus')} CPUs, this container has {cpus}; ignoring it")
+        return None
+    if stored.get("img_size") != IMG_SIZE:
+        print(f"[autotune] {path} was tuned at IMG_SIZE={stored.get('img_size')}, serving {IMG_SIZE}; ignoring it")
+        return None
+    return stored["config"]
+
+def quota_config(cpus=None):
+    # Untuned fallback: one worker whose torch threads cover the quota, rather than torch
+    # sizing its pool from every host core; sync_service.py keeps its default batch size
+    return {"workers": 1, "torch_threads": cpus or available_cpus(), "sync_max_batch_size": None}
+
+def apply_to_environment(config, keep=()):
+    # Read by app.py (TORCH_NUM_THREADS) and sync_service.py (SYNC_MAX_BATCH_SIZE) in each worker;
+    # variables named in keep (set by the deployment) are left alone
+    values = {"TORCH_NUM_THREADS": config["torch_threads"], "SYNC_MAX_BATCH_SIZE": config["sync_max_batch_size"]}
+    for name, value in values.items():
+        if value is not None and name not in keep:
+            os.environ[name] = str(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark workers x torch threads (batch 1) and the sync batch size of the served model on this machine's CPU quota.")
+    parser.add_argument("--checkpoint", default=MODEL_CHECKPOINT)
+    parser.add_argument("--output", default=AUTOTUNE_CONFIG_PATH)
+    parser.add_argument("--duration", type=float, default=DURATION_S, help="Seconds per configuration.")
+    args = parser.parse_args()
+    if not os.path.exists(args.checkpoint):
+        parser.error(f"checkpoint {args.checkpoint} not found (set --checkpoint or MODEL_CHECKPOINT)")
+
+    cpus = available_cpus()
+    print(f"[autotune] {cpus} CPUs available, {os.path.basename(args.checkpoint)} at {IMG_SIZE}x{IMG_SIZE}")
+    tuned = tune(cpus, args.checkpoint, duration=args.duration)
+    save_config(tuned, args.output)
+    print(f"[autotune] chose {tuned['config']} -> {args.output}")
+
+if __name__ == "__main__":
+    main()
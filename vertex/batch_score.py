@@ -0,0 +1,232 @@
+import os
+import io
+import csv
+import json
+import time
+import zipfile
+import argparse
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+# Offline scoring of clinic archive dumps with the model, weights, calibration and
+# preprocessing of app.py. app.py (and with it torch and the model) is imported only in
+# the main process; decode workers are spawned and import just this module.
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+BATCH_SIZE = 64
+CHECKPOINT_EVERY = 1024  # images per output part / checkpoint
+
+# ============================================================
+# 2. Image Sources
+# ============================================================
+
+def is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS) and not os.path.basename(name).startswith(".")
+
+def list_images(source):
+    # Sorted, so the n-th image is the same on every run and progress is a single count
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return sorted(name for name in archive.namelist() if is_image(name) and "__MACOSX/" not in name)
+    names = []
+    for folder, _, files in os.walk(source):
+        names.extend(os.path.relpath(os.path.join(folder, f), source) for f in files if is_image(f))
+    return sorted(names)
+
+# ============================================================
+# 3. Decode Workers
+# ============================================================
+
+_source = None
+_archive = None
+_transform = None
+
+def init_worker(source, transform):
+    # Each worker keeps its own handle on the zip; ZipFile objects are not shared across processes
+    global _source, _archive, _transform
+    _source, _transform = source, transform
+    _archive = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+
+def decode(name):
+    # Returns (array, error). With a transform the array is the normalized HWC float32 model
+    # input; without one (lesion cropping) it is the decoded RGB image
+    try:
+        if _archive is not None:
+            image = Image.open(io.BytesIO(_archive.read(name)))
+        else:
+            image = Image.open(os.path.join(_source, name))
+        image = np.array(image.convert("RGB"))
+        if _transform is not None:
+            image = _transform(image=image)["image"]
+        return image, None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+# ============================================================
+# 4. Incremental Output and Checkpoint
+# ============================================================
+
+class CsvWriter:
+    def __init__(self, path, columns, offset):
+        # Truncating to the checkpointed offset drops rows written after the last checkpoint
+        mode = "r+" if offset and os.path.exists(path) else "w"
+        self.file = open(path, mode, newline="")
+        self.file.truncate(offset if mode == "r+" else 0)
+        self.file.seek(0, os.SEEK_END)
+        self.writer = csv.DictWriter(self.file, fieldnames=columns)
+        if mode == "w":
+            self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"csv_bytes": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+class ParquetWriter:
+    def __init__(self, path, columns, part):
+        # One file per checkpoint; pd.read_parquet(path) reads the folder as one table
+        import pandas as pd
+        self.pd = pd
+        self.path, self.columns, self.part = path, columns, part
+        os.makedirs(path, exist_ok=True)
+        if part == 0:
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+
+    def write(self, rows):
+        frame = self.pd.DataFrame(rows, columns=self.columns)
+        part_path = os.path.join(self.path, f"part-{self.part:05d}.parquet")
+        frame.to_parquet(part_path + ".tmp", index=False)
+        os.replace(part_path + ".tmp", part_path)
+        self.part += 1
+        return {"parts": self.part}
+
+    def close(self):
+        pass
+
+def load_checkpoint(path, source, num_images):
+    if not os.path.exists(path):
+        return {"source": source, "num_images": num_images, "done": 0, "parts": 0, "csv_bytes": 0}
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint["source"] != source or checkpoint["num_images"] != num_images:
+        raise SystemExit(f"{path} belongs to a different source ({checkpoint['source']}, {checkpoint['num_images']} images); "
+                         "use --restart or another --output")
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+# ============================================================
+# 5. Scoring
+# ============================================================
+
+def batches(names, size):
+    for start in range(0, len(names), size):
+        yield names[start:start + size]
+
+def score(args):
+    import torch
+    import torch.nn.functional as F
+    import albumentations as A
+    from app import DEVICE, LABELS, lesion_cropper, model, temperature, test_transform
+
+    source = os.path.abspath(args.source)
+    names = list_images(source)
+    checkpoint_path = args.output + ".checkpoint.json"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    checkpoint = load_checkpoint(checkpoint_path, source, len(names))
+    done = checkpoint["done"]
+    print(f"{len(names)} images in {source}; {done} already scored")
+    if done == len(names):
+        print(f"✅ Nothing left to score, results in {args.output}")
+        return
+
+    columns = ["image", "prediction", "confidence"] + [f"p_{label}" for label in LABELS] + ["error"]
+    if args.format == "csv":
+        writer = CsvWriter(args.output, columns, checkpoint["csv_bytes"])
+    else:
+        writer = ParquetWriter(args.output, columns, checkpoint["parts"])
+
+    # app.py's test_transform without ToTensorV2, so workers return plain numpy arrays.
+    # Lesion cropping needs the full image and the cropper model, so it stays in this process.
+    worker_transform = A.Compose(test_transform.transforms[:-1]) if lesion_cropper is None else None
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(args.workers, initializer=init_worker, initargs=(source, worker_transform))
+
+    pending = list(batches(names[done:], args.batch_size))
+    rows, start_time, scored = [], time.time(), 0
+    chunksize = max(1, args.batch_size // (4 * args.workers))
+    # The next batch decodes while the current one runs through the model
+    future = pool.map_async(decode, pending[0], chunksize) if pending else None
+    try:
+        for index, batch in enumerate(pending):
+            decoded = future.get()
+            if index + 1 < len(pending):
+                future = pool.map_async(decode, pending[index + 1], chunksize)
+
+            ok = [i for i, (array, _) in enumerate(decoded) if array is not None]
+            probs = np.full((len(batch), len(LABELS)), np.nan, dtype=np.float32)
+            if ok:
+                arrays = [decoded[i][0] for i in ok]
+                if lesion_cropper is not None:
+                    crops = lesion_cropper.crop([Image.fromarray(a) for a in arrays])
+                    tensor = torch.stack([test_transform(image=np.array(c))["image"] for c in crops])
+                else:
+                    tensor = torch.from_numpy(np.stack(arrays)).permute(0, 3, 1, 2).contiguous()
+                with torch.no_grad():
+                    outputs = model(tensor.to(DEVICE))
+                    probs[ok] = F.softmax(outputs / temperature, dim=1).cpu().numpy()
+
+            pred_idx = probs.argmax(axis=1)
+            for name, (_, error), p, idx in zip(batch, decoded, probs.tolist(), pred_idx.tolist()):
+                row = {"image": name, "prediction": None, "confidence": None, "error": error}
+                row.update({f"p_{label}": None for label in LABELS})
+                if error is None:
+                    row.update(prediction=LABELS[idx], confidence=p[idx])
+                    row.update({f"p_{label}": value for label, value in zip(LABELS, p)})
+                rows.append(row)
+
+            done += len(batch)
+            scored += len(batch)
+            if len(rows) >= args.checkpoint_every or done == len(names):
+                # Output first, then the checkpoint: a kill in between only repeats these rows
+                checkpoint.update(writer.write(rows), done=done)
+                save_checkpoint(checkpoint_path, checkpoint)
+                rows = []
+                rate = scored / (time.time() - start_time)
+                print(f"{done}/{len(names)} images ({rate:.1f} img/s)")
+    finally:
+        pool.terminate()
+        pool.join()
+        writer.close()
+    print(f"✅ Scored {len(names)} images -> {args.output}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a directory or zip of dermoscopy images with the served model.")
+    parser.add_argument("source", help="Folder (searched recursively) or .zip of images.")
+    parser.add_argument("--output", required=True, help="CSV file, or folder of Parquet parts with --format parquet.")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1), help="Decode processes.")
+    parser.add_argument("--checkpoint-every", type=int, default=CHECKPOINT_EVERY, help="Images per output part and checkpoint.")
+    parser.add_argument("--restart", action="store_true", help="Ignore an existing checkpoint and start over.")
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+    score(args)
+
+if __name__ == "__main__":
+    main()
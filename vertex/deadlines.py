@@ -0,0 +1,92 @@
+import os
+import time
+import threading
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+# Clients (or the gateway in front of the container) send either a relative budget or an
+# absolute deadline; requests without one get DEFAULT_TIMEOUT_MS.
+TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+DEADLINE_HEADER = "X-Request-Deadline"      # unix time in seconds
+# Set by proxies when the request was accepted ("t=<microseconds>" or seconds), so the
+# budget also covers time spent waiting in the proxy and gunicorn backlog
+REQUEST_START_HEADER = "X-Request-Start"
+DEFAULT_TIMEOUT_MS = float(os.environ.get("REQUEST_TIMEOUT_MS", "60000"))
+
+SHED_STAGES = ["queued", "before_model", "in_batch"]
+
+# ============================================================
+# 2. Deadlines
+# ============================================================
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super(DeadlineExceeded, self).__init__(f"Request deadline exceeded ({stage})")
+        self.stage = stage
+
+def parse_request_start(value):
+    value = str(value).strip()
+    try:
+        value = float(value[2:] if value.startswith("t=") else value)
+    except ValueError:
+        return None
+    # Microseconds, milliseconds or seconds since the epoch; anything not within a day of now is ignored
+    now = time.time()
+    for scale in (1e6, 1e3, 1.0):
+        if abs(value / scale - now) < 86400:
+            return value / scale
+    return None
+
+class Deadline:
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_headers(cls, headers, default_timeout_ms=DEFAULT_TIMEOUT_MS):
+        now = time.time()
+        try:
+            if headers.get(DEADLINE_HEADER):
+                return cls(float(headers[DEADLINE_HEADER]))
+            timeout_ms = float(headers.get(TIMEOUT_HEADER) or default_timeout_ms)
+        except ValueError:
+            timeout_ms = default_timeout_ms
+        start = parse_request_start(headers[REQUEST_START_HEADER]) if headers.get(REQUEST_START_HEADER) else None
+        return cls(min(start or now, now) + timeout_ms / 1000.0)
+
+    def remaining(self):
+        return self.expires_at - time.time()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self, stage):
+        if self.expired():
+            record_shed(stage)
+            raise DeadlineExceeded(stage)
+
+# ============================================================
+# 3. Shed Counters
+# ============================================================
+
+# Per process: each gunicorn worker reports its own counts on /health
+_shed_lock = threading.Lock()
+_shed_counts = dict.fromkeys(SHED_STAGES, 0)
+
+def record_shed(stage, count=1):
+    if count:
+        with _shed_lock:
+            _shed_counts[stage] += count
+
+def shed_counts():
+    with _shed_lock:
+        return dict(_shed_counts, total=sum(_shed_counts.values()), pid=os.getpid())
+
+def live_indices(deadlines, count):
+    # Rows of a batch whose requests have not timed out; the rest are counted as shed
+    if deadlines is None:
+        return list(range(count))
+    live = [i for i, deadline in enumerate(deadlines) if not deadline.expired()]
+    record_shed("in_batch", count - len(live))
+    return live
@@ -0,0 +1,94 @@
+import os
+import io
+import base64
+import numpy as np
+import torch.nn.functional as F
+from PIL import Image
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+# Heatmaps come from the SoftAttention maps of the prediction's own forward pass
+# (8x8 at 299x299 input), so explaining costs no extra forward or backward pass.
+EXPLAIN_FORMATS = ("png", "rle")
+MAX_SIDE = int(os.environ.get("EXPLAIN_MAX_SIDE", "512"))
+MASK_THRESHOLD = float(os.environ.get("EXPLAIN_MASK_THRESHOLD", "0.5"))
+OVERLAY_ALPHA = 0.5
+
+def parse_explain(value):
+    # `parameters.explain` of a /predict request: false/absent, true (png), "png" or "rle"
+    if value in (None, False, "", "false", "0", 0):
+        return None
+    if value in (True, "true", "1", 1):
+        return "png"
+    if value in EXPLAIN_FORMATS:
+        return value
+    raise ValueError(f"explain must be a boolean or one of {', '.join(EXPLAIN_FORMATS)}")
+
+# ============================================================
+# 2. Heatmaps
+# ============================================================
+
+def output_size(image, max_side=MAX_SIDE):
+    width, height = image.size
+    scale = min(1.0, max_side / max(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def heatmaps(attn_maps, sizes):
+    # (batch, heads or 1, h, w) attention -> one [0, 1] map per image at its (width, height)
+    maps = attn_maps.detach().sum(dim=1, keepdim=True).float().cpu()
+    result = []
+    for attn, (width, height) in zip(maps, sizes):
+        upsampled = F.interpolate(attn[None], size=(height, width), mode="bilinear", align_corners=False)[0, 0].numpy()
+        low, high = upsampled.min(), upsampled.max()
+        result.append((upsampled - low) / max(high - low, 1e-12))
+    return result
+
+# ============================================================
+# 3. Encodings
+# ============================================================
+
+# Jet colormap lookup table (no matplotlib in the serving image)
+_JET_ANCHORS = np.array([[0, 0, 0.5], [0, 0, 1], [0, 1, 1], [1, 1, 0], [1, 0, 0], [0.5, 0, 0]])
+_JET = np.stack([
+    np.interp(np.linspace(0, 1, 256), np.linspace(0, 1, len(_JET_ANCHORS)), _JET_ANCHORS[:, c]) for c in range(3)
+], axis=1).astype(np.float32) * 255
+
+def png_overlay(image, heatmap):
+    # Colour is blended in proportion to attention, so unattended skin stays as photographed
+    height, width = heatmap.shape
+    photo = np.asarray(image.convert("RGB").resize((width, height), Image.BILINEAR), dtype=np.float32)
+    alpha = OVERLAY_ALPHA * heatmap[..., None]
+    blended = photo * (1 - alpha) + _JET[(heatmap * 255).astype(np.uint8)] * alpha
+    buffer = io.BytesIO()
+    Image.fromarray(blended.astype(np.uint8)).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def rle_mask(heatmap, threshold=MASK_THRESHOLD):
+    # Row-major run lengths of the thresholded map, alternating 0-runs and 1-runs, starting with 0s
+    flat = (heatmap >= threshold).ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], changes, [flat.size]]))
+    if flat[0]:
+        counts = np.concatenate([[0], counts])
+    return {"size": list(heatmap.shape), "counts": counts.tolist(), "threshold": threshold}
+
+def explain_batch(images, attn_maps, fmt, bboxes=None):
+    # `images` are what the model saw (lesion crops if cropping is on); `bboxes` place them
+    # in the uploaded photo as normalized (x0, y0, x1, y1)
+    sizes = [output_size(image) for image in images]
+    explanations = []
+    for i, (image, heatmap) in enumerate(zip(images, heatmaps(attn_maps, sizes))):
+        explanation = {
+            "format": fmt,
+            "width": heatmap.shape[1],
+            "height": heatmap.shape[0],
+            "bbox": [float(v) for v in bboxes[i]] if bboxes is not None else [0.0, 0.0, 1.0, 1.0],
+        }
+        if fmt == "png":
+            explanation["overlay"] = png_overlay(image, heatmap)
+        else:
+            explanation["mask"] = rle_mask(heatmap)
+        explanations.append(explanation)
+    return explanations
@@ -0,0 +1,148 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import timm
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+# Same branches, feature sizes and attribute names as FusionModelTimm in
+# models/fusion-vit-efficientnet-resnet50.ipynb, so its checkpoints load as-is.
+BRANCHES = {
+    "efficientnet": ("efficientnet_b3", 1536),
+    "resnet50": ("resnet50", 2048),
+    "vit": ("vit_base_patch16_224", 768),
+}
+FUSED_DIM = sum(dim for _, dim in BRANCHES.values())  # 4352
+FUSION_IMG_SIZE = 224
+# FusionModelTimm was trained with sorted(dx) class indices, not the LABELS order of app.py
+FUSION_LABELS = ["akiec", "bcc", "bkl", "df", "mel", "nv", "vasc"]
+
+class BranchCancelled(Exception):
+    pass
+
+# Per-thread cancel event, checked before every module of a running branch
+_branch_state = threading.local()
+
+def _check_cancelled(module, inputs):
+    cancel = getattr(_branch_state, "cancel", None)
+    if cancel is not None and cancel.is_set():
+        raise BranchCancelled()
+
+# ============================================================
+# 2. Fusion Engine
+# ============================================================
+
+class FusionEngine(nn.Module):
+    def __init__(self, num_classes=7, dropout_p=0.3, pretrained=False):
+        super(FusionEngine, self).__init__()
+        for name, (arch, _) in BRANCHES.items():
+            setattr(self, name, timm.create_model(arch, pretrained=pretrained, num_classes=0))
+        self.classifier = nn.Sequential(
+            nn.Linear(FUSED_DIM, 512),
+            nn.ReLU(),
+            nn.Dropout(dropout_p),
+            nn.Linear(512, num_classes)
+        )
+        # Linear probes on each branch's features, used only for early exit
+        self.branch_heads = nn.ModuleDict({name: nn.Linear(dim, num_classes) for name, (_, dim) in BRANCHES.items()})
+        self.register_buffer("branch_heads_fitted", torch.tensor(False))
+        self.executor = ThreadPoolExecutor(max_workers=len(BRANCHES), thread_name_prefix="fusion-branch")
+        for name in BRANCHES:
+            for module in getattr(self, name).modules():
+                module.register_forward_pre_hook(_check_cancelled)
+
+    def forward(self, x):
+        # Sequential reference path, identical to FusionModelTimm.forward
+        return self.classifier(torch.cat([getattr(self, name)(x) for name in BRANCHES], dim=1))
+
+    def run_branch(self, name, x, cancel=None):
+        _branch_state.cancel = cancel
+        try:
+            with torch.no_grad():
+                return getattr(self, name)(x)
+        finally:
+            _branch_state.cancel = None
+
+    def confident_exit(self, name, features, threshold):
+        if threshold is None or not bool(self.branch_heads_fitted):
+            return None
+        with torch.no_grad():
+            probs = F.softmax(self.branch_heads[name](features), dim=1)
+        # The whole batch must be confident for the branch to answer alone
+        return probs if bool((probs.max(dim=1).values >= threshold).all()) else None
+
+    def infer(self, x, concurrent=True, early_exit_threshold=None, return_features=False):
+        # Returns class probabilities, the fused 4352-dim features (None after an early exit)
+        # and the branch that answered alone, if any. Requesting features disables early exit.
+        threshold = None if return_features else early_exit_threshold
+        if concurrent:
+            features, exited = self.run_concurrent(x, threshold)
+        else:
+            features, exited = self.run_sequential(x, threshold)
+        if exited is not None:
+            return {"probs": features, "features": None, "exited_branch": exited}
+        fused = torch.cat([features[name] for name in BRANCHES], dim=1)
+        with torch.no_grad():
+            probs = F.softmax(self.classifier(fused), dim=1)
+        return {"probs": probs, "features": fused if return_features else None, "exited_branch": None}
+
+    def run_sequential(self, x, threshold):
+        features = {}
+        for name in BRANCHES:
+            features[name] = self.run_branch(name, x)
+            probs = self.confident_exit(name, features[name], threshold)
+            if probs is not None:
+                return probs, name
+        return features, None
+
+    def run_concurrent(self, x, threshold):
+        # The three backbones only read the shared input batch, and torch ops release the GIL,
+        # so the branches overlap on separate threads. torch.jit.fork is synchronous in eager mode.
+        cancel = threading.Event()
+        futures = {self.executor.submit(self.run_branch, name, x, cancel): name for name in BRANCHES}
+        features, exited, answer = {}, None, None
+        for done in as_completed(futures):
+            name = futures[done]
+            try:
+                features[name] = done.result()
+            except BranchCancelled:
+                continue
+            if exited is None:
+                probs = self.confident_exit(name, features[name], threshold)
+                if probs is not None:
+                    # Remaining branches stop at their next module boundary
+                    exited, answer = name, probs
+                    cancel.set()
+        if exited is not None:
+            return answer, exited
+        return features, None
+
+    def fit_branch_heads(self, features, labels, epochs=200, lr=1e-2, weight_decay=1e-4):
+        # Logistic-regression probes on cached fused features (N x 4352), split per branch;
+        # run offline by models/fit_fusion_heads.py, which saves them into the checkpoint
+        labels = torch.as_tensor(labels, dtype=torch.long)
+        start = 0
+        for name, (_, dim) in BRANCHES.items():
+            head = self.branch_heads[name]
+            x = torch.as_tensor(features[:, start:start + dim], dtype=torch.float32).to(head.weight.device)
+            optimizer = torch.optim.Adam(head.parameters(), lr=lr, weight_decay=weight_decay)
+            for _ in range(epochs):
+                optimizer.zero_grad()
+                F.cross_entropy(head(x), labels.to(x.device)).backward()
+                optimizer.step()
+            start += dim
+        self.branch_heads_fitted.fill_(True)
+
+def load_engine(path, device, num_classes=7):
+    engine = FusionEngine(num_classes=num_classes)
+    state = torch.load(path, map_location=device, weights_only=True)
+    # Plain FusionModelTimm checkpoints have no branch heads; early exit then stays off
+    missing, unexpected = engine.load_state_dict(state, strict=False)
+    missing = [key for key in missing if not key.startswith("branch_heads")]
+    if missing or unexpected:
+        raise RuntimeError(f"Fusion checkpoint mismatch: missing {missing}, unexpected {unexpected}")
+    return engine.to(device).eval()
@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from autotune import AUTOTUNE_CONFIG_PATH, MODEL_CHECKPOINT, apply_to_environment, available_cpus, load_config, quota_config, save_config, tune
+
+# Workers, torch threads and the sync batch size come from autotune.json, written offline by
+# `python autotune.py` on the serving machine type. When it has no result for this CPU quota,
+# the quota-derived fallback applies and when_ready tunes once (after bind, before any worker
+# is forked) and persists the result for the next start. AUTOTUNE=0 skips both the file and
+# the tuning; AUTOTUNE_ON_START=0 skips only the tuning. WEB_CONCURRENCY, TORCH_NUM_THREADS and
+# SYNC_MAX_BATCH_SIZE set by the deployment always win.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+explicit = {name for name in ("WEB_CONCURRENCY", "TORCH_NUM_THREADS", "SYNC_MAX_BATCH_SIZE") if name in os.environ}
+tuned = load_config() if os.environ.get("AUTOTUNE", "1") != "0" else None
+tune_on_start = tuned is None and os.environ.get("AUTOTUNE", "1") != "0" and os.environ.get("AUTOTUNE_ON_START", "1") != "0"
+config = tuned or quota_config()
+apply_to_environment(config, keep=explicit)
+workers = int(os.environ.get("WEB_CONCURRENCY", config["workers"]))
+
+def when_ready(server):
+    if not tune_on_start:
+        return
+    if not os.path.exists(MODEL_CHECKPOINT):
+        server.log.warning(f"[autotune] {MODEL_CHECKPOINT} not found, serving with {config}")
+        return
+    server.log.info(f"[autotune] tuning for {available_cpus()} CPUs before starting workers")
+    try:
+        result = tune(available_cpus(), MODEL_CHECKPOINT)
+        save_config(result, AUTOTUNE_CONFIG_PATH)
+    except (RuntimeError, OSError) as e:
+        server.log.warning(f"[autotune] tuning failed, serving with {config}: {e}")
+        return
+    server.log.info(f"[autotune] chose {result['config']} -> {AUTOTUNE_CONFIG_PATH}")
+    apply_to_environment(result["config"], keep=explicit)
+    if "WEB_CONCURRENCY" not in explicit:
+        server.num_workers = result["config"]["workers"]
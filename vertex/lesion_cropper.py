@@ -0,0 +1,97 @@
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+
+# ============================================================
+# 1. Bounding Boxes
+# ============================================================
+
+# Boxes are (x0, y0, x1, y1) as fractions of the image size, so a box found on
+# a 256x256 mask or a 16x16 prediction applies to the full-resolution photo.
+FULL_FRAME = (0.0, 0.0, 1.0, 1.0)
+
+def mask_to_bbox(mask, threshold=0.5, margin=0.1):
+    mask = np.asarray(mask) > threshold
+    rows, cols = np.flatnonzero(mask.any(axis=1)), np.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        return FULL_FRAME
+    h, w = mask.shape
+    y0, y1 = rows[0] / h, (rows[-1] + 1) / h
+    x0, x1 = cols[0] / w, (cols[-1] + 1) / w
+    # Keep some surrounding skin: the border is part of the ABCD criteria
+    dx, dy = margin * (x1 - x0), margin * (y1 - y0)
+    return (max(0.0, x0 - dx), max(0.0, y0 - dy), min(1.0, x1 + dx), min(1.0, y1 + dy))
+
+def crop_image(image, bbox):
+    w, h = image.size
+    x0, y0, x1, y1 = bbox
+    box = (int(x0 * w), int(y0 * h), max(int(np.ceil(x1 * w)), int(x0 * w) + 1), max(int(np.ceil(y1 * h)), int(y0 * h) + 1))
+    return image.crop(box)
+
+def bbox_iou(a, b):
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    x0, y0 = np.maximum(a[..., 0], b[..., 0]), np.maximum(a[..., 1], b[..., 1])
+    x1, y1 = np.minimum(a[..., 2], b[..., 2]), np.minimum(a[..., 3], b[..., 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area = lambda box: (box[..., 2] - box[..., 0]) * (box[..., 3] - box[..., 1])
+    return inter / np.maximum(area(a) + area(b) - inter, 1e-12)
+
+# ============================================================
+# 2. Mask Predictor
+# ============================================================
+
+# Three stride-2 stages on a 128x128 input predict a coarse 16x16 lesion mask.
+# A box only needs the mask's extent, so this is enough at ~40M multiply-adds
+# (about 0.3% of Inception-ResNet-v2 at 299x299).
+class MaskNet(nn.Module):
+    def __init__(self, width=16):
+        super(MaskNet, self).__init__()
+        layers, in_channels = [], 3
+        for channels in (width, width * 2, width * 4):
+            layers += [
+                nn.Conv2d(in_channels, channels, kernel_size=3, stride=2, padding=1),
+                nn.BatchNorm2d(channels),
+                nn.ReLU(inplace=True),
+                nn.Conv2d(channels, channels, kernel_size=3, padding=1),
+                nn.BatchNorm2d(channels),
+                nn.ReLU(inplace=True),
+            ]
+            in_channels = channels
+        self.features = nn.Sequential(*layers)
+        self.head = nn.Conv2d(in_channels, 1, kernel_size=1)
+
+    def forward(self, x):
+        return self.head(self.features(x))
+
+def to_mask_input(images, input_size):
+    batch = np.stack([np.asarray(image.convert("RGB").resize((input_size, input_size), Image.BILINEAR)) for image in images])
+    return (torch.from_numpy(batch).permute(0, 3, 1, 2).float() / 255.0 - 0.5) / 0.5
+
+class LesionCropper:
+    def __init__(self, path, device="cpu"):
+        checkpoint = torch.load(path, map_location=device, weights_only=True)
+        self.input_size = int(checkpoint["input_size"])
+        self.threshold = float(checkpoint["threshold"])
+        self.margin = float(checkpoint["margin"])
+        self.device = device
+        self.model = MaskNet(width=int(checkpoint["width"])).to(device)
+        self.model.load_state_dict(checkpoint["state_dict"])
+        self.model.eval()
+
+    def predict_bboxes(self, images):
+        with torch.no_grad():
+            masks = torch.sigmoid(self.model(to_mask_input(images, self.input_size).to(self.device)))[:, 0]
+        return [mask_to_bbox(mask, self.threshold, self.margin) for mask in masks.cpu().numpy()]
+
+    def crop(self, images):
+        return [crop_image(image, bbox) for image, bbox in zip(images, self.predict_bboxes(images))]
+
+def save_cropper(path, model, input_size, width, threshold=0.5, margin=0.1):
+    torch.save({
+        "state_dict": model.state_dict(),
+        "input_size": input_size,
+        "width": width,
+        "threshold": threshold,
+        "margin": margin,
+    }, path)
@@ -0,0 +1,174 @@
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+# ============================================================
+# 1. Schema
+# ============================================================
+
+# `lesions` holds one row per tracked lesion with the state needed to score
+# the next visit (previous and baseline embedding/probabilities) plus the
+# latest change scores. Scoring a visit reads and updates that single row,
+# and drift queries are index range scans on the score columns, so neither
+# touches the `visits` history.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lesions (
+    patient_id TEXT NOT NULL,
+    lesion_id TEXT NOT NULL,
+    visit_count INTEGER NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    baseline_embedding BLOB NOT NULL,
+    baseline_probs BLOB NOT NULL,
+    last_embedding BLOB NOT NULL,
+    last_probs BLOB NOT NULL,
+    last_drift REAL NOT NULL DEFAULT 0,
+    baseline_drift REAL NOT NULL DEFAULT 0,
+    max_drift REAL NOT NULL DEFAULT 0,
+    mel_shift REAL NOT NULL DEFAULT 0,
+    baseline_mel_shift REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (patient_id, lesion_id)
+);
+CREATE INDEX IF NOT EXISTS idx_lesions_last_drift ON lesions (last_drift);
+CREATE INDEX IF NOT EXISTS idx_lesions_baseline_drift ON lesions (baseline_drift);
+CREATE INDEX IF NOT EXISTS idx_lesions_max_drift ON lesions (max_drift);
+CREATE INDEX IF NOT EXISTS idx_lesions_mel_shift ON lesions (mel_shift);
+CREATE INDEX IF NOT EXISTS idx_lesions_baseline_mel_shift ON lesions (baseline_mel_shift);
+
+CREATE TABLE IF NOT EXISTS visits (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    patient_id TEXT NOT NULL,
+    lesion_id TEXT NOT NULL,
+    visit_index INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    probs BLOB NOT NULL,
+    drift REAL NOT NULL,
+    mel_shift REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_visits_lesion ON visits (patient_id, lesion_id, visit_index);
+"""
+
+DRIFT_METRICS = ["last_drift", "baseline_drift", "max_drift", "mel_shift", "baseline_mel_shift"]
+LESION_COLUMNS = ["patient_id", "lesion_id", "visit_count", "first_seen", "last_seen"] + DRIFT_METRICS
+
+# ============================================================
+# 2. Vector Helpers
+# ============================================================
+
+def to_blob(values):
+    return np.asarray(values, dtype=np.float32).tobytes()
+
+def from_blob(blob):
+    return np.frombuffer(blob, dtype=np.float32)
+
+def normalize(embedding):
+    embedding = np.asarray(embedding, dtype=np.float32).ravel()
+    return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+def cosine_drift(a, b):
+    # Both vectors are stored L2-normalized, so cosine distance is 1 - dot
+    return float(1.0 - np.dot(a, b))
+
+# ============================================================
+# 3. Lesion Tracker
+# ============================================================
+
+class LesionTracker:
+    def __init__(self, path, mel_index):
+        self.path = path
+        self.mel_index = mel_index
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def record_visit(self, patient_id, lesion_id, embedding, probs, timestamp=None):
+        embedding = normalize(embedding)
+        probs = np.asarray(probs, dtype=np.float32).ravel()
+        timestamp = timestamp or datetime.utcnow().isoformat()
+        key = (patient_id, lesion_id)
+
+        with self.connect() as conn:
+            # Serialize concurrent visits of the same store so visit_index stays consistent
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT visit_count, baseline_embedding, baseline_probs, last_embedding, last_probs, max_drift "
+                    "FROM lesions WHERE patient_id = ? AND lesion_id = ?",
+                    key,
+                ).fetchone()
+
+                if row is None:
+                    metrics = {"visit_index": 0, "last_drift": 0.0, "baseline_drift": 0.0, "max_drift": 0.0,
+                               "mel_shift": 0.0, "baseline_mel_shift": 0.0}
+                    conn.execute(
+                        "INSERT INTO lesions (patient_id, lesion_id, visit_count, first_seen, last_seen, "
+                        "baseline_embedding, baseline_probs, last_embedding, last_probs) VALUES (?, ?, 1, ?, ?, ?, ?, ?, ?)",
+                        (*key, timestamp, timestamp, to_blob(embedding), to_blob(probs), to_blob(embedding), to_blob(probs)),
+                    )
+                else:
+                    visit_count, baseline_embedding, baseline_probs, last_embedding, last_probs, max_drift = row
+                    last_drift = cosine_drift(from_blob(last_embedding), embedding)
+                    metrics = {
+                        "visit_index": visit_count,
+                        "last_drift": last_drift,
+                        "baseline_drift": cosine_drift(from_blob(baseline_embedding), embedding),
+                        "max_drift": max(max_drift, last_drift),
+                        "mel_shift": float(probs[self.mel_index] - from_blob(last_probs)[self.mel_index]),
+                        "baseline_mel_shift": float(probs[self.mel_index] - from_blob(baseline_probs)[self.mel_index]),
+                    }
+                    conn.execute(
+                        "UPDATE lesions SET visit_count = visit_count + 1, last_seen = ?, last_embedding = ?, last_probs = ?, "
+                        "last_drift = ?, baseline_drift = ?, max_drift = ?, mel_shift = ?, baseline_mel_shift = ? "
+                        "WHERE patient_id = ? AND lesion_id = ?",
+                        (timestamp, to_blob(embedding), to_blob(probs), *(metrics[m] for m in DRIFT_METRICS), *key),
+                    )
+
+                conn.execute(
+                    "INSERT INTO visits (patient_id, lesion_id, visit_index, timestamp, embedding, probs, drift, mel_shift) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (*key, metrics["visit_index"], timestamp, to_blob(embedding), to_blob(probs),
+                     metrics["last_drift"], metrics["mel_shift"]),
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return metrics
+
+    def flagged_lesions(self, threshold, metric="last_drift", limit=100):
+        if metric not in DRIFT_METRICS:
+            raise ValueError(f"Unknown drift metric '{metric}', expected one of {DRIFT_METRICS}")
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(LESION_COLUMNS)} FROM lesions WHERE {metric} >= ? ORDER BY {metric} DESC LIMIT ?",
+                (threshold, limit),
+            ).fetchall()
+        return [dict(zip(LESION_COLUMNS, row)) for row in rows]
+
+    def history(self, patient_id, lesion_id, labels):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT visit_index, timestamp, probs, drift, mel_shift FROM visits "
+                "WHERE patient_id = ? AND lesion_id = ? ORDER BY visit_index",
+                (patient_id, lesion_id),
+            ).fetchall()
+        return [
+            {
+                "visit_index": visit_index,
+                "timestamp": timestamp,
+                "probabilities": dict(zip(labels, from_blob(probs).tolist())),
+                "drift": drift,
+                "mel_shift": mel_shift,
+            }
+            for visit_index, timestamp, probs, drift, mel_shift in rows
+        ]
@@ -0,0 +1,148 @@
+import copy
+from collections import namedtuple
+import torch
+import torch.nn as nn
+
+# ============================================================
+# 1. Prunable Channels of Inception-ResNet-v2
+# ============================================================
+
+# Block35/Block17/Block8 stages of timm's inception_resnet_v2. Each block adds
+# conv2d(cat(branches)) to its input, so the residual width is left alone and
+# only channels inside the branches are removed: the output channels of a
+# BasicConv2d plus the matching input channels of whatever consumes them (the
+# next conv of the branch, or the block's 1x1 up-projection for the last one).
+RESIDUAL_STAGES = ("repeat", "repeat_1", "repeat_2", "block8")
+MIN_CHANNELS = 8
+
+PruneUnit = namedtuple("PruneUnit", ["name", "layer", "consumer", "consumer_attr", "offset"])
+
+def residual_blocks(base_model):
+    for stage_name in RESIDUAL_STAGES:
+        stage = getattr(base_model, stage_name)
+        if isinstance(stage, nn.Sequential):
+            for i, block in enumerate(stage):
+                yield f"{stage_name}.{i}", block
+        else:
+            yield stage_name, stage
+
+def branch_chains(block):
+    chains = []
+    for name in ("branch0", "branch1", "branch2"):
+        branch = getattr(block, name, None)
+        if branch is not None:
+            chains.append((name, list(branch) if isinstance(branch, nn.Sequential) else [branch]))
+    return chains
+
+def prunable_units(base_model):
+    # Offsets into the concatenated branch outputs reflect the current (possibly pruned) widths
+    units = []
+    for block_name, block in residual_blocks(base_model):
+        offset = 0
+        for branch_name, chain in branch_chains(block):
+            for i, layer in enumerate(chain):
+                name = f"{block_name}.{branch_name}" + (f".{i}" if len(chain) > 1 else "")
+                if i + 1 < len(chain):
+                    units.append(PruneUnit(name, layer, chain[i + 1], "conv", 0))
+                else:
+                    units.append(PruneUnit(name, layer, block, "conv2d", offset))
+            offset += chain[-1].conv.out_channels
+    return units
+
+# ============================================================
+# 2. Structural Surgery
+# ============================================================
+
+# Layers are copied and their tensors sliced rather than rebuilt, so subclasses survive:
+# timm >= 0.9 uses BatchNormAct2d (an nn.BatchNorm2d that applies the ReLU in its forward)
+# and may use padding-aware Conv2d variants.
+def slice_conv(conv, out_keep=None, in_keep=None):
+    new_conv = copy.deepcopy(conv)
+    weight = conv.weight.data
+    if out_keep is not None:
+        weight = weight[out_keep]
+        if conv.bias is not None:
+            new_conv.bias = nn.Parameter(conv.bias.data[out_keep].clone())
+    if in_keep is not None:
+        weight = weight[:, in_keep]
+    new_conv.weight = nn.Parameter(weight.clone())
+    new_conv.out_channels = weight.shape[0]
+    new_conv.in_channels = weight.shape[1] * conv.groups
+    return new_conv
+
+def slice_batchnorm(bn, keep):
+    new_bn = copy.deepcopy(bn)
+    new_bn.num_features = len(keep)
+    for name in ("weight", "bias"):
+        if getattr(bn, name) is not None:
+            setattr(new_bn, name, nn.Parameter(getattr(bn, name).data[keep].clone()))
+    for name in ("running_mean", "running_var"):
+        if getattr(bn, name) is not None:
+            setattr(new_bn, name, getattr(bn, name)[keep].clone())
+    return new_bn
+
+def select_out_channels(conv, bn, keep):
+    return slice_conv(conv, out_keep=keep), slice_batchnorm(bn, keep)
+
+def select_in_channels(conv, keep):
+    return slice_conv(conv, in_keep=keep)
+
+def prune_unit(unit, keep):
+    # keep: sorted indices of the unit's output channels that survive
+    keep = torch.as_tensor(sorted(keep), dtype=torch.long, device=unit.layer.conv.weight.device)
+    width = unit.layer.conv.out_channels
+    unit.layer.conv, unit.layer.bn = select_out_channels(unit.layer.conv, unit.layer.bn, keep)
+    consumer = getattr(unit.consumer, unit.consumer_attr)
+    consumer_keep = torch.cat([
+        torch.arange(unit.offset, device=keep.device),
+        unit.offset + keep,
+        torch.arange(unit.offset + width, consumer.in_channels, device=keep.device),
+    ])
+    setattr(unit.consumer, unit.consumer_attr, select_in_channels(consumer, consumer_keep))
+
+def apply_pruning(base_model, plan):
+    # plan: {unit name: kept channel indices}. Units are re-enumerated after every cut so
+    # the concat offsets of later branches follow the already-pruned widths.
+    for name, keep in plan.items():
+        unit = next(u for u in prunable_units(base_model) if u.name == name)
+        if len(keep) < unit.layer.conv.out_channels:
+            prune_unit(unit, keep)
+
+def channel_counts(base_model):
+    return {unit.name: unit.layer.conv.out_channels for unit in prunable_units(base_model)}
+
+def check_surgery(model, x, atol=1e-5):
+    # Cutting every unit while keeping all of its channels must not change the outputs;
+    # catches layers (e.g. fused norm + activation) that the surgery fails to carry over
+    rebuilt = copy.deepcopy(model).eval()
+    for unit in prunable_units(rebuilt.base_model):
+        prune_unit(unit, range(unit.layer.conv.out_channels))
+    with torch.no_grad():
+        max_diff = (model.eval()(x) - rebuilt(x)).abs().max().item()
+    if max_diff > atol:
+        raise RuntimeError(f"Channel surgery changed the model outputs (max abs diff {max_diff:.2e})")
+    return max_diff
+
+# ============================================================
+# 3. Loading Pruned Checkpoints
+# ============================================================
+
+def set_submodule(model, name, module):
+    parent_name, _, attr = name.rpartition(".")
+    setattr(model.get_submodule(parent_name) if parent_name else model, attr, module)
+
+def resize_to_state_dict(model, state_dict):
+    # Rebuild convs/BNs whose checkpoint shapes are smaller (pruned), so a pruned
+    # checkpoint loads into the unpruned architecture with plain load_state_dict
+    for name, module in list(model.named_modules()):
+        weight = state_dict.get(f"{name}.weight")
+        if weight is None or not hasattr(module, "weight") or weight.shape == module.weight.shape:
+            continue
+        # Checkpoint values overwrite the sliced ones in load_state_dict
+        device = module.weight.device
+        if isinstance(module, nn.Conv2d):
+            out_keep, in_keep = torch.arange(weight.shape[0], device=device), torch.arange(weight.shape[1], device=device)
+            set_submodule(model, name, slice_conv(module, out_keep, in_keep))
+        elif isinstance(module, nn.BatchNorm2d):
+            set_submodule(model, name, slice_batchnorm(module, torch.arange(weight.shape[0], device=device)))
+    return model
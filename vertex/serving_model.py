@@ -0,0 +1,64 @@
+import torch
+import torch.nn as nn
+import timm
+from soft_attention import SoftAttention2d
+from pruning import resize_to_state_dict
+
+# The served architecture, shared by app.py, models/IRv2.py, models/prune_irv2.py, autotune.py
+# and the benchmarks. Importing this module loads no weights.
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+# Class order of the served checkpoints (models/IRv2.py trains in this order too)
+LABELS = ["nv", "mel", "bkl", "bcc", "akiec", "vasc", "df"]
+NUM_CLASSES = len(LABELS)
+IMG_SIZE = 299
+
+# ============================================================
+# 2. Inception-ResNet-v2 + Soft Attention
+# ============================================================
+
+class InceptionResNetV2_SoftAttention(nn.Module):
+    def __init__(self, num_classes=NUM_CLASSES, dropout_p=0.5, img_size=IMG_SIZE, pretrained=False):
+        super(InceptionResNetV2_SoftAttention, self).__init__()
+        self.num_classes = num_classes
+        self.base_model = timm.create_model("inception_resnet_v2", pretrained=pretrained, num_classes=0, global_pool="")
+        self.soft_attention = SoftAttention2d(1536, heads=16, aggregate=True)
+        self.pool = nn.MaxPool2d(kernel_size=2, stride=2, padding=1)
+        self.relu = nn.ReLU()
+        self.dropout = nn.Dropout(dropout_p)
+        # The head's width depends on the input size (8x8 features at 299, 5x5 at 224)
+        self.base_model.eval()
+        with torch.no_grad():
+            pooled = self.pool(self.base_model.forward_features(torch.zeros(1, 3, img_size, img_size)))
+        self.base_model.train()
+        self.fc = nn.Linear(2 * pooled[0].numel(), num_classes)
+
+    def forward(self, x, return_embedding=False, return_attention=False):
+        features = self.base_model.forward_features(x)
+        attn_features, attn_maps = self.soft_attention(features, return_maps=True)
+        pooled_features = self.pool(features)
+        pooled_attn = self.pool(attn_features)
+        combined = torch.cat([pooled_features, pooled_attn], dim=1)
+        activated = self.relu(combined)
+        dropped = self.dropout(activated)
+        flat = torch.flatten(dropped, 1)
+        out = self.fc(flat)
+        extras = ()
+        if return_embedding:
+            # 1536-dim embedding: pooled attention features averaged over space
+            extras += (pooled_attn.mean(dim=(2, 3)),)
+        if return_attention:
+            # (batch, 1, h, w) SoftAttention map, for explanations (see explain.py)
+            extras += (attn_maps,)
+        return (out,) + extras if extras else out
+
+def load_serving_model(path, device, img_size=IMG_SIZE, num_classes=NUM_CLASSES):
+    # Full or channel-pruned checkpoints (models/prune_irv2.py); layers are resized to the
+    # checkpoint before a strict load_state_dict
+    model = InceptionResNetV2_SoftAttention(num_classes=num_classes, img_size=img_size)
+    state_dict = torch.load(path, map_location="cpu", weights_only=True)
+    resize_to_state_dict(model, state_dict).load_state_dict(state_dict)
+    return model.to(device)
@@ -0,0 +1,231 @@
+import os
+import argparse
+import time
+import numpy as np
+
+# ============================================================
+# 1. Vector Helpers
+# ============================================================
+
+def l2_normalize(x):
+    x = np.atleast_2d(np.asarray(x, dtype=np.float32))
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-12)
+
+def assign_nearest(x, centroids, chunk_size=8192):
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), chunk_size):
+        chunk = x[start:start + chunk_size]
+        dists = centroid_norms[None, :] - 2.0 * chunk @ centroids.T
+        assign[start:start + chunk_size] = dists.argmin(axis=1)
+    return assign
+
+def kmeans(x, k, n_iter=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = assign_nearest(x, centroids)
+        counts = np.bincount(assign, minlength=k)
+        order = np.argsort(assign, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.add.reduceat(x[order], starts[nonempty], axis=0)
+        centroids[nonempty] = sums / counts[nonempty, None]
+        # Re-seed empty clusters so every list stays usable
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), size=len(empty), replace=False)]
+    return centroids.astype(np.float32)
+
+# ============================================================
+# 2. IVF-PQ Index
+# ============================================================
+
+# Vectors are L2-normalized, routed to the nearest of `nlist` coarse centroids
+# and stored as `m` uint8 codes of their residual (1536 floats -> 64 bytes).
+# A query only scores the codes of the `nprobe` closest lists.
+class IVFPQIndex:
+    def __init__(self, dim, nlist=None, m=64, ksub=256):
+        if dim % m != 0:
+            raise ValueError(f"Embedding dim {dim} is not divisible by m={m}")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.dsub = dim // m
+        self.ksub = ksub
+        self.centroids = None
+        self.codebooks = None
+        self.codebook_norms = None
+        self.codes = np.empty((0, m), dtype=np.uint8)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.list_offsets = None
+        self.metadata = {}
+
+    def train(self, x, n_iter=20, seed=0):
+        x = l2_normalize(x)
+        if self.nlist is None:
+            self.nlist = max(1, int(4 * np.sqrt(len(x))))
+        self.nlist = min(self.nlist, len(x))
+        self.ksub = min(self.ksub, len(x))
+        self.centroids = kmeans(x, self.nlist, n_iter=n_iter, seed=seed)
+
+        residuals = x - self.centroids[assign_nearest(x, self.centroids)]
+        residuals = residuals.reshape(len(x), self.m, self.dsub)
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(residuals[:, j]), self.ksub, n_iter=n_iter, seed=seed + j)
+            for j in range(self.m)
+        ])
+        self.codebook_norms = (self.codebooks ** 2).sum(axis=-1)
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        return self
+
+    def encode(self, residuals):
+        residuals = residuals.reshape(len(residuals), self.m, self.dsub)
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign_nearest(residuals[:, j], self.codebooks[j])
+        return codes
+
+    def add(self, x, ids=None):
+        x = l2_normalize(x)
+        if ids is None:
+            ids = np.arange(len(self.ids), len(self.ids) + len(x), dtype=np.int64)
+        lists = assign_nearest(x, self.centroids)
+        codes = self.encode(x - self.centroids[lists])
+
+        # Keep codes grouped by list (CSR layout) so a probe is one slice
+        old_lists = np.repeat(np.arange(self.nlist), np.diff(self.list_offsets))
+        all_lists = np.concatenate([old_lists, lists])
+        order = np.argsort(all_lists, kind="stable")
+        self.codes = np.concatenate([self.codes, codes])[order]
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])[order]
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(all_lists, minlength=self.nlist))])
+
+    def search(self, queries, k=5, nprobe=16):
+        queries = l2_normalize(queries)
+        nprobe = min(nprobe, self.nlist)
+        all_distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        all_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        subspaces = np.arange(self.m)
+
+        for qi, q in enumerate(queries):
+            coarse = ((self.centroids - q) ** 2).sum(axis=1)
+            probes = np.argpartition(coarse, nprobe - 1)[:nprobe]
+
+            # Distance tables: ||r_j - c_jk||^2 for every probe, subspace and code
+            residuals = (q[None, :] - self.centroids[probes]).reshape(nprobe, self.m, self.dsub)
+            cross = np.matmul(residuals.transpose(1, 0, 2), self.codebooks.transpose(0, 2, 1)).transpose(1, 0, 2)
+            tables = (residuals ** 2).sum(axis=-1)[..., None] - 2.0 * cross + self.codebook_norms[None]
+
+            starts = self.list_offsets[probes]
+            lengths = self.list_offsets[probes + 1] - starts
+            total = lengths.sum()
+            if total == 0:
+                continue
+            probe_idx = np.repeat(np.arange(nprobe), lengths)
+            rows = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) + np.arange(total)
+
+            dists = tables[probe_idx[:, None], subspaces[None, :], self.codes[rows]].sum(axis=1)
+            top = min(k, total)
+            best = np.argpartition(dists, top - 1)[:top]
+            best = best[np.argsort(dists[best])]
+            all_distances[qi, :top] = dists[best]
+            all_ids[qi, :top] = self.ids[rows[best]]
+
+        return all_distances, all_ids
+
+    def save(self, path):
+        arrays = {
+            "config": np.array([self.dim, self.nlist, self.m, self.ksub], dtype=np.int64),
+            "centroids": self.centroids,
+            "codebooks": self.codebooks,
+            "codes": self.codes,
+            "ids": self.ids,
+            "list_offsets": self.list_offsets,
+        }
+        for key, values in self.metadata.items():
+            arrays[f"meta_{key}"] = np.asarray(values)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dim, nlist, m, ksub = (int(v) for v in data["config"])
+        index = cls(dim, nlist=nlist, m=m, ksub=ksub)
+        index.centroids = data["centroids"]
+        index.codebooks = data["codebooks"]
+        index.codebook_norms = (index.codebooks ** 2).sum(axis=-1)
+        index.codes = data["codes"]
+        index.ids = data["ids"]
+        index.list_offsets = data["list_offsets"]
+        index.metadata = {key[len("meta_"):]: data[key] for key in data.files if key.startswith("meta_")}
+        return index
+
+    def __len__(self):
+        return len(self.ids)
+
+# ============================================================
+# 3. Building the HAM10000 Reference Index
+# ============================================================
+
+def extract_embeddings(metadata_file, images_folder, batch_size=32):
+    import pandas as pd
+    import torch
+    from PIL import Image
+    from app import model, test_transform, DEVICE
+
+    metadata = pd.read_csv(metadata_file)
+    image_ids = metadata["image_id"].to_numpy()
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(image_ids), batch_size):
+            batch = [
+                test_transform(image=np.array(Image.open(os.path.join(images_folder, f"{img_id}.jpg")).convert("RGB")))["image"]
+                for img_id in image_ids[start:start + batch_size]
+            ]
+            _, embedding = model(torch.stack(batch).to(DEVICE), return_embedding=True)
+            embeddings.append(embedding.cpu().numpy())
+            print(f"Embedded {min(start + batch_size, len(image_ids))}/{len(image_ids)} images")
+    return np.concatenate(embeddings), image_ids, metadata["dx"].to_numpy()
+
+def benchmark_search(num_vectors=100000, dim=1536, num_queries=200, k=5, nprobe=16):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((num_vectors, dim), dtype=np.float32)
+    index = IVFPQIndex(dim).train(vectors[:20000], n_iter=10)
+    index.add(vectors)
+    queries = vectors[rng.choice(num_vectors, size=num_queries, replace=False)]
+
+    latencies = []
+    for q in queries:
+        start = time.perf_counter()
+        index.search(q, k=k, nprobe=nprobe)
+        latencies.append((time.perf_counter() - start) * 1000)
+    print(f"{len(index)} vectors, nlist={index.nlist}, nprobe={nprobe}: "
+          f"p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms")
+
+def main():
+    base_path = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    parser = argparse.ArgumentParser(description="Build the IVF-PQ similarity index over HAM10000 embeddings.")
+    parser.add_argument("--metadata", default=os.path.join(base_path, "HAM10000", "HAM10000_metadata"))
+    parser.add_argument("--images", default=os.path.join(base_path, "HAM10000", "HAM10000_images"))
+    parser.add_argument("--output", default="similarity_index.npz")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--m", type=int, default=64)
+    parser.add_argument("--benchmark", action="store_true", help="Time queries on 100k synthetic vectors instead.")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark_search()
+        return
+
+    embeddings, image_ids, dx = extract_embeddings(args.metadata, args.images, args.batch_size)
+    index = IVFPQIndex(embeddings.shape[1], nlist=args.nlist, m=args.m).train(embeddings)
+    index.add(embeddings)
+    index.metadata = {"image_id": image_ids.astype(str), "dx": dx.astype(str)}
+    index.save(args.output)
+    print(f"Index with {len(index)} vectors saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
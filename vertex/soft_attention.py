@@ -0,0 +1,73 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+# ============================================================
+# Soft Attention (Conv3d formulation, as trained in irv2-sa.ipynb)
+# ============================================================
+
+class SoftAttention(nn.Module):
+    def __init__(self, channels, heads, aggregate=True, concat_with_x=False):
+        super(SoftAttention, self).__init__()
+        self.channels = channels
+        self.multiheads = heads
+        self.aggregate_channels = aggregate
+        self.concat_input_with_scaled = concat_with_x
+        self.conv = nn.Conv3d(1, heads, kernel_size=(channels, 3, 3), padding=(0, 1, 1), bias=True)
+
+    def forward(self, x, return_maps=False):
+        b, c, h, w = x.shape
+        x_exp = x.unsqueeze(1)
+        conv3d = self.conv(x_exp).squeeze(2)
+        attn_maps = F.softmax(conv3d.view(b, self.multiheads, -1), dim=-1).view(b, self.multiheads, h, w)
+        if self.aggregate_channels:
+            attn_maps = attn_maps.sum(dim=1, keepdim=True)
+            x_out = x * attn_maps
+        else:
+            x_out = x * attn_maps.unsqueeze(1)
+        if self.concat_input_with_scaled:
+            x_out = torch.cat([x_out, x], dim=1)
+        return (x_out, attn_maps) if return_maps else x_out
+
+# ============================================================
+# Soft Attention (equivalent Conv2d formulation)
+# ============================================================
+
+# A Conv3d over the unsqueezed (1, C, H, W) map whose kernel spans all C
+# channels is a plain C -> heads 3x3 Conv2d, which runs on the much faster
+# 2-D kernels. Conv3d checkpoints load by dropping the singleton in-channel.
+class SoftAttention2d(nn.Module):
+    def __init__(self, channels, heads, aggregate=True, concat_with_x=False):
+        super(SoftAttention2d, self).__init__()
+        self.channels = channels
+        self.multiheads = heads
+        self.aggregate_channels = aggregate
+        self.concat_input_with_scaled = concat_with_x
+        self.conv = nn.Conv2d(channels, heads, kernel_size=3, padding=1, bias=True)
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        weight = state_dict.get(prefix + "conv.weight")
+        if weight is not None and weight.dim() == 5:
+            # (heads, 1, channels, 3, 3) -> (heads, channels, 3, 3)
+            state_dict[prefix + "conv.weight"] = weight.squeeze(1)
+        super(SoftAttention2d, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    @classmethod
+    def from_conv3d(cls, module):
+        converted = cls(module.channels, module.multiheads, module.aggregate_channels, module.concat_input_with_scaled)
+        converted.load_state_dict(module.state_dict())
+        return converted.to(module.conv.weight.device)
+
+    def forward(self, x, return_maps=False):
+        b, c, h, w = x.shape
+        conv2d = self.conv(x)
+        attn_maps = F.softmax(conv2d.view(b, self.multiheads, -1), dim=-1).view(b, self.multiheads, h, w)
+        if self.aggregate_channels:
+            attn_maps = attn_maps.sum(dim=1, keepdim=True)
+            x_out = x * attn_maps
+        else:
+            x_out = x * attn_maps.unsqueeze(1)
+        if self.concat_input_with_scaled:
+            x_out = torch.cat([x_out, x], dim=1)
+        # The maps are computed either way; returning them costs nothing (see vertex/explain.py)
+        return (x_out, attn_maps) if return_maps else x_out
@@ -0,0 +1,210 @@
+import os
+import json
+import sqlite3
+from contextlib import contextmanager
+from flask import Flask, g, request, jsonify
+from app import predict_batch, decode_image, deadline_exceeded, start_deadline
+from deadlines import DeadlineExceeded, record_shed, shed_counts
+
+sync_app = Flask(__name__)
+sync_app.before_request(start_deadline)
+sync_app.register_error_handler(DeadlineExceeded, deadline_exceeded)
+
+# ============================================================
+# 1. Settings
+# ============================================================
+
+SYNC_DB_PATH = os.environ.get("SYNC_DB_PATH", "sync.db")
+MAX_BATCH_SIZE = int(os.environ.get("SYNC_MAX_BATCH_SIZE", "16"))
+MAX_UPLOAD_ITEMS = int(os.environ.get("SYNC_MAX_UPLOAD_ITEMS", "256"))
+DEFAULT_PAGE_SIZE = 200
+
+# ============================================================
+# 2. Server-side Prediction Store
+# ============================================================
+
+# `seq` is a global, monotonically increasing change number. A device's sync
+# cursor is the last `seq` it has seen, so "what changed since X" is a range
+# scan on the (device_id, seq) index rather than a full history fetch.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    device_id TEXT NOT NULL,
+    lesion_id TEXT NOT NULL,
+    client_id TEXT NOT NULL,
+    prediction TEXT,
+    confidence TEXT,
+    timestamp TEXT,
+    processing_time TEXT,
+    details TEXT,
+    UNIQUE (device_id, client_id)
+);
+CREATE INDEX IF NOT EXISTS idx_predictions_device_seq ON predictions (device_id, seq);
+CREATE INDEX IF NOT EXISTS idx_predictions_device_lesion ON predictions (device_id, lesion_id, seq);
+"""
+
+COLUMNS = ["seq", "device_id", "lesion_id", "client_id", "prediction", "confidence", "timestamp", "processing_time", "details"]
+
+class SyncStore:
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def known_client_ids(self, device_id, client_ids):
+        if not client_ids:
+            return set()
+        placeholders = ",".join("?" * len(client_ids))
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT client_id FROM predictions WHERE device_id = ? AND client_id IN ({placeholders})",
+                [device_id, *client_ids],
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def insert_results(self, device_id, items, results):
+        rows = [
+            (device_id, item["lesion_id"], item["client_id"], result["prediction"], result["confidence"],
+             result["timestamp"], result["processing_time"], json.dumps(result["detailed_predictions"]))
+            for item, result in zip(items, results)
+        ]
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO predictions (device_id, lesion_id, client_id, prediction, confidence, "
+                "timestamp, processing_time, details) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def changes_since(self, device_id, cursor, limit=DEFAULT_PAGE_SIZE):
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM predictions WHERE device_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (device_id, cursor, limit + 1),
+            ).fetchall()
+        has_more = len(rows) > limit
+        changes = [dict(zip(COLUMNS, row)) for row in rows[:limit]]
+        next_cursor = changes[-1]["seq"] if changes else cursor
+        return changes, next_cursor, has_more
+
+    def lesion_history(self, device_id, lesion_id):
+        with self.connect() as conn:
+            rows = conn.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM predictions WHERE device_id = ? AND lesion_id = ? ORDER BY seq",
+                (device_id, lesion_id),
+            ).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+store = SyncStore(SYNC_DB_PATH)
+
+# ============================================================
+# 3. Batched Inference
+# ============================================================
+
+def score_items(items, deadline):
+    # Items not scored before the upload's deadline are returned as errors; the device
+    # re-uploads them later and already-synced client_ids are skipped then. Each chunk is
+    # decoded right before its batch, so at most MAX_BATCH_SIZE decoded photos are held at once.
+    results, errors = [], []
+    for start in range(0, len(items), MAX_BATCH_SIZE):
+        chunk = []
+        for item in items[start:start + MAX_BATCH_SIZE]:
+            if deadline.expired():
+                record_shed("before_model")
+                errors.append({"client_id": item.get("client_id"), "error": "Request deadline exceeded"})
+                continue
+            try:
+                chunk.append((item, decode_image(item["image"])))
+            except Exception as e:
+                errors.append({"client_id": item.get("client_id"), "error": f"Error processing image: {str(e)}"})
+        if not chunk:
+            continue
+        batch_results = predict_batch([image for _, image in chunk], deadlines=[deadline] * len(chunk))
+        for (item, _), result in zip(chunk, batch_results):
+            if result is None:
+                errors.append({"client_id": item.get("client_id"), "error": "Request deadline exceeded"})
+            else:
+                results.append((item, result))
+    return results, errors
+
+# ============================================================
+# 4. Routes
+# ============================================================
+
+def parse_cursor(value):
+    try:
+        return max(int(value or 0), 0)
+    except (TypeError, ValueError):
+        return None
+
+@sync_app.route("/sync/upload", methods=["POST"])
+def upload_endpoint():
+    data = request.get_json()
+    if not data or not data.get("device_id") or "items" not in data:
+        return jsonify({"error": "device_id and items are required."}), 400
+    items = data["items"]
+    if not isinstance(items, list) or any(not isinstance(item, dict) for item in items):
+        return jsonify({"error": "items must be a list of objects."}), 400
+    if len(items) > MAX_UPLOAD_ITEMS:
+        return jsonify({"error": f"At most {MAX_UPLOAD_ITEMS} items per upload."}), 413
+    if any(not item.get("client_id") or not item.get("lesion_id") or not item.get("image") for item in items):
+        return jsonify({"error": "Every item needs client_id, lesion_id and image."}), 400
+    # The id columns have TEXT affinity (an inserted 5 reads back as '5'), so ids are compared as strings
+    items = [dict(item, client_id=str(item["client_id"]), lesion_id=str(item["lesion_id"])) for item in items]
+    cursor = parse_cursor(data.get("cursor"))
+    if cursor is None:
+        return jsonify({"error": "cursor must be an integer."}), 400
+
+    device_id = str(data["device_id"])
+    # Re-uploads of already-synced photos are skipped before inference
+    known = store.known_client_ids(device_id, [item["client_id"] for item in items])
+    pending = [item for item in items if item["client_id"] not in known]
+
+    scored, errors = score_items(pending, g.deadline)
+    store.insert_results(device_id, [item for item, _ in scored], [result for _, result in scored])
+
+    changes, next_cursor, has_more = store.changes_since(device_id, cursor)
+    return jsonify({
+        "accepted": len(scored),
+        "skipped": len(known),
+        "shed": sum(error["error"] == "Request deadline exceeded" for error in errors),
+        "errors": errors,
+        "changes": changes,
+        "cursor": next_cursor,
+        "has_more": has_more,
+    })
+
+@sync_app.route("/sync/changes", methods=["GET"])
+def changes_endpoint():
+    device_id = request.args.get("device_id")
+    cursor = parse_cursor(request.args.get("cursor"))
+    limit = parse_cursor(request.args.get("limit", DEFAULT_PAGE_SIZE))
+    if not device_id or cursor is None or not limit:
+        return jsonify({"error": "device_id, an integer cursor and a positive limit are required."}), 400
+    limit = min(limit, 1000)
+
+    changes, next_cursor, has_more = store.changes_since(device_id, cursor, limit)
+    return jsonify({"changes": changes, "cursor": next_cursor, "has_more": has_more})
+
+@sync_app.route("/sync/lesions/<lesion_id>", methods=["GET"])
+def lesion_endpoint(lesion_id):
+    device_id = request.args.get("device_id")
+    if not device_id:
+        return jsonify({"error": "device_id is required."}), 400
+    return jsonify({"lesion_id": lesion_id, "history": store.lesion_history(device_id, lesion_id)})
+
+@sync_app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok", "shed": shed_counts()}), 200
+
+if __name__ == '__main__':
+    sync_app.run(host="0.0.0.0", port=8081)